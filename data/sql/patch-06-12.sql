@@ -0,0 +1,4 @@
+-- Used by the payment flow history to read only the requested interval
+
+CREATE INDEX payment_due_date_idx ON payment (due_date);
+CREATE INDEX payment_paid_date_idx ON payment (paid_date);
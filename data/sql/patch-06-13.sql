@@ -0,0 +1,47 @@
+-- The confirmed sales aggregated by day, branch, salesperson and sellable,
+-- used by the sold items searches and reports. This is derived from the
+-- sale items and is not synchronized, so there is no te_id here.
+
+CREATE TABLE sale_summary (
+    id serial NOT NULL PRIMARY KEY,
+    date timestamp NOT NULL,
+    branch_id uuid NOT NULL REFERENCES branch(id)
+        ON UPDATE CASCADE ON DELETE CASCADE,
+    salesperson_id uuid REFERENCES sales_person(id)
+        ON UPDATE CASCADE ON DELETE CASCADE,
+    sellable_id uuid NOT NULL REFERENCES sellable(id)
+        ON UPDATE CASCADE ON DELETE CASCADE,
+    quantity numeric(20, 3) NOT NULL,
+    total_sold numeric(20, 2) NOT NULL,
+    total_cost numeric(20, 2) NOT NULL
+);
+
+CREATE INDEX sale_summary_date_branch_id_idx ON sale_summary (date, branch_id);
+CREATE INDEX sale_summary_sellable_id_idx ON sale_summary (sellable_id);
+
+-- When the summary was last caught up with the sales modified outside
+-- of the domain (e.g. by the synchronization)
+CREATE TABLE sale_summary_refresh (
+    id serial NOT NULL PRIMARY KEY,
+    refresh_time timestamp NOT NULL
+);
+
+-- Used to find the sales of the days being refreshed. The ones modified
+-- since the last refresh are found through transaction_entry_te_time_idx,
+-- created by patch-06-15
+CREATE INDEX sale_confirm_date_idx ON sale (confirm_date);
+
+INSERT INTO sale_summary (date, branch_id, salesperson_id, sellable_id,
+                          quantity, total_sold, total_cost)
+    SELECT DATE(sale.confirm_date), sale.branch_id, sale.salesperson_id,
+           sale_item.sellable_id, SUM(sale_item.quantity),
+           SUM(ROUND(sale_item.price * sale_item.quantity, 2)),
+           SUM(ROUND(sale_item.quantity * sale_item.average_cost, 2))
+    FROM sale_item
+    JOIN sale ON sale.id = sale_item.sale_id
+    WHERE sale.status IN ('confirmed', 'renegotiated') AND
+          sale.confirm_date IS NOT NULL
+    GROUP BY DATE(sale.confirm_date), sale.branch_id, sale.salesperson_id,
+             sale_item.sellable_id;
+
+INSERT INTO sale_summary_refresh (refresh_time) VALUES (TRANSACTION_TIMESTAMP());
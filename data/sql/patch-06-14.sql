@@ -0,0 +1,8 @@
+-- There must be only one sale_summary row per day, branch, salesperson and
+-- sellable. The salesperson is optional, so it is coalesced to a fixed
+-- uuid that is never used by any of them.
+
+CREATE UNIQUE INDEX sale_summary_key_idx ON sale_summary (
+    date, branch_id,
+    COALESCE(salesperson_id, '00000000-0000-0000-0000-000000000000'),
+    sellable_id);
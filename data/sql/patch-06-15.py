@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+
+# Note to whoever will create schema-07 or new domain tables: they should
+# have the te_removal_trigger too, or the search results cached by
+# stoqlib.database.queryexecuter.SearchResultCache will not notice when
+# their rows are removed.
+
+index_query = """
+-- Used to find the transaction entries modified since a given time
+CREATE INDEX IF NOT EXISTS transaction_entry_te_time_idx
+    ON transaction_entry (te_time);
+"""
+
+function_query = """
+-- Removing rows leaves no transaction entry behind, so register the
+-- removal on a new one, already marked as synchronized since there is
+-- no row to synchronize
+CREATE OR REPLACE FUNCTION register_te_removal() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO transaction_entry (te_time, sync_status, metadata)
+        VALUES (STATEMENT_TIMESTAMP(), 1::bit,
+                jsonb_build_object('removed_from', TG_TABLE_NAME));
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+trigger_query = """
+CREATE TRIGGER te_removal_trigger
+    AFTER DELETE ON {table}
+    FOR EACH STATEMENT
+    EXECUTE PROCEDURE register_te_removal();
+"""
+
+tables_query = """
+SELECT DISTINCT
+    src_pg_class.relname AS srctable
+FROM pg_constraint
+JOIN pg_class AS src_pg_class
+    ON src_pg_class.oid = pg_constraint.conrelid
+JOIN pg_class AS ref_pg_class
+    ON ref_pg_class.oid = pg_constraint.confrelid
+JOIN pg_attribute AS src_pg_attribute
+    ON src_pg_class.oid = src_pg_attribute.attrelid
+JOIN pg_attribute AS ref_pg_attribute
+    ON ref_pg_class.oid = ref_pg_attribute.attrelid, generate_series(0,10) pos(n)
+WHERE
+    contype = 'f'
+    AND ref_pg_class.relname = 'transaction_entry'
+    AND ref_pg_attribute.attname = 'id'
+    AND src_pg_attribute.attnum = pg_constraint.conkey[n]
+    AND ref_pg_attribute.attnum = pg_constraint.confkey[n]
+    AND NOT src_pg_attribute.attisdropped
+    AND NOT ref_pg_attribute.attisdropped
+"""
+
+
+def apply_patch(store):
+    store.execute(index_query)
+    store.execute(function_query)
+    tables = store.execute(tables_query).get_all()
+
+    for (table,) in tables:
+        store.execute(trigger_query.format(table=table))
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+# vi:si:et:sw=4:sts=4:ts=4
+
+##
+## Copyright (C) 2016 Stoq Tecnologia <http://stoq.link>
+## All rights reserved
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU Lesser General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU Lesser General Public License
+## along with this program; if not, write to the Free Software
+## Foundation, Inc., or visit: http://www.gnu.org/.
+##
+## Author(s): Stoq Team <stoq-devel@async.com.br>
+##
+
+
+"""Pipelined execution of fiscal printer commands
+
+Sending a command to a fiscal printer means a round-trip through a serial
+port, which can take a few hundred milliseconds. Instead of blocking the
+interface on each one of them, :class:`PrinterCommandQueue` sends them to
+the device on a separated thread, in the same order they were queued,
+and acknowledges them back in the main thread.
+"""
+
+import collections
+import logging
+import queue
+import threading
+
+from stoqlib.lib.threadutils import threadit, schedule_in_main_thread
+
+log = logging.getLogger(__name__)
+
+
+class CommandAbortedError(Exception):
+    """The command was not sent to the printer since a previous one failed"""
+
+
+class PrinterCommand(object):
+    """A command to be sent to the fiscal printer
+
+    After the command is acknowledged, either :attr:`result` will contain
+    what the driver returned or :attr:`error` will contain the exception
+    it raised (or a :class:`CommandAbortedError` if the command was
+    not even sent).
+    """
+
+    def __init__(self, method, args, kwargs, callback, generation):
+        self.method = method
+        self.args = args
+        self.kwargs = kwargs
+        self.callback = callback
+        self.generation = generation
+        self.result = None
+        self.error = None
+
+    def __repr__(self):
+        return '<PrinterCommand %s>' % (self.method, )
+
+    @property
+    def failed(self):
+        """If the command was not executed successfully by the printer"""
+        return self.error is not None
+
+
+class PrinterCommandQueue(object):
+    """A queue of commands to be sent to a fiscal printer driver
+
+    The commands are executed in a background thread, one at a time and in
+    the order they were queued. Their callbacks are called in the main
+    thread, also in that order, once the command is acknowledged.
+
+    When a command fails, all the commands that were queued before the
+    failure got acknowledged will be aborted instead of being sent to
+    the printer. That way the callsite can rollback whatever it did
+    after queueing them, keeping its state in sync with what was actually
+    printed.
+
+    Note that the driver is not thread safe, so no other call should be
+    done to it while there are pending commands. Use :meth:`flush` before
+    doing that.
+
+    :param driver: the fiscal printer driver
+    """
+
+    def __init__(self, driver):
+        self._driver = driver
+        self._pending = queue.Queue()
+        self._done = collections.deque()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._dispatch_scheduled = False
+        # The generation is increased each time a failure is acknowledged.
+        # Commands from the same generation of a failed one are aborted.
+        self._generation = 0
+        self._failed_generation = None
+
+    #
+    #  Private
+    #
+
+    def _run(self):
+        while True:
+            command = self._pending.get()
+            if command.generation == self._failed_generation:
+                command.error = CommandAbortedError()
+            else:
+                try:
+                    func = getattr(self._driver, command.method)
+                    command.result = func(*command.args, **command.kwargs)
+                except Exception as e:
+                    log.info("Printer command %r failed: %s" % (command, e))
+                    command.error = e
+                    self._failed_generation = command.generation
+
+            with self._lock:
+                self._done.append(command)
+                schedule = not self._dispatch_scheduled
+                self._dispatch_scheduled = True
+            if schedule:
+                schedule_in_main_thread(self._on_idle)
+            self._pending.task_done()
+
+    def _dispatch(self):
+        with self._lock:
+            commands = list(self._done)
+            self._done.clear()
+            self._dispatch_scheduled = False
+
+        failures = 0
+        for command in commands:
+            if command.failed:
+                failures += 1
+                if not isinstance(command.error, CommandAbortedError):
+                    # Commands queued after this point are safe to be sent
+                    self._generation += 1
+            if command.callback is not None:
+                command.callback(command)
+        return failures
+
+    def _on_idle(self):
+        self._dispatch()
+        # Don't run again
+        return False
+
+    #
+    #  Public API
+    #
+
+    def put(self, method, args=(), kwargs=None, callback=None):
+        """Queue a command to be sent to the printer
+
+        :param method: the name of the driver method to call
+        :param args: the positional arguments for the method
+        :param kwargs: the keyword arguments for the method
+        :param callback: a callable that will receive the
+            :class:`PrinterCommand` in the main thread after it
+            was acknowledged
+        :returns: the queued :class:`PrinterCommand`
+        """
+        command = PrinterCommand(method, args, kwargs or {},
+                                 callback, self._generation)
+        if self._thread is None:
+            self._thread = threadit(self._run)
+        self._pending.put(command)
+        return command
+
+    def flush(self):
+        """Wait until all the queued commands are acknowledged
+
+        The callbacks of the commands acknowledged so far will be called
+        before this returns, without waiting for the main loop.
+
+        :returns: the number of commands that failed or were aborted
+            among the ones acknowledged by this call
+        """
+        self._pending.join()
+        return self._dispatch()
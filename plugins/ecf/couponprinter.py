@@ -43,6 +43,7 @@ from stoqlib.lib.ibpt import generate_ibpt_message
 from stoqlib.lib.message import warning
 from stoqlib.lib.translation import stoqlib_gettext
 
+from ecf.commandqueue import CommandAbortedError, PrinterCommandQueue
 from ecf.ecfdomain import FiscalSaleHistory, ECFDocumentHistory
 
 _ = stoqlib_gettext
@@ -61,12 +62,15 @@ class CouponPrinter(object):
         self._printer = printer
         # and this is a FiscalPrinter instance
         self._driver = printer.get_fiscal_driver()
+        # Coupon items are sent to the driver through this queue
+        self._queue = PrinterCommandQueue(self._driver)
 
     #
     # Public API
     #
 
     def has_open_coupon(self):
+        self._queue.flush()
         return self._driver.has_open_coupon()
 
     def open_till(self):
@@ -104,6 +108,7 @@ class CouponPrinter(object):
         #        That requires each sale to have a reference to a coupon.
         #        See #3130 for more information
 
+        self._queue.flush()
         try:
             self._driver.cancel()
         except CouponNotOpenError:
@@ -119,6 +124,7 @@ class CouponPrinter(object):
 
     def cancel_last_coupon(self):
         """Cancel the last non-fiscal coupon or sale."""
+        self._queue.flush()
         try:
             self._driver.cancel_last_coupon()
         except DriverError as details:
@@ -171,7 +177,7 @@ class CouponPrinter(object):
                     str(details))
 
     def create_coupon(self, coupon):
-        return Coupon(coupon, self._printer, self._driver)
+        return Coupon(coupon, self._printer, self._driver, self._queue)
 
     def check_serial(self):
         driver_serial = self._driver.get_serial()
@@ -264,6 +270,9 @@ class CouponPrinter(object):
     def get_driver(self):
         return self._driver
 
+    def get_queue(self):
+        return self._queue
+
 
 #
 # Class definitions
@@ -278,12 +287,17 @@ class Coupon(object):
     emitted, it will not be opened in fact, but just ignored.
     """
 
-    def __init__(self, coupon, printer, driver):
+    def __init__(self, coupon, printer, driver, queue):
         self.closed = False
         self._coupon = coupon
         self._printer = printer
         self._driver = driver
+        self._queue = queue
+        # Items are added to the printer asynchronously. add_item() returns
+        # a provisional id and this maps it to the id given by the driver
+        # after the command gets acknowledged.
         self._item_ids = {}
+        self._last_item_id = 0
         self._total_taxes = 0
         # This is a discount that will be added to the sale discount. See
         # add_item() for more information.
@@ -292,8 +306,24 @@ class Coupon(object):
         self._customer_document = None
         self._customer_document_type = None
 
+        # The driver should not be called while the queue has pending
+        # commands, so the capabilities are fetched only once, here
+        self._queue.flush()
+        self._capabilities = self._driver.get_capabilities()
+
     def _get_capability(self, name):
-        return self._driver.get_capabilities()[name]
+        return self._capabilities[name]
+
+    def _on_add_item__acknowledged(self, item, item_id, command):
+        if not command.failed:
+            self._item_ids[item_id] = command.result
+            return
+
+        # Rollback the item, it was not printed
+        self._temp_discount.pop(item_id, None)
+        if not isinstance(command.error, CommandAbortedError):
+            warning(_("Could not print item"), str(command.error))
+        self._coupon.reject_item(item, item_id)
 
     #
     # IContainer implementation
@@ -301,11 +331,14 @@ class Coupon(object):
 
     def add_item(self, item):
         """
+        The item is queued to be printed and this returns right away. If
+        the printer fails to print it, the item will be rejected
+        in the coupon afterwards. See :meth:`FiscalCoupon.reject_item`
+
         @param item: A :class:`SaleItem` subclass
-        @returns: id of the item.:
-          0 >= if it was added successfully
-          -1 if an error happend
-          0 if added but not printed (gift certificates, free deliveries)
+        @returns: the provisional id of the item, or -1 if its tax
+          constant could not be found on the printer. Errors when printing
+          it happen later and make the coupon reject the item
         """
         sellable = item.sellable
         max_len = self._get_capability("item_description").max_len
@@ -339,27 +372,43 @@ class Coupon(object):
             base_price = Decimal('0.01')
             discount_value = 0
 
-        try:
-            item_id = self._driver.add_item(code, description, base_price,
-                                            tax_constant.device_value.decode(),
-                                            item.quantity, unit,
-                                            unit_desc=unit_desc,
-                                            discount=discount_value)
-        except DriverError as e:
-            warning(_("Could not print item"), str(e))
-            item_id = -1
+        self._last_item_id += 1
+        item_id = self._last_item_id
 
-        if item.price == 0 and item_id != -1:
+        def callback(command):
+            self._on_add_item__acknowledged(item, item_id, command)
+
+        self._queue.put('add_item',
+                        args=(code, description, base_price,
+                              tax_constant.device_value.decode(),
+                              item.quantity, unit),
+                        kwargs=dict(unit_desc=unit_desc,
+                                    discount=discount_value),
+                        callback=callback)
+
+        if item.price == 0:
             self._temp_discount[item_id] = base_price * item.quantity
 
         return item_id
 
     def remove_item(self, item_id):
-        self._driver.cancel_item(item_id)
+        self._queue.flush()
+        # The item may have been rejected while the queue was flushed
+        if item_id not in self._item_ids:
+            return
+
+        self._driver.cancel_item(self._item_ids.pop(item_id))
         # We need to remove the temporary discount for the item we are removing
         if item_id in self._temp_discount:
             del self._temp_discount[item_id]
 
+    def flush(self):
+        """Wait until all the items are sent to the printer
+
+        :returns: the number of items that were rejected
+        """
+        return self._queue.flush()
+
     #
     # Fiscal coupon related functions
     #
@@ -372,20 +421,25 @@ class Coupon(object):
         self._customer_document = document
         self._customer_document_type = document_type
 
+        self._queue.flush()
         self._driver.identify_customer(name[:max_name], address[:max_addr],
                                        document[:max_id])
 
     def is_customer_identified(self):
+        self._queue.flush()
         return self._driver.coupon_is_customer_identified()
 
     def open(self):
+        self._queue.flush()
         return self._driver.open()
 
     def totalize(self, sale):
+        self._queue.flush()
         discount = sale.discount_value + sum(self._temp_discount.values())
         return self._driver.totalize(discount, Decimal('0'), TaxType.NONE)
 
     def cancel(self):
+        self._queue.flush()
         return self._driver.cancel()
 
     def _get_payment_method_constant(self, payment):
@@ -402,6 +456,7 @@ class Coupon(object):
         function must be called after all the payments has been created.
         """
         log.info("setting up payments for %r" % (sale, ))
+        self._queue.flush()
 
         log.info("we have %d payments" % (sale.payments.count()), )
 
@@ -455,6 +510,7 @@ class Coupon(object):
             parts.insert(-1, additional_info)
         message = '\n'.join(parts)
         message += ' - www.stoq.com.br'
+        self._queue.flush()
         self._create_fiscal_sale_data(sale)
         coupon_id = self._driver.close(message)
         self.closed = True
@@ -470,9 +526,11 @@ class Coupon(object):
                           store=store)
 
     def get_ccf(self):
+        self._queue.flush()
         return self._driver.get_ccf()
 
     def get_coo(self):
+        self._queue.flush()
         return self._driver.get_coo()
 
     @property
@@ -491,6 +549,7 @@ class Coupon(object):
         @param receipt: the text to be printed
         """
         constant = self._get_payment_method_constant(payment)
+        self._queue.flush()
         receipt_id = self._driver.get_payment_receipt_identifier(constant.constant_name)
 
         self._driver.payment_receipt_open(receipt_id, coo,
@@ -40,6 +40,8 @@ from stoqlib.domain.interfaces import IActive, IDescribable
 from stoqlib.exceptions import DeviceError
 from stoqlib.lib.translation import stoqlib_gettext
 
+from ecf.virtualprinter import VirtualFiscalPrinter
+
 _ = stoqlib_gettext
 
 
@@ -196,8 +198,10 @@ class ECFPrinter(Domain):
     def get_fiscal_driver(self):
         if self.brand == 'virtual':
             port = VirtualPort()
-        else:
-            port = SerialPort(device=self.device_name, baudrate=self.baudrate)
+            return VirtualFiscalPrinter(
+                FiscalPrinter(brand=self.brand, model=self.model, port=port))
+
+        port = SerialPort(device=self.device_name, baudrate=self.baudrate)
         return FiscalPrinter(brand=self.brand, model=self.model, port=port)
 
     def set_user_info(self, user_info):
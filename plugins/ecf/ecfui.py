@@ -437,6 +437,7 @@ class ECFUI(object):
                 ('customer-identified', self._on_coupon__customer_identified),
                 ('add-item', self._on_coupon__add_item),
                 ('remove-item', self._on_coupon__remove_item),
+                ('flush', self._on_coupon__flush),
                 ('add-payments', self._on_coupon__add_payments),
                 ('totalize', self._on_coupon__totalize),
                 ('close', self._on_coupon__close),
@@ -701,6 +702,9 @@ class ECFUI(object):
     def _on_coupon__remove_item(self, coupon, item_id):
         coupon.remove_item(item_id)
 
+    def _on_coupon__flush(self, coupon):
+        return coupon.flush()
+
     def _on_coupon__add_payments(self, coupon, sale):
         coupon.add_payments(sale)
 
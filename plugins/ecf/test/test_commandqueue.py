@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+# vi:si:et:sw=4:sts=4:ts=4
+
+##
+## Copyright (C) 2016 Stoq Tecnologia <http://stoq.link>
+## All rights reserved
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU Lesser General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU Lesser General Public License
+## along with this program; if not, write to the Free Software
+## Foundation, Inc., or visit: http://www.gnu.org/.
+##
+## Author(s): Stoq Team <stoq-devel@async.com.br>
+##
+
+
+import time
+
+from stoqdrivers.exceptions import DriverError
+
+from ecf.commandqueue import CommandAbortedError, PrinterCommandQueue
+from ecf.test.ecftest import ECFTest
+
+
+class TestPrinterCommandQueue(ECFTest):
+    def setUp(self):
+        super(TestPrinterCommandQueue, self).setUp()
+        self.driver = self.printer.get_driver()
+        self.queue = PrinterCommandQueue(self.driver)
+        self.acknowledged = []
+
+    def _put(self, method, *args):
+        return self.queue.put(method, args=args,
+                              callback=self.acknowledged.append)
+
+    def test_put(self):
+        self.driver.latency = 0.05
+        start = time.time()
+        commands = [self._put('get_coo') for i in range(3)]
+        # Queueing should not wait for the printer
+        self.assertLess(time.time() - start, self.driver.latency)
+        self.assertEqual(self.acknowledged, [])
+
+        self.assertEqual(self.queue.flush(), 0)
+        self.assertEqual(self.acknowledged, commands)
+        for command in commands:
+            self.assertFalse(command.failed)
+            self.assertEqual(command.result, self.driver.get_coo())
+
+    def test_put_failure(self):
+        error = DriverError("Out of paper")
+        self.driver.inject_error('get_coo', error)
+        commands = [self._put('get_coo') for i in range(3)]
+
+        self.assertEqual(self.queue.flush(), 3)
+        self.assertEqual(self.acknowledged, commands)
+        self.assertIs(commands[0].error, error)
+        self.assertIsInstance(commands[1].error, CommandAbortedError)
+        self.assertIsInstance(commands[2].error, CommandAbortedError)
+
+        # After the failure was acknowledged, commands are sent again
+        command = self._put('get_coo')
+        self.assertEqual(self.queue.flush(), 0)
+        self.assertFalse(command.failed)
+        self.assertEqual(self.acknowledged[-1], command)
+
+    def test_flush_empty(self):
+        self.assertEqual(self.queue.flush(), 0)
+        self.assertEqual(self.acknowledged, [])
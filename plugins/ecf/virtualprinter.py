@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+# vi:si:et:sw=4:sts=4:ts=4
+
+##
+## Copyright (C) 2016 Stoq Tecnologia <http://stoq.link>
+## All rights reserved
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU Lesser General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU Lesser General Public License
+## along with this program; if not, write to the Free Software
+## Foundation, Inc., or visit: http://www.gnu.org/.
+##
+## Author(s): Stoq Team <stoq-devel@async.com.br>
+##
+
+
+"""A virtual fiscal printer that behaves like a real device
+
+stoqdrivers' virtual printer answers immediately, which hides any issue
+related to the latency of a real printer. :class:`VirtualFiscalPrinter`
+wraps it, delaying every command as if it was sent through a serial port.
+
+The latency can be configured with the ``STOQ_ECF_VIRTUAL_LATENCY``
+environment variable, in milliseconds.
+"""
+
+import os
+import time
+
+
+def get_virtual_printer_latency():
+    """Get the latency configured for virtual printers
+
+    :returns: the latency in seconds
+    """
+    value = os.environ.get('STOQ_ECF_VIRTUAL_LATENCY')
+    if not value:
+        return 0
+    return float(value) / 1000
+
+
+class VirtualFiscalPrinter(object):
+    """A wrapper around a virtual fiscal printer driver
+
+    :param driver: the stoqdrivers fiscal printer, using a virtual port
+    :param latency: how many seconds each command will take. If ``None``,
+        :func:`get_virtual_printer_latency` will be used
+    """
+
+    def __init__(self, driver, latency=None):
+        if latency is None:
+            latency = get_virtual_printer_latency()
+        self.latency = latency
+        self._driver = driver
+        self._errors = {}
+
+    def __getattr__(self, name):
+        attr = getattr(self._driver, name)
+        if not callable(attr):
+            return attr
+
+        def command(*args, **kwargs):
+            if self.latency:
+                time.sleep(self.latency)
+            errors = self._errors.get(name)
+            if errors:
+                raise errors.pop(0)
+            return attr(*args, **kwargs)
+        return command
+
+    #
+    #  Public API
+    #
+
+    def inject_error(self, method, error):
+        """Make the next call to a method fail
+
+        This is useful to simulate a printer rejecting a command.
+
+        :param method: the name of the driver method
+        :param error: the exception that will be raised
+        """
+        self._errors.setdefault(method, []).append(error)
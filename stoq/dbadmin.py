@@ -433,8 +433,13 @@ class StoqCommandHandler:
 
         if output == '-':
             output = None
+        exclude_schemas = []
+        if options.exclude_archive:
+            from stoqlib.database.archive import ARCHIVE_SCHEMA
+            exclude_schemas.append(ARCHIVE_SCHEMA)
         self._db_settings.dump_database(output, gzip=options.gzip,
-                                        format=options.format)
+                                        format=options.format,
+                                        exclude_schemas=exclude_schemas)
 
     def opt_dump(self, parser, group):
         group.add_option('-z', '--gzip',
@@ -445,6 +450,77 @@ class StoqCommandHandler:
                          default='custom',
                          help="dump format see man pg_dump for more information",
                          dest='format')
+        group.add_option('', '--exclude-archive',
+                         action='store_true',
+                         help="don't dump the archived history",
+                         dest='exclude_archive')
+
+    def cmd_archive_history(self, options, until):
+        """Move the history older than a date (YYYY-MM-DD) to the archive"""
+        import datetime
+        import os
+        from stoqlib.database.archive import (archive_history,
+                                              detach_partition,
+                                              get_archive_partitions)
+        from stoqlib.database.runtime import new_store
+
+        self._read_config(options, register_station=False)
+        try:
+            until = datetime.datetime.strptime(until, '%Y-%m-%d')
+        except ValueError:
+            print('ERROR: Invalid date: %s' % (until, ))
+            return 1
+
+        with new_store() as store:
+            try:
+                archived = archive_history(store, until)
+            except ValueError as err:
+                print('ERROR: %s' % (str(err), ))
+                store.retval = False
+                return 1
+
+            for partition, count in sorted(archived.items()):
+                print('%s: %d rows archived' % (partition, count))
+            if options.dry:
+                store.retval = False
+                return 0
+
+        if not options.detach_dir:
+            return 0
+
+        with new_store() as store:
+            for partition in get_archive_partitions(store):
+                filename = os.path.join(options.detach_dir,
+                                        '%s.dump' % (partition, ))
+                detach_partition(store, partition, filename)
+                print('%s: detached to %s' % (partition, filename))
+
+    def opt_archive_history(self, parser, group):
+        group.add_option('', '--detach-dir',
+                         action='store',
+                         help="dump the archive partitions to this "
+                              "directory and drop them from the database",
+                         dest='detach_dir')
+
+    def cmd_refresh_sale_summary(self, options):
+        """Update the sale summary with the sales modified since last time"""
+        from stoqlib.database.runtime import new_store
+        from stoqlib.domain.sale import SaleSummary
+
+        self._read_config(options, register_station=False)
+        with new_store() as store:
+            if options.rebuild:
+                SaleSummary.rebuild(store)
+            else:
+                SaleSummary.refresh_modified(store)
+            if options.dry:
+                store.retval = False
+
+    def opt_refresh_sale_summary(self, parser, group):
+        group.add_option('', '--rebuild',
+                         action='store_true',
+                         help="recalculate the whole summary",
+                         dest='rebuild')
 
     def cmd_restore(self, options, schema):
         """Restore a database dump"""
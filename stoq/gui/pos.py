@@ -1291,6 +1291,11 @@ class PosApp(ShellApp):
             # The user can save a token with just a client.
             return
 
+        if self._coupon is not None and self._coupon.flush():
+            # Some items were rejected by the fiscal printer and removed
+            # from the sale. Let the user review it before checking out
+            return
+
         if (self._token and not len(self.sale_items) and not
                 self._suggested_client):
             # This is a sale token with no items nor client. Just close it.
@@ -1458,6 +1463,7 @@ class PosApp(ShellApp):
         coupon = self._printer.create_coupon()
 
         if coupon:
+            coupon.connect('item-rejected', self._on_coupon__item_rejected)
             while not coupon.open():
                 if not yesno(
                         _("It is not possible to start a new sale if the "
@@ -1472,7 +1478,9 @@ class PosApp(ShellApp):
         """Adds an item to the coupon.
 
         Should return -1 if the coupon was not added, but will return None if
-        CONFIRM_SALES_ON_TILL is true
+        CONFIRM_SALES_ON_TILL is true. Note that the item may still be on its
+        way to the fiscal printer. If it fails to print it, the item will be
+        removed from the sale by :meth:`._on_coupon__item_rejected`
 
         See :class:`stoqlib.gui.fiscalprinter.FiscalCoupon` for more information
         """
@@ -1653,6 +1661,12 @@ class PosApp(ShellApp):
 
         return True
 
+    def _on_coupon__item_rejected(self, coupon, sale_item):
+        if sale_item in self.sale_items:
+            self.sale_items.remove(sale_item)
+        self._update_totals()
+        self._update_widgets()
+
     def _on_remove_trade_button__clicked(self, button):
         if yesno(_("Do you really want to cancel the trade in progress?"),
                  Gtk.ResponseType.NO, _("Cancel trade"), _("Don't cancel")):
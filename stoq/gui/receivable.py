@@ -79,6 +79,7 @@ class ReceivableApp(BaseAccountWindow):
     app_title = _('Accounts receivable')
     gladefile = 'receivable'
     search_spec = InPaymentView
+    search_result_cache = True
     search_label = _('matching:')
     report_table = ReceivablePaymentReport
     editor_class = InPaymentEditor
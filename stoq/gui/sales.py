@@ -104,6 +104,7 @@ class SalesApp(ShellApp):
     app_title = _('Sales')
     gladefile = 'sales_app'
     search_spec = SaleView
+    search_result_cache = True
     search_label = _('matching:')
     report_table = SalesReport
 
@@ -33,10 +33,14 @@ from gi.repository import Gtk, GdkPixbuf, Pango, GLib
 from kiwi.currency import currency
 from kiwi.ui.gadgets import render_pixbuf
 from kiwi.ui.objectlist import Column
-from storm.expr import And, Or, Eq
+from storm.expr import (Alias, And, Cast, Count, Eq, Ne, Or, Select,
+                        Undef)
 from zope.interface import implementer
 
 from stoqlib.api import api
+from stoqlib.database.expr import (Case, Field, Over, RowNumber,
+                                   StatementTimestamp)
+from stoqlib.domain.system import TransactionEntry
 from stoqlib.domain.workorder import (WorkOrder, WorkOrderCategory,
                                       WorkOrderView)
 from stoqlib.enums import SearchFilterPosition
@@ -88,6 +92,17 @@ class WorkOrderResultKanbanView(KanbanView):
         WorkOrder.STATUS_WORK_FINISHED
     ]
 
+    #: How many work orders each column will load at once. More can be
+    #: loaded by clicking on the column's "Show more" button
+    page_size = 50
+
+    def __init__(self):
+        super(WorkOrderResultKanbanView, self).__init__()
+        self._store = None
+        self._results = None
+        self._limits = {}
+        self._last_update = None
+
     def _ask_reason(self, work_order, new_status):
         if (work_order.status, new_status) not in self.need_reason:
             return None
@@ -156,10 +171,138 @@ class WorkOrderResultKanbanView(KanbanView):
 
             work_order.inform_client(rv.notes)
 
+    def _get_column_value(self):
+        # The value of the column the work order should be displayed on.
+        # Note that the status needs to be casted since it is an enum
+        return Case(Ne(WorkOrder.client_informed_date, None),
+                    u'client_informed_date', Cast(WorkOrder.status, 'text'))
+
+    def _get_positions(self, limits, work_order_ids=None):
+        # Using a window function we can find out which work orders fit in
+        # each column and how many work orders each column has in a single
+        # query, without having to load all of them
+        column_value = self._get_column_value()
+        select = self._results.get_select()
+        select.columns = [
+            Alias(WorkOrder.id, 'id'),
+            Alias(column_value, 'column_value'),
+            Alias(Over(RowNumber(), [column_value],
+                       [WorkOrder.open_date, WorkOrder.id]), 'position'),
+            Alias(Over(Count(), [column_value]), 'total'),
+        ]
+        select.order_by = Undef
+        select.limit = Undef
+        select.offset = Undef
+
+        value_field = Field('_kanban', 'column_value')
+        position_field = Field('_kanban', 'position')
+        query = Or(*[And(value_field == value, position_field <= limit)
+                     for value, limit in limits.items()])
+        if work_order_ids is not None:
+            query = And(query,
+                        Field('_kanban', 'id').is_in(work_order_ids))
+
+        return self._store.execute(
+            Select([Field('_kanban', 'id'), value_field,
+                    Field('_kanban', 'total')],
+                   tables=[Alias(select, '_kanban')],
+                   where=query)).get_all()
+
+    def _load_work_orders(self, columns, work_order_ids=None):
+        limits = dict((column.value, self._limits[column.value])
+                      for column in columns)
+        positions = self._get_positions(limits, work_order_ids)
+        if not positions:
+            return
+
+        totals = {}
+        column_values = {}
+        for work_order_id, value, total in positions:
+            column_values[work_order_id] = value
+            totals[value] = total
+
+        results = self._results.find(
+            WorkOrder.id.is_in(list(column_values)))
+        columns = dict((column.value, column) for column in columns)
+        for work_order_view in results.order_by(WorkOrder.open_date,
+                                                WorkOrder.id):
+            self._prepare_item(work_order_view)
+            column = columns[column_values[work_order_view.id]]
+            if work_order_ids is None:
+                column.append_item(work_order_view)
+            else:
+                self._insert_sorted(column, work_order_view)
+
+        for value, total in totals.items():
+            column = columns[value]
+            column.set_has_more(total > len(column.get_items()))
+
+    def _insert_sorted(self, column, work_order_view):
+        key = (work_order_view.open_date, work_order_view.id)
+        for i, item in enumerate(column.get_items()):
+            if (item.open_date, item.id) > key:
+                column.insert_item(i, work_order_view)
+                return
+        column.append_item(work_order_view)
+
+    def _prepare_item(self, work_order_view):
+        if work_order_view.sellable:
+            description = '%s - %s' % (
+                work_order_view.sellable,
+                work_order_view.description)
+        else:
+            description = work_order_view.description
+
+        # FIXME: Figure out a better way of rendering
+        work_order_view.markup = '<b>%s</b>\n%s\n%s' % (
+            description,
+            str(api.escape(work_order_view.client_name)),
+            work_order_view.open_date.strftime('%x'))
+
+    def _get_current_time(self):
+        # te_time is stored without the time zone
+        return self._store.execute(
+            Select(Cast(StatementTimestamp(), 'timestamp'))).get_one()[0]
+
+    #
+    # Public API
+    #
+
+    def update_changed(self):
+        """Update only the work orders that changed since the last update
+
+        Instead of running the whole search again, only the work orders
+        whose |transactionentry| changed after the last update are fetched
+        and moved to their new columns.
+        """
+        if self._results is None:
+            return
+
+        since = self._last_update
+        self._last_update = self._get_current_time()
+        changed = set(self._store.find(
+            WorkOrder.id, And(WorkOrder.te_id == TransactionEntry.id,
+                              TransactionEntry.te_time >= since)))
+        if not changed:
+            return
+
+        for column in self.get_columns():
+            for item in column.get_items():
+                if item.id not in changed:
+                    continue
+                # Make sure the work order will be loaded again with the
+                # values changed by other stores
+                self._store.invalidate(item.work_order)
+                column.remove_item(item)
+
+        self._load_work_orders(self.get_columns(), list(changed))
+
     # ISearchResultView
 
     def attach(self, search, columns):
+        self._store = search.store
         self.connect('item-dragged', self._on__item_dragged)
+        self.connect('load-more', self._on__load_more)
         for status in self.status_columns:
             name = WorkOrder.statuses[status]
             column = KanbanViewColumn(title=name, value=status)
@@ -176,36 +319,11 @@ class WorkOrderResultKanbanView(KanbanView):
     def search_completed(self, results):
         # We are only interested in the workorders whose status are in one of our
         # columns
-        results = results.find(WorkOrder.status.is_in(self.status_columns))
-        for work_order_view in results.order_by(WorkOrder.open_date):
-            work_order = work_order_view.work_order
-            status_name = WorkOrder.statuses.get(work_order.status)
-            # Skip cancel/delivered etc
-            if status_name is None:
-                continue
-
-            # Since this column isnt one of the |work_order| status
-            if work_order.client_informed_date:
-                status_name = _('Client informed')
-
-            column = self.get_column_by_title(status_name)
-            if column is None:
-                continue
-
-            if work_order_view.sellable:
-                description = '%s - %s' % (
-                    work_order_view.sellable,
-                    work_order_view.description)
-            else:
-                description = work_order_view.description
-
-            # FIXME: Figure out a better way of rendering
-            work_order_view.markup = '<b>%s</b>\n%s\n%s' % (
-                description,
-                str(api.escape(work_order_view.client_name)),
-                work_order_view.open_date.strftime('%x'))
-
-            column.append_item(work_order_view)
+        self._results = results.find(WorkOrder.status.is_in(self.status_columns))
+        self._limits = dict((column.value, self.page_size)
+                            for column in self.get_columns())
+        self._last_update = self._get_current_time()
+        self._load_work_orders(self.get_columns())
 
     def get_settings(self):
         return {}
@@ -228,6 +346,11 @@ class WorkOrderResultKanbanView(KanbanView):
         return self._change_status(work_order_view.work_order,
                                    new_status)
 
+    def _on__load_more(self, kanban, column):
+        self._limits[column.value] += self.page_size
+        column.clear()
+        self._load_work_orders([column])
+
 
 class _FilterItem(object):
     def __init__(self, name, value, color=None, obj_id=None):
@@ -540,8 +663,14 @@ class ServicesApp(ShellApp):
             (category.name, category.id, render_pixbuf(category.color))
             for category in self.store.find(WorkOrderCategory)]
 
-    def _update_view(self, select_item=None):
-        self.refresh()
+    def _update_view(self, select_item=None, changed_only=False):
+        result_view = self.search.result_view
+        if changed_only and isinstance(result_view, WorkOrderResultKanbanView):
+            # The kanban is able to update only the work orders that changed,
+            # which is a lot faster than running the whole search again
+            result_view.update_changed()
+        else:
+            self.refresh()
         if select_item is not None:
             item = self.store.find(WorkOrderView, id=select_item.id).one()
             self.select_result(item)
@@ -648,12 +777,12 @@ class ServicesApp(ShellApp):
         self.actions.new_order(category=category)
 
     def on_actions__model_created(self, actions, order):
-        self._update_view(select_item=order)
+        self._update_view(select_item=order, changed_only=True)
         # A category may have been created on the editor
         self._update_filters()
 
     def on_actions__model_edited(self, actions, order):
-        self._update_view()
+        self._update_view(changed_only=True)
         # A category may have been created on the editor
         self._update_filters()
 
@@ -62,33 +62,35 @@ class ShellBootstrap(object):
     def bootstrap(self):
         self._setup_gobject()
         self._set_uptime()
-        # Do this as soon as possible, before we attempt to use the
-        # external libraries/resources
-        self._set_user_locale()
-        # Do this as early as possible to get as much as possible into the
-        # log file itself, which means we cannot depend on the config or
-        # anything else
-        self._prepare_logfiles()
-        try:
-            self._setup_venv()
-        except Exception:
-            log.info('Failed to create venv')
-        self._set_app_info()
-        self._check_dependencies()
-        self._setup_exception_hook()
-        self._setup_gtk()
-        self._setup_kiwi()
-        self._show_splash()
-        self._setup_psycopg()
-        self._check_version_policy()
-        self._setup_ui_dialogs()
-        self._setup_cookiefile()
-        self._register_stock_icons()
-        self._setup_domain_slave_mapper()
-        self._load_key_bindings()
-        self._setup_debug_options()
-        self._check_locale()
-        self._setup_autoreload()
+
+        from stoqlib.lib.uptime import measure_phase
+        for step in [
+                # Do this as soon as possible, before we attempt to use the
+                # external libraries/resources
+                self._set_user_locale,
+                # Do this as early as possible to get as much as possible into
+                # the log file itself, which means we cannot depend on the
+                # config or anything else
+                self._prepare_logfiles,
+                self._try_setup_venv,
+                self._set_app_info,
+                self._check_dependencies,
+                self._setup_exception_hook,
+                self._setup_gtk,
+                self._setup_kiwi,
+                self._show_splash,
+                self._setup_psycopg,
+                self._check_version_policy,
+                self._setup_ui_dialogs,
+                self._setup_cookiefile,
+                self._register_stock_icons,
+                self._setup_domain_slave_mapper,
+                self._load_key_bindings,
+                self._setup_debug_options,
+                self._check_locale,
+                self._setup_autoreload]:
+            with measure_phase('bootstrap' + step.__name__):
+                step()
 
     def _setup_gobject(self):
         if not self._initial:
@@ -188,6 +190,12 @@ class ShellBootstrap(object):
         info.set("log", self._log_filename)
         provide_utility(IAppInfo, info)
 
+    def _try_setup_venv(self):
+        try:
+            self._setup_venv()
+        except Exception:
+            log.info('Failed to create venv')
+
     def _setup_venv(self):
         from stoqlib.lib.osutils import get_application_dir
         import venv
@@ -65,9 +65,11 @@ class ShellDatabaseConnection(object):
         self._ran_wizard = False
 
     def connect(self):
-        self._load_configuration()
-        self._maybe_run_first_time_wizard()
-        self._try_connect()
+        from stoqlib.lib.uptime import measure_phase
+        with measure_phase('connect'):
+            self._load_configuration()
+            self._maybe_run_first_time_wizard()
+            self._try_connect()
         self._post_connect()
 
     def _load_configuration(self):
@@ -152,9 +154,13 @@ class ShellDatabaseConnection(object):
                       'error=%s uri=%s' % (str(e), store_uri))
 
     def _post_connect(self):
-        self._check_schema_migration()
-        self._check_branch()
-        self._activate_plugins()
+        from stoqlib.lib.uptime import measure_phase
+        with measure_phase('check_schema_migration'):
+            self._check_schema_migration()
+        with measure_phase('check_branch'):
+            self._check_branch()
+        with measure_phase('activate_plugins'):
+            self._activate_plugins()
 
     def _check_schema_migration(self):
         from stoqlib.lib.message import error
@@ -524,16 +530,20 @@ class Shell(object):
     #
 
     def _on_app__activate(self, app):
+        from stoqlib.lib.uptime import log_phases, measure_phase
         appname = self._appname
         action_name = self._action_name
         self._dbconn.connect()
+        # The time spent here depends mostly on the user typing the password
         if not self._do_login():
             raise SystemExit
         if appname is None:
             appname = u'launcher'
-        shell_window = self.create_window()
-        app = shell_window.run_application(str(appname))
-        shell_window.show()
+        with measure_phase('run_application'):
+            shell_window = self.create_window()
+            app = shell_window.run_application(str(appname))
+            shell_window.show()
+        log_phases()
 
         if action_name is not None:
             action = getattr(app, action_name, None)
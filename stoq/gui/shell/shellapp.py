@@ -74,6 +74,11 @@ class ShellApp(GladeDelegate):
     #: The spec for store.find() to perform the search on
     search_spec = None
 
+    #: If the results of the search should be cached. Useful for applications
+    #: where the search is refreshed very often, e.g. on each activation.
+    #: Lazy searches (see :meth:`SearchSlave.enable_lazy_search`) are not cached
+    search_result_cache = False
+
     #: Label left of the search entry
     search_label = _('Search:')
 
@@ -118,6 +123,8 @@ class ShellApp(GladeDelegate):
                                   store=self.store,
                                   restore_name=self.__class__.__name__,
                                   search_spec=self.search_spec)
+        if self.search_result_cache:
+            self.search.enable_result_cache()
 
     def _attach_search(self):
         if self.search_spec is None:
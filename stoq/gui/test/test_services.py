@@ -29,7 +29,8 @@ import mock
 from nose.exc import SkipTest
 
 from stoqlib.api import api
-from stoqlib.domain.workorder import WorkOrderItem, WorkOrder
+from stoqlib.domain.test.domaintest import DomainTest
+from stoqlib.domain.workorder import WorkOrderItem, WorkOrder, WorkOrderView
 from stoqlib.gui.dialogs.workordercategorydialog import WorkOrderCategoryDialog
 from stoqlib.gui.editors.noteeditor import NoteEditor, Note
 from stoqlib.reporting.workorder import (WorkOrderReceiptReport,
@@ -38,10 +39,129 @@ from stoqlib.gui.search.personsearch import ClientSearch
 from stoqlib.gui.search.productsearch import ProductSearch
 from stoqlib.gui.search.servicesearch import ServiceSearch
 
-from stoq.gui.services import ServicesApp
+from stoq.gui.services import ServicesApp, WorkOrderResultKanbanView
 from stoq.gui.test.baseguitest import BaseGUITest
 
 
+class _Column(object):
+    """A kanban column without the widgets"""
+
+    def __init__(self, value):
+        self.value = value
+        self.items = []
+        self.has_more = False
+
+    def append_item(self, item):
+        self.items.append(item)
+
+    def insert_item(self, index, item):
+        self.items.insert(index, item)
+
+    def remove_item(self, item):
+        self.items.remove(item)
+
+    def get_items(self):
+        return list(self.items)
+
+    def set_has_more(self, has_more):
+        self.has_more = has_more
+
+
+class TestWorkOrderResultKanbanView(DomainTest):
+    def setUp(self):
+        super(TestWorkOrderResultKanbanView, self).setUp()
+        self.clean_domain([WorkOrderItem, WorkOrder])
+
+        self.view = WorkOrderResultKanbanView()
+        self.view.page_size = 2
+        self.view._store = self.store
+        self.columns = dict(
+            (value, _Column(value)) for value in
+            self.view.status_columns + [u'client_informed_date'])
+        patcher = mock.patch.object(self.view, 'get_columns',
+                                    return_value=list(self.columns.values()))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _create_workorder(self, status, day):
+        workorder = self.create_workorder()
+        workorder.status = status
+        workorder.open_date = datetime.datetime(2013, 1, day)
+        return workorder
+
+    def _get_items(self, value):
+        return [item.work_order for item in self.columns[value].items]
+
+    def test_get_positions(self):
+        opened = [self._create_workorder(WorkOrder.STATUS_OPENED, day)
+                  for day in [3, 1, 2]]
+        waiting = self._create_workorder(WorkOrder.STATUS_WORK_WAITING, 1)
+        informed = self._create_workorder(WorkOrder.STATUS_WORK_FINISHED, 1)
+        informed.client_informed_date = datetime.datetime(2013, 1, 5)
+        self._create_workorder(WorkOrder.STATUS_WORK_FINISHED, 2)
+        self.view._results = self.store.find(WorkOrderView)
+
+        positions = self.view._get_positions({
+            WorkOrder.STATUS_OPENED: 2,
+            WorkOrder.STATUS_WORK_WAITING: 2,
+            u'client_informed_date': 2})
+        # Only the oldest work orders fitting in each column are returned,
+        # with the total of the column. The columns not asked are ignored
+        self.assertEqual(set(positions), {
+            (opened[1].id, WorkOrder.STATUS_OPENED, 3),
+            (opened[2].id, WorkOrder.STATUS_OPENED, 3),
+            (waiting.id, WorkOrder.STATUS_WORK_WAITING, 1),
+            (informed.id, u'client_informed_date', 1)})
+
+        positions = self.view._get_positions({WorkOrder.STATUS_OPENED: 2},
+                                             [opened[0].id, opened[2].id])
+        self.assertEqual(positions,
+                         [(opened[2].id, WorkOrder.STATUS_OPENED, 3)])
+
+    def test_search_completed(self):
+        opened = [self._create_workorder(WorkOrder.STATUS_OPENED, day)
+                  for day in [3, 1, 2]]
+        waiting = self._create_workorder(WorkOrder.STATUS_WORK_WAITING, 1)
+        # Not in any of the columns
+        self._create_workorder(WorkOrder.STATUS_CANCELLED, 1)
+
+        self.view.search_completed(self.store.find(WorkOrderView))
+        self.assertEqual(self._get_items(WorkOrder.STATUS_OPENED),
+                         [opened[1], opened[2]])
+        self.assertTrue(self.columns[WorkOrder.STATUS_OPENED].has_more)
+        self.assertEqual(self._get_items(WorkOrder.STATUS_WORK_WAITING),
+                         [waiting])
+        self.assertFalse(self.columns[WorkOrder.STATUS_WORK_WAITING].has_more)
+        self.assertEqual(self._get_items(WorkOrder.STATUS_WORK_FINISHED), [])
+
+    def test_update_changed(self):
+        opened = [self._create_workorder(WorkOrder.STATUS_OPENED, day)
+                  for day in [1, 2, 3]]
+        waiting = [self._create_workorder(WorkOrder.STATUS_WORK_WAITING, day)
+                   for day in [1, 3]]
+        self.view.search_completed(self.store.find(WorkOrderView))
+
+        # Nothing changed
+        with mock.patch.object(self.view, '_load_work_orders') as load:
+            self.view.update_changed()
+            self.assertNotCalled(load)
+
+        # A changed work order moves to the right position of its new column
+        opened[1].status = WorkOrder.STATUS_WORK_WAITING
+        self.view.update_changed()
+        self.assertEqual(self._get_items(WorkOrder.STATUS_OPENED),
+                         [opened[0]])
+        self.assertEqual(self._get_items(WorkOrder.STATUS_WORK_WAITING),
+                         [waiting[0], opened[1], waiting[1]])
+
+        # And is removed when it doesn't belong to any column anymore
+        opened[0].status = WorkOrder.STATUS_CANCELLED
+        self.view.update_changed()
+        self.assertEqual(self._get_items(WorkOrder.STATUS_OPENED), [])
+        self.assertEqual(self._get_items(WorkOrder.STATUS_WORK_WAITING),
+                         [waiting[0], opened[1], waiting[1]])
+
+
 class TestServices(BaseGUITest):
     def test_initial(self):
         api.sysparam.set_bool(self.store, 'SMART_LIST_LOADING', True)
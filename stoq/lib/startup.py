@@ -31,7 +31,8 @@ import sys
 
 from kiwi.component import provide_utility
 from stoqlib.database.migration import StoqlibSchemaMigration
-from stoqlib.database.debug import enable as enable_debugging
+from stoqlib.database.debug import (enable as enable_debugging,
+                                    enable_query_profiler)
 from stoqlib.database.runtime import (get_default_store,
                                       set_current_branch_station)
 from stoqlib.exceptions import DatabaseError
@@ -113,6 +114,11 @@ def setup(config=None, options=None, register_station=True, check_schema=True,
     if options and options.sqldebug:
         enable_debugging()
 
+    # Use a .json file for a report or anything else for flamegraphs
+    profile_filename = os.environ.get('STOQ_QUERY_PROFILE')
+    if profile_filename:
+        enable_query_profiler(profile_filename)
+
     from stoq.lib.applist import ApplicationDescriptions
     provide_utility(IApplicationDescriptions, ApplicationDescriptions(),
                     replace=True)
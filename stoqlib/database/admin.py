@@ -43,7 +43,8 @@ from stoqdrivers.constants import describe_constant
 from stoqlib.database.expr import TransactionTimestamp
 from stoqlib.database.interfaces import ICurrentBranch, ICurrentUser
 from stoqlib.database.migration import StoqlibSchemaMigration
-from stoqlib.database.runtime import get_default_store, new_store
+from stoqlib.database.runtime import (clear_references_cache,
+                                      get_default_store, new_store)
 from stoqlib.database.settings import db_settings
 from stoqlib.domain.person import (Branch, Company, Employee, EmployeeRole,
                                    Individual, LoginUser, Person, SalesPerson)
@@ -331,6 +332,7 @@ def create_base_schema():
     schema = _get_latest_schema()
     if db_settings.execute_sql(schema) != 0:
         error(u'Failed to create base schema')
+    clear_references_cache()
 
     migration = StoqlibSchemaMigration()
     migration.apply_all_patches()
@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+# vi:si:et:sw=4:sts=4:ts=4
+
+##
+## Copyright (C) 2016 Stoq Tecnologia <http://stoq.link>
+## All rights reserved
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU Lesser General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU Lesser General Public License
+## along with this program; if not, write to the Free Software
+## Foundation, Inc., or visit: http://www.gnu.org/.
+##
+## Author(s): Stoq Team <stoq-devel@async.com.br>
+##
+
+
+"""Archiving of old rows from the history tables
+
+Some tables only get new rows appended to them and are almost never read
+after some time, but after a few years they end up being most of the
+database, slowing down vacuum, backups and every query done on them.
+
+The rows older than a closed period can be moved from those tables to
+yearly partitions on the ``archive`` schema, together with their
+``transaction_entry``. The application never reads from that schema, so
+it can be left out of the daily backups and the partitions can be detached
+(dumped to a file and dropped) when they are not needed anymore.
+
+The partitions have the same columns as the original tables, so the old
+data can still be queried when needed, for example::
+
+  SELECT * FROM archive.stock_transaction_history_2015 WHERE ...
+"""
+
+import collections
+import datetime
+import logging
+
+from stoqlib.database.settings import db_settings
+from stoqlib.exceptions import DatabaseError
+from stoqlib.lib.dateutils import localtoday
+
+log = logging.getLogger(__name__)
+
+#: The database schema where the archive partitions are created
+ARCHIVE_SCHEMA = u'archive'
+
+#: A table that can be archived. *date_expr* is the SQL expression giving
+#: the date of each row and *query*, when not ``None``, restricts the rows
+#: that can be moved (e.g. to skip the ones referenced by other tables).
+#: *has_te* tells if the rows have a ``transaction_entry`` to be archived
+#: together with them.
+ArchivableTable = collections.namedtuple(
+    'ArchivableTable', ['name', 'date_expr', 'query', 'has_te'])
+
+#: The tables archived by default
+ARCHIVABLE_TABLES = [
+    ArchivableTable(
+        u'stock_transaction_history', u'date',
+        (u'NOT EXISTS (SELECT 1 FROM cost_center_entry WHERE '
+         u'cost_center_entry.stock_transaction_id = '
+         u'stock_transaction_history.id)'),
+        True),
+    ArchivableTable(
+        u'product_history',
+        (u'COALESCE(sold_date, received_date, production_date, '
+         u'decreased_date)'),
+        None, True),
+    ArchivableTable(u'event', u'date', None, False),
+]
+
+
+def get_partition_name(table_name, year):
+    """Get the name of the archive partition of a table for a year
+
+    :param table_name: the name of the archived table
+    :param year: the year of the rows on the partition
+    :returns: the partition name, qualified with the archive schema
+    """
+    return u'%s.%s_%d' % (ARCHIVE_SCHEMA, table_name, year)
+
+
+def get_archive_partitions(store):
+    """Get the partitions created on the archive schema
+
+    :param store: a store
+    :returns: a list of partition names, qualified with the archive schema
+    """
+    results = store.execute(
+        u"""SELECT table_name FROM information_schema.tables
+            WHERE table_schema = ? ORDER BY table_name""", (ARCHIVE_SCHEMA, ))
+    return [u'%s.%s' % (ARCHIVE_SCHEMA, name) for name, in results]
+
+
+def _get_partition(store, table_name, date_expr, year):
+    partition = get_partition_name(table_name, year)
+    if partition in get_archive_partitions(store):
+        return partition
+
+    # Only the columns are copied. The partitions are not used by the
+    # application, so they don't need the defaults, rules, indexes and
+    # foreign keys the original tables have.
+    store.execute(u'CREATE TABLE %s (LIKE %s)' % (partition, table_name))
+    if date_expr is None:
+        return partition
+
+    store.execute(
+        u"""ALTER TABLE %s ADD CONSTRAINT period_check
+            CHECK (%s >= '%d-01-01' AND %s < '%d-01-01')""" % (
+            partition, date_expr, year, date_expr, year + 1))
+    return partition
+
+
+def _archive_year(store, table, year, query, params):
+    partition = _get_partition(store, table.name, table.date_expr, year)
+    moved = u"""moved AS (
+                  DELETE FROM %s WHERE %s RETURNING %s.*)""" % (
+        table.name, query, table.name)
+    if not table.has_te:
+        return partition, store.execute(
+            u'WITH %s INSERT INTO %s SELECT * FROM moved' % (
+                moved, partition), params).rowcount
+
+    count = store.execute(
+        u"""WITH %s, archived AS (
+                INSERT INTO %s SELECT * FROM moved RETURNING te_id)
+            INSERT INTO _archived_te SELECT te_id FROM archived""" % (
+            moved, partition), params).rowcount
+
+    # The transaction entries are not referenced by anything else now. They
+    # are partitioned by the date of their rows, since te_time is the date
+    # of the last change and could be on any year after it.
+    te_partition = _get_partition(store, u'transaction_entry', None, year)
+    store.execute(
+        u"""WITH moved AS (
+                DELETE FROM transaction_entry
+                WHERE id IN (SELECT id FROM _archived_te)
+                RETURNING transaction_entry.*)
+            INSERT INTO %s SELECT * FROM moved""" % (te_partition, ))
+    store.execute(u'DELETE FROM _archived_te')
+    return partition, count
+
+
+def archive_history(store, until, tables=None):
+    """Move the rows older than a date to the archive partitions
+
+    The rows are moved to one partition per table and year, created when
+    needed with a check constraint on its period. The ``transaction_entry``
+    of the moved rows are moved as well, to the ``transaction_entry``
+    partitions.
+
+    :param store: a store
+    :param until: a date, the rows before it will be archived. It cannot be
+      after today, since only closed periods can be archived
+    :param tables: a list of :class:`ArchivableTable` to archive, or
+      ``None`` to use :obj:`ARCHIVABLE_TABLES`
+    :returns: a dict mapping the partition names to the number of rows
+      moved to them
+    """
+    until = datetime.datetime(until.year, until.month, until.day)
+    if until > localtoday():
+        raise ValueError("Only closed periods can be archived")
+
+    store.execute(u'CREATE SCHEMA IF NOT EXISTS %s' % (ARCHIVE_SCHEMA, ))
+    store.execute(u"""CREATE TEMPORARY TABLE IF NOT EXISTS _archived_te
+                      (id bigint) ON COMMIT DROP""")
+
+    archived = {}
+    for table in tables or ARCHIVABLE_TABLES:
+        query = u'%s < ?' % (table.date_expr, )
+        if table.query is not None:
+            query = u'%s AND %s' % (query, table.query)
+        years = store.execute(
+            u'SELECT DISTINCT EXTRACT(YEAR FROM %s) FROM %s WHERE %s' % (
+                table.date_expr, table.name, query), (until, ))
+
+        for year in sorted(int(year) for year, in years):
+            start = datetime.datetime(year, 1, 1)
+            end = min(datetime.datetime(year + 1, 1, 1), until)
+            partition, count = _archive_year(
+                store, table, year,
+                u'%s >= ? AND %s' % (table.date_expr, query), (start, end))
+            log.info("Archived %d rows from %s to %s" % (
+                count, table.name, partition))
+            archived[partition] = archived.get(partition, 0) + count
+
+    return archived
+
+
+def detach_partition(store, partition, filename):
+    """Dump an archive partition to a file and drop it
+
+    The partition is dumped using another connection, so everything archived
+    on it needs to be committed before detaching it.
+
+    :param store: a store
+    :param partition: the partition name, qualified with the archive schema
+    :param filename: the file to dump the partition to. It can be restored
+      later using ``pg_restore``
+    """
+    if partition not in get_archive_partitions(store):
+        raise ValueError("%s is not an archive partition" % (partition, ))
+
+    proc = db_settings.dump_table(partition, filename, data_only=False)
+    if proc.wait() != 0:
+        raise DatabaseError("Could not dump %s to %s" % (partition, filename))
+    store.execute(u'DROP TABLE %s' % (partition, ))
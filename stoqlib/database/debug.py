@@ -21,15 +21,22 @@
 ## Author(s): Stoq Team <stoq-devel@async.com.br>
 ##
 
+import atexit
+import collections
 import datetime
+import json
+import logging
 import os
+import re
 import sys
 import platform
 import struct
+import threading
+import time
 
 import psycopg2
 
-from storm.tracer import BaseStatementTracer, install_tracer
+from storm.tracer import BaseStatementTracer, install_tracer, remove_tracer_type
 
 try:
     from sqlparse import engine, filters, sql
@@ -38,6 +45,9 @@ except ImportError:
     has_sqlparse = False
 
 
+log = logging.getLogger(__name__)
+
+
 # http://stackoverflow.com/questions/566746/how-to-get-console-window-width-in-python
 def getTerminalSize():
     if platform.system() != 'Linux':
@@ -256,5 +266,302 @@ class StoqlibDebugTracer(BaseStatementTracer):
         self.header(pid, color, 'CLOSE')
 
 
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PARAMS_LIST_RE = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+_SPACES_RE = re.compile(r"\s+")
+
+# Frames from the database layer itself are skipped when looking
+# for the code that issued a statement
+_DATABASE_DIR = os.path.dirname(os.path.abspath(__file__))
+_STORM_DIR = os.path.join('storm', '')
+
+
+def get_statement_fingerprint(statement):
+    """Normalize a statement so that statements of the same shape are equal
+
+    Literal strings and numbers are replaced by ``?``, as are the query
+    parameters, and lists of parameters (e.g. inside an ``IN``) are collapsed
+    into a single one.
+
+    >>> get_statement_fingerprint(
+    ...     "SELECT * FROM sale WHERE id IN (%s, %s) AND  status = 'open'")
+    'SELECT * FROM sale WHERE id IN (?) AND status = ?'
+
+    :param statement: the statement sent to the database
+    :returns: the normalized statement
+    """
+    statement = _STRING_RE.sub('?', statement)
+    statement = statement.replace('%s', '?')
+    statement = _NUMBER_RE.sub('?', statement)
+    statement = _PARAMS_LIST_RE.sub('(?)', statement)
+    return _SPACES_RE.sub(' ', statement).strip()
+
+
+class QueryStats(object):
+    """Statistics of the statements with the same fingerprint and call site"""
+
+    def __init__(self, fingerprint, call_site):
+        self.fingerprint = fingerprint
+        self.call_site = call_site
+        self.count = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.rows = 0
+        #: the biggest number of times the statement was executed
+        #: in a single operation
+        self.max_per_operation = 0
+
+    def to_dict(self):
+        return dict(fingerprint=self.fingerprint,
+                    call_site=self.call_site,
+                    count=self.count,
+                    total_time=self.total_time,
+                    max_time=self.max_time,
+                    rows=self.rows,
+                    max_per_operation=self.max_per_operation)
+
+
+class StoqlibQueryProfiler(object):
+    """A low overhead tracer that aggregates the executed statements
+
+    Statements are aggregated by their fingerprint (see
+    :func:`get_statement_fingerprint`) and the python call site that issued
+    them, recording how many times they were executed, how long they took
+    and how many rows they affected.
+
+    An operation is what happens between two commits of a store, or
+    an explicit :meth:`.operation` block. When the same statement is
+    executed by the same call site more than *n_plus_one_threshold* times
+    in one operation, it is considered a N+1 candidate: something that
+    should probably be fetched with a single query.
+    """
+
+    def __init__(self, n_plus_one_threshold=10, collect_stacks=False,
+                 stack_depth=40):
+        """
+        :param n_plus_one_threshold: the number of times a statement
+            can be executed in the same operation before being considered
+            a N+1 candidate
+        :param collect_stacks: if the whole python stack should be recorded,
+            which is needed by :meth:`.dump_collapsed`
+        :param stack_depth: the maximum depth of the recorded stacks
+        """
+        self.n_plus_one_threshold = n_plus_one_threshold
+        self.collect_stacks = collect_stacks
+        self.stack_depth = stack_depth
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.reset()
+
+    #
+    #  Public API
+    #
+
+    def reset(self):
+        """Forget everything that was recorded"""
+        with self._lock:
+            self._stats = {}
+            self._stacks = collections.Counter()
+            self._operations = {}
+
+    def install(self):
+        install_tracer(self)
+
+    def remove(self):
+        remove_tracer_type(type(self))
+
+    def start_operation(self, name=None):
+        """Start a new operation in the current thread
+
+        :param name: the name of the operation, used on the log when
+            a N+1 candidate is found
+        """
+        self._local.operation = name
+        self._local.counts = collections.Counter()
+
+    def get_stats(self):
+        """Get the recorded statistics
+
+        :returns: a list of :class:`QueryStats`, the slowest first
+        """
+        with self._lock:
+            stats = list(self._stats.values())
+        return sorted(stats, key=lambda s: s.total_time, reverse=True)
+
+    def get_n_plus_one_candidates(self):
+        """Get the statements that looks like N+1 queries
+
+        :returns: a list of :class:`QueryStats`, the most executed first
+        """
+        return sorted(
+            [s for s in self.get_stats()
+             if s.max_per_operation > self.n_plus_one_threshold],
+            key=lambda s: s.max_per_operation, reverse=True)
+
+    def dump_json(self, stream):
+        """Write a report of the recorded statistics as json
+
+        :param stream: a file like object
+        """
+        json.dump(dict(
+            statements=[s.to_dict() for s in self.get_stats()],
+            n_plus_one=[s.to_dict() for s in self.get_n_plus_one_candidates()],
+        ), stream, indent=2)
+
+    def dump_collapsed(self, stream):
+        """Write the recorded stacks in the collapsed format
+
+        Each line has the frames separated by ``;`` followed by the time
+        spent in microseconds, the format expected by flamegraph.pl and
+        similar tools. The stacks are only recorded when *collect_stacks*
+        is ``True``.
+
+        :param stream: a file like object
+        """
+        with self._lock:
+            stacks = list(self._stacks.items())
+        for stack, value in sorted(stacks):
+            stream.write('%s %d\n' % (';'.join(stack), value))
+
+    def dump(self, filename):
+        """Write a report to the given file
+
+        Files ending with ``.json`` will be written by :meth:`.dump_json`,
+        anything else by :meth:`.dump_collapsed`.
+
+        :param filename: the file to write to
+        """
+        with open(filename, 'w') as f:
+            if filename.endswith('.json'):
+                self.dump_json(f)
+            else:
+                self.dump_collapsed(f)
+        log.info("Query profile written to %s", filename)
+
+    #
+    #  Private
+    #
+
+    def _get_call_site(self):
+        frame = sys._getframe(2)
+        while frame is not None:
+            filename = frame.f_code.co_filename
+            if (os.path.dirname(filename) != _DATABASE_DIR and
+                    _STORM_DIR not in filename):
+                break
+            frame = frame.f_back
+        if frame is None:
+            return '<unknown>', frame
+
+        return '%s:%d:%s' % (frame.f_code.co_filename, frame.f_lineno,
+                             frame.f_code.co_name), frame
+
+    def _get_stack(self, frame):
+        stack = []
+        while frame is not None and len(stack) < self.stack_depth:
+            code = frame.f_code
+            stack.append('%s:%s' % (
+                os.path.basename(code.co_filename), code.co_name))
+            frame = frame.f_back
+        stack.reverse()
+        return tuple(stack)
+
+    def _get_operation_counts(self):
+        counts = getattr(self._local, 'counts', None)
+        if counts is None:
+            self.start_operation()
+            counts = self._local.counts
+        return counts
+
+    def _record(self, statement, rows):
+        start = getattr(self._local, 'start', None)
+        if start is None:
+            return
+        elapsed = time.time() - start
+        self._local.start = None
+
+        fingerprint = get_statement_fingerprint(statement)
+        call_site, frame = self._get_call_site()
+        key = (fingerprint, call_site)
+
+        counts = self._get_operation_counts()
+        counts[key] += 1
+        count = counts[key]
+
+        with self._lock:
+            stats = self._stats.get(key)
+            if stats is None:
+                stats = self._stats[key] = QueryStats(fingerprint, call_site)
+            stats.count += 1
+            stats.total_time += elapsed
+            stats.max_time = max(stats.max_time, elapsed)
+            stats.rows += max(rows, 0)
+            stats.max_per_operation = max(stats.max_per_operation, count)
+            if self.collect_stacks and frame is not None:
+                self._stacks[self._get_stack(frame)] += int(elapsed * 10 ** 6)
+
+        # Only log once per operation, when the threshold is crossed
+        if count == self.n_plus_one_threshold + 1:
+            log.warning("Possible N+1 query on operation %r at %s: %s",
+                        self._local.operation, call_site, fingerprint)
+
+    #
+    #  Tracer
+    #
+
+    def connection_raw_execute(self, connection, raw_cursor, statement,
+                               params):
+        self._local.start = time.time()
+
+    def connection_raw_execute_success(self, connection, raw_cursor,
+                                       statement, params):
+        self._record(statement, raw_cursor.rowcount)
+
+    def connection_raw_execute_error(self, connection, raw_cursor,
+                                     statement, params, error):
+        self._record(statement, 0)
+
+    def transaction_commit(self, store):
+        self.start_operation()
+
+    def transaction_close(self, store):
+        self.start_operation()
+
+
+_profiler = None
+
+
 def enable():
     install_tracer(StoqlibDebugTracer())
+
+
+def enable_query_profiler(filename=None, collect_stacks=None):
+    """Install a :class:`StoqlibQueryProfiler`
+
+    When the ``STOQ_QUERY_PROFILE`` environment variable is set, this
+    will be called on startup using it as *filename*.
+
+    :param filename: if not ``None``, a report will be written to this
+        file when the application exits. See :meth:`StoqlibQueryProfiler.dump`
+    :param collect_stacks: if the stacks should be collected. If ``None``,
+        they will be collected only if *filename* is not a json file
+    :returns: the profiler
+    """
+    global _profiler
+    if _profiler is None:
+        if collect_stacks is None:
+            collect_stacks = bool(filename and not filename.endswith('.json'))
+        _profiler = StoqlibQueryProfiler(collect_stacks=collect_stacks)
+        _profiler.install()
+        if filename is not None:
+            atexit.register(_profiler.dump, filename)
+    return _profiler
+
+
+def get_query_profiler():
+    """Get the installed :class:`StoqlibQueryProfiler`
+
+    :returns: the profiler or ``None`` if it was not enabled
+    """
+    return _profiler
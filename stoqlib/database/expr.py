@@ -155,6 +155,20 @@ class SplitPart(NamedFunc):
     name = "split_part"
 
 
+class Right(NamedFunc):
+    """Return the last n characters of the string"""
+    # http://www.postgresql.org/docs/9.1/static/functions-string.html
+    __slots__ = ()
+    name = "RIGHT"
+
+
+class RegexpReplace(NamedFunc):
+    """Replace the substrings matching a POSIX regular expression"""
+    # http://www.postgresql.org/docs/9.1/static/functions-string.html
+    __slots__ = ()
+    name = "REGEXP_REPLACE"
+
+
 class ArrayAgg(NamedFunc):
     __slots__ = ()
     name = "array_agg"
@@ -37,7 +37,8 @@ import traceback
 
 from kiwi.environ import environ
 
-from stoqlib.database.runtime import get_default_store, new_store
+from stoqlib.database.runtime import (clear_references_cache,
+                                      get_default_store, new_store)
 from stoqlib.database.settings import db_settings, check_extensions
 from stoqlib.domain.plugin import InstalledPlugin
 from stoqlib.domain.profile import update_profile_applications
@@ -139,6 +140,9 @@ class Patch(object):
         else:
             raise AssertionError("Unknown filename: %s" % (self.filename, ))
 
+        # The patch may have added or removed foreign keys
+        clear_references_cache()
+
     def get_version(self):
         """Returns the patch version
         :returns: a tuple with the patch generation and level
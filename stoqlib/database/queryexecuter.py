@@ -24,8 +24,10 @@
 Kiwi integration for Stoq/Storm
 """
 
+import collections
 import re
 import threading
+import time
 import queue
 
 from gi.repository import GLib, GObject
@@ -33,7 +35,9 @@ from kiwi.python import Settable
 from kiwi.utils import gsignal
 from storm import Undef
 from storm.database import Connection, convert_param_marks
-from storm.expr import compile, And, Or, Like, Not, Alias, State, Lower
+from storm.expr import (compile, And, Or, Like, Not, Alias, State, Lower,
+                        Expr, SQL, Table)
+from storm.info import get_cls_info
 from storm.tracer import trace
 import psycopg2
 import psycopg2.extensions
@@ -321,6 +325,197 @@ class _OperationExecuter(threading.Thread):
         self._queue.put(operation)
 
 
+class CachedResultSet(object):
+    """Resultset returned by :class:`QueryExecuter` when using a
+    :class:`SearchResultCache`.
+
+    Just like :class:`AsyncResultSet`, the objects are built from the rows
+    stored in the cache on iteration, and methods that are not defined here
+    will be forwarded to the original resultset.
+    """
+
+    def __init__(self, resultset, result, rows):
+        """
+        :param resultset: the original
+            :class:stoqlib.database.runtime.StoqlibResultset`. It will
+            be used to construct the objects on iteration
+        :param result: the :class:`storm.database.Result` that queried
+            the rows. Used to convert the values to storm variables
+        :param rows: a sequence of the raw values of each row
+        """
+        self.resultset = resultset
+        self._result = result
+        self._rows = rows
+
+    def __iter__(self):
+        for values in self._rows:
+            yield self.resultset._load_objects(self._result, values)
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __getattr__(self, attr):
+        return getattr(self.resultset, attr)
+
+    def count(self):
+        return len(self._rows)
+
+    def fast_iter(self):
+        return self.resultset.fast_load(self._rows)
+
+
+class SearchResultCache(object):
+    """A size bounded LRU cache for search results
+
+    The results are stored as the raw values returned by the database,
+    keyed on the compiled statement and its parameters. Each entry also
+    stores the greatest ``te_time`` of the database when it was fetched.
+
+    When that moves, the entry is only considered stale if one of the
+    newer transaction entries belongs to a table involved in the query,
+    including the ones used only on subqueries, or was created when rows
+    were removed from one of them. Checking that looks only at the entries
+    newer than the cached ones, through the ``te_time`` index, so it is
+    a lot cheaper than the heavy aggregations done by some viewables.
+
+    Tables without a transaction entry can't be checked like that, so
+    results involving them are stale after any modification. Since the
+    ``te_time`` is set before the transaction commits, entries also
+    expire after *max_age* seconds.
+    """
+
+    #: The query used to know if something changed since a result was cached
+    version_query = "SELECT MAX(te_time) FROM transaction_entry"
+
+    def __init__(self, maxsize=20, max_age=60):
+        """
+        :param maxsize: the maximum number of results to keep
+        :param max_age: the number of seconds a result is kept
+        """
+        self.maxsize = maxsize
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = collections.OrderedDict()
+
+    #
+    #  Public API
+    #
+
+    def get_resultset(self, store, resultset):
+        """Get a result set for *resultset* using the cache when possible
+
+        :param store: the store used to execute the query
+        :param resultset: a :class:`stoqlib.database.runtime.StoqlibResultSet`
+        :returns: a :class:`CachedResultSet`
+        """
+        select = resultset._get_select()
+        state = State()
+        statement = compile(select, state)
+        key = (statement,
+               repr(tuple(Connection.to_database(state.parameters))))
+        version = store.execute(self.version_query).get_one()[0]
+        now = time.monotonic()
+
+        entry = self._entries.get(key)
+        if (entry is not None and now - entry[1] < self.max_age and
+                not self._has_changes(store, entry[0], version, select)):
+            self.hits += 1
+            # Only the entries newer than this need to be checked next time
+            self._entries[key] = (version, ) + entry[1:]
+            self._entries.move_to_end(key)
+            return CachedResultSet(resultset, entry[2], entry[3])
+
+        self.misses += 1
+        result = store._connection.execute(select)
+        rows = result.get_all()
+        self._entries[key] = (version, now, result, rows)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+        return CachedResultSet(resultset, result, rows)
+
+    def get_stats(self):
+        """Get statistics about this cache
+
+        :returns: a dict containing the number of hits, misses,
+            evictions and entries of this cache
+        """
+        return dict(hits=self.hits,
+                    misses=self.misses,
+                    evictions=self.evictions,
+                    entries=len(self._entries))
+
+    def clear(self):
+        """Remove all the results from the cache"""
+        self._entries.clear()
+
+    #
+    #  Private
+    #
+
+    def _get_tables(self, select):
+        tables = set()
+        untracked = set()
+        seen = set()
+
+        def add(expr):
+            if isinstance(expr, (list, tuple)):
+                for e in expr:
+                    add(e)
+            elif isinstance(expr, (type, Expr)):
+                if id(expr) in seen:
+                    return
+                seen.add(id(expr))
+                if isinstance(expr, type):
+                    if not hasattr(expr, '__storm_table__'):
+                        return
+                    # ClassAlias point to the class they are aliasing
+                    cls = get_cls_info(expr).cls
+                    if hasattr(cls, 'te_id'):
+                        tables.add(cls.__storm_table__)
+                    else:
+                        untracked.add(cls.__storm_table__)
+                elif isinstance(expr, Table):
+                    untracked.add(expr.name)
+                elif isinstance(expr, SQL):
+                    # There is no way to know what a raw query uses
+                    untracked.add(expr.expr)
+                else:
+                    for klass in type(expr).__mro__:
+                        slots = getattr(klass, '__slots__', ())
+                        if isinstance(slots, str):
+                            slots = [slots]
+                        for slot in slots:
+                            add(getattr(expr, slot, None))
+                    add(list(getattr(expr, '__dict__', {}).values()))
+
+        add(select)
+        return sorted(tables), untracked
+
+    def _has_changes(self, store, since, version, select):
+        if since == version:
+            return False
+
+        tables, untracked = self._get_tables(select)
+        if since is None or untracked or not tables:
+            return True
+
+        conditions = [
+            'EXISTS (SELECT 1 FROM "{0}" '
+            'WHERE "{0}".te_id = transaction_entry.id)'.format(table)
+            for table in tables]
+        # The entries created when rows were removed from the tables
+        conditions.append("transaction_entry.metadata->>'removed_from' "
+                          "IN ({})".format(', '.join(['%s'] * len(tables))))
+        query = ("SELECT 1 FROM transaction_entry WHERE te_time > %s AND "
+                 "({}) LIMIT 1".format(' OR '.join(conditions)))
+        return store.execute(query, [since] + tables).get_one() is not None
+
+
 class QueryExecuter(object):
     """
     A QueryExecuter is responsible for taking the state (as in QueryState)
@@ -341,6 +536,7 @@ class QueryExecuter(object):
         self._query = self._default_query
         self.post_result = None
         self._operation_executer = _OperationExecuter.get_instance()
+        self._result_cache = None
 
     # Public API
 
@@ -367,9 +563,12 @@ class QueryExecuter(object):
             order_by = self.order_by
 
         if order_by:
-            return resultset.order_by(order_by)
-        else:
-            return resultset
+            resultset = resultset.order_by(order_by)
+
+        # Lazy searches are paginated by the view itself and cannot be cached
+        if self._result_cache is not None and limit > 0:
+            return self._result_cache.get_resultset(self.store, resultset)
+        return resultset
 
     def search_async(self, states=None, resultset=None, limit=None):
         """
@@ -426,6 +625,29 @@ class QueryExecuter(object):
     def get_limit(self):
         return self._limit
 
+    def enable_result_cache(self, cache=None):
+        """Cache the results of the searches done by this executer
+
+        Note that only searches with a limit will be cached.
+
+        :param cache: a :class:`SearchResultCache` or ``None`` to create
+          a new one
+        """
+        if cache is None:
+            cache = SearchResultCache()
+        self._result_cache = cache
+
+    def disable_result_cache(self):
+        """Stop caching the results of the searches"""
+        self._result_cache = None
+
+    def get_result_cache(self):
+        """Get the :class:`SearchResultCache` used by this executer
+
+        :returns: the cache or ``None`` if it is not enabled
+        """
+        return self._result_cache
+
     def set_filter_columns(self, search_filter, columns, use_having=False):
         """Set what columns should be filtered for the search_filter
 
@@ -23,7 +23,8 @@
 ##
 """ Runtime routines for applications"""
 
-from collections import namedtuple
+from collections import namedtuple, OrderedDict
+import itertools
 import logging
 import sys
 import warnings
@@ -32,10 +33,13 @@ import os
 
 from kiwi.component import get_utility, provide_utility
 from storm import Undef
-from storm.expr import SQL, Avg
+from storm.expr import SQL, Alias, Avg, Count, Expr, Select, State
 from storm.info import get_obj_info
+from storm.properties import PropertyColumn
+from storm.references import Reference
 from storm.store import Store, ResultSet, PENDING_REMOVE, PENDING_ADD
 from storm.tracer import trace
+from storm.variables import Variable
 
 from stoqlib.database.exceptions import InterfaceError, OperationalError
 from stoqlib.database.interfaces import (
@@ -43,7 +47,7 @@ from stoqlib.database.interfaces import (
     ICurrentBranchStation, ICurrentUser)
 from stoqlib.database.expr import is_sql_identifier
 from stoqlib.database.orm import ORMObject
-from stoqlib.database.properties import Identifier
+from stoqlib.database.properties import Identifier, IdentifierCol
 from stoqlib.database.settings import db_settings
 from stoqlib.database.viewable import Viewable
 from stoqlib.exceptions import DatabaseError, LoginError
@@ -63,6 +67,14 @@ _default_store = None
 #: should not be used by anything except autoreload_object()
 _stores = weakref.WeakSet()
 
+#: a map of (table, column) -> list of foreign keys referencing it,
+#: shared by all stores. See :meth:`StoqlibStore.list_references`
+_references_map = None
+
+#: used to give an unique name to the cursors of
+#: :meth:`StoqlibResultSet.fetch_chunks`
+_cursor_counter = itertools.count()
+
 
 def autoreload_object(obj, obj_store=False):
     """Autoreload object in any other existing store.
@@ -98,6 +110,18 @@ class StoqlibResultSet(ResultSet):
         # ResultSet.avg() is not used because storm returns it as a float
         return self._aggregate(Avg, attribute)
 
+    def prefetch(self, *paths):
+        """Fetch the objects of this result set and their references
+
+        See :meth:`StoqlibStore.prefetch` for more information.
+
+        :param paths: reference paths, e.g. ``'sellable.product'``
+        :returns: a list with the objects of this result set
+        """
+        objects = list(self)
+        self._store.prefetch(objects, *paths)
+        return objects
+
     def set_viewable(self, viewable):
         """Configures this result set to load the results as instances of the
         given viewable.
@@ -176,7 +200,124 @@ class StoqlibResultSet(ResultSet):
         else:
             return objects[0]
 
+    def get_select(self):
+        """Get the select statement used to fetch this result set
+
+        This is useful to reuse the query of a search, with all of its
+        filters, as a subselect projecting other columns.
+
+        :returns: a :class:`storm.expr.Select`
+        """
+        return self._get_select()
+
+    def count(self, *args, **kwargs):
+        # ResultSet.count() doesn't support a group_by, which is used by
+        # some viewables. Count the rows of the query as a subselect instead
+        if self._group_by is Undef or args or kwargs:
+            return super(StoqlibResultSet, self).count(*args, **kwargs)
+
+        select = self._get_select()
+        # Ordering doesn't matter for counting
+        select.order_by = Undef
+        result = self._store._connection.execute(
+            Select(Count(), tables=Alias(select, '_count')))
+        return result.get_one()[0]
+
+    def get_projection(self, attributes):
+        """Get the columns of the results of this result set by attribute
+
+        This is useful to fetch only some values of the results, with
+        :meth:`.fetch_chunks`, instead of loading the whole objects.
+
+        :param attributes: a list of attribute names of the viewable or
+            domain class being queried
+        :returns: a list with one column for each attribute or ``None`` if
+            any of them is not a column or an expression (e.g. it is a
+            python property or a reference)
+        """
+        if hasattr(self, '_viewable'):
+            spec = self._viewable
+        elif not self._find_spec.is_tuple:
+            spec = self._find_spec.default_cls_info.cls
+        else:
+            return None
+
+        columns = []
+        for attr in attributes:
+            column = getattr(spec, attr, None)
+            if not isinstance(column, Expr):
+                return None
+            # The prefix of the identifiers depends on the branch of the
+            # whole object
+            if (isinstance(column, PropertyColumn) and
+                    issubclass(column.variable_factory.func,
+                               IdentifierCol.variable_class)):
+                return None
+            columns.append(column)
+        return columns
+
+    def fetch_chunks(self, columns=None, chunk_size=1000):
+        """Fetch the results of this result set in chunks
+
+        The query is executed only once, through a server side cursor,
+        and the results are fetched from it *chunk_size* at a time. That
+        way they don't need to be all loaded in memory at once and are
+        returned in the order of this result set.
+
+        Note that the cursor only exists until the end of the transaction.
+
+        :param columns: if not ``None``, only those columns will be
+            fetched (see :meth:`.get_projection`) and each result will be
+            a tuple with their values, instead of a whole object
+        :param chunk_size: how many results will be fetched each time
+        :returns: an iterator of lists of results, one for each chunk
+        """
+        select = self._get_select()
+        if columns is not None:
+            select.columns = columns
+
+        connection = self._store._connection
+        state = State()
+        statement = connection.compile(select, state)
+        cursor_name = '_fetch_chunks_%d' % (next(_cursor_counter), )
+        connection.execute('DECLARE %s NO SCROLL CURSOR FOR %s' % (
+            cursor_name, statement), state.parameters, noresult=True)
+
+        while True:
+            result = connection.execute('FETCH %d FROM %s' % (
+                chunk_size, cursor_name))
+            rows = result.get_all()
+            if columns is None:
+                results = [self._load_objects(result, values)
+                           for values in rows]
+            else:
+                results = []
+                for values in rows:
+                    row = []
+                    for column, value in zip(columns, values):
+                        # Left joins may return NULL for any column
+                        variable = getattr(column, 'variable_factory',
+                                           Variable)(allow_none=True)
+                        result.set_variable(variable, value)
+                        row.append(variable.get())
+                    results.append(tuple(row))
+
+            if results:
+                yield results
+            if len(rows) < chunk_size:
+                break
+
+        connection.execute('CLOSE %s' % (cursor_name, ), noresult=True)
+
     def fast_iter(self):
+        return self.fast_load(self._store._connection.execute(self._get_select()))
+
+    def fast_load(self, rows):
+        """Load the given raw database rows the same way :meth:`.fast_iter` does
+
+        :param rows: an iterable of raw values, as returned by the database
+            for the select of this result set
+        """
         # First build all named tuples
         named_tuples = []
         for is_expr, info in self._find_spec._cls_spec_info:
@@ -188,7 +329,7 @@ class StoqlibResultSet(ResultSet):
 
         is_viewable = hasattr(self, '_viewable')
         # Then interate over the results bypassing storm object creation
-        for values in self._store._connection.execute(self._get_select()):
+        for values in rows:
             value = self._load_fast_object(named_tuples, values)
             if is_viewable:
                 value = self._load_viewable(value)
@@ -241,6 +382,7 @@ class StoqlibStore(Store):
         # When using savepoints, this stack will hold what objects were changed
         # (created, deleted or edited) inside that savepoint.
         self._dirties = [[]]
+        self._transaction_caches = {}
         self.retval = True
         self.obsolete = False
 
@@ -300,6 +442,93 @@ class StoqlibStore(Store):
 
         return resultset
 
+    def prefetch(self, objects, *paths):
+        """Load the references of the given objects in batch
+
+        Walking a reference path like ``item.sellable.product.storable``
+        for each object of a list will do a query for each reference of
+        each object. This will load each step of the paths for all the
+        objects at once, using a single query per step, and link them, so
+        that walking the references afterwards will not need to query the
+        database again, e.g.::
+
+            items = list(sale.get_items())
+            store.prefetch(items, 'sellable.product.storable', 'batch')
+
+        Note that references to objects that do not exist (e.g. the
+        storable of a product that doesn't control its stock) will still
+        query the database when accessed.
+
+        :param objects: a sequence of objects
+        :param paths: reference paths, e.g. ``'sellable.product'``
+        """
+        objects = [obj for obj in objects if obj is not None]
+        for path in paths:
+            current = objects
+            for attr in path.split('.'):
+                if not current:
+                    break
+                current = self._prefetch_reference(current, attr)
+
+    def _prefetch_reference(self, objects, attr):
+        objects_by_class = OrderedDict()
+        for obj in objects:
+            objects_by_class.setdefault(type(obj), []).append(obj)
+
+        # Different objects may reference the same remote object
+        remotes = OrderedDict()
+        for cls, cls_objects in objects_by_class.items():
+            reference = getattr(cls, attr)
+            if not isinstance(reference, Reference):
+                raise TypeError("%s.%s is not a reference" % (
+                    cls.__name__, attr))
+            relation = reference._relation
+            if len(relation.remote_key) != 1:
+                raise TypeError("%s.%s uses a composed key" % (
+                    cls.__name__, attr))
+
+            # Objects that were invalidated (e.g. after a commit) would
+            # be reloaded one by one when accessing their keys
+            to_reload = [obj.id for obj in cls_objects
+                         if relation.get_local_variables(obj)[0].get_lazy()]
+            if to_reload:
+                list(self.find(cls, cls.id.is_in(to_reload)))
+
+            missing = {}
+            for obj in cls_objects:
+                # Do not use relation.get_remote() here, since it would
+                # validate invalidated objects one by one
+                remote = (get_obj_info(obj).get(relation) or {}).get('remote')
+                if (remote is not None and
+                        not get_obj_info(remote).get('invalidated')):
+                    remotes[id(remote)] = remote
+                    continue
+
+                value = relation.get_local_variables(obj)[0].get(to_db=True)
+                if value is None:
+                    continue
+                if relation.remote_key_is_primary:
+                    obj_info = self._alive.get((relation.remote_cls, (value, )))
+                    alive = obj_info and obj_info.get_obj()
+                    if alive is not None and not obj_info.get('invalidated'):
+                        relation.link(obj, alive)
+                        remotes[id(alive)] = alive
+                        continue
+                missing.setdefault(value, []).append(obj)
+
+            if not missing:
+                continue
+
+            remote_key = relation.remote_key[0]
+            for remote in self.find(relation.remote_cls,
+                                    remote_key.is_in(list(missing))):
+                value = relation.get_remote_variables(remote)[0].get(to_db=True)
+                for obj in missing.get(value, []):
+                    relation.link(obj, remote)
+                remotes[id(remote)] = remote
+
+        return list(remotes.values())
+
     def get_lock_database_query(self):
         """
         Fetch a database query that needs to be executed to lock the database,
@@ -359,9 +588,20 @@ class StoqlibStore(Store):
         - update : The ON UPDATE action for the reference. 'a' for 'NO ACTION', 'c'
           for CASCADE
         - delete: The same as update.
+
+        The foreign keys of the whole database are read from the catalog
+        only once per process. Call :func:`clear_references_cache` after
+        changing the schema to have them read again.
         """
+        global _references_map
+        if _references_map is None:
+            _references_map = self._build_references_map()
+
         table_name = str(column.cls.__storm_table__)
         column_name = str(column.name)
+        return list(_references_map.get((table_name, column_name), []))
+
+    def _build_references_map(self):
         query = """
             SELECT DISTINCT
                 src_pg_class.relname AS srctable,
@@ -381,15 +621,16 @@ class StoqlibStore(Store):
                 ON ref_pg_class.oid = ref_pg_attribute.attrelid, generate_series(0,10) pos(n)
             WHERE
                 contype = 'f'
-                AND ref_pg_class.relname = ?
-                AND ref_pg_attribute.attname = ?
                 AND src_pg_attribute.attnum = pg_constraint.conkey[n]
                 AND ref_pg_attribute.attnum = pg_constraint.confkey[n]
                 AND NOT src_pg_attribute.attisdropped
                 AND NOT ref_pg_attribute.attisdropped
             ORDER BY src_pg_class.relname, src_pg_attribute.attname
             """
-        return self.execute(query, (table_name, column_name)).get_all()
+        references = {}
+        for ref in self.execute(query).get_all():
+            references.setdefault((ref[2], ref[3]), []).append(ref)
+        return references
 
     def quote_query(self, query, args=()):
         """Prepare a query for executing it.
@@ -421,6 +662,21 @@ class StoqlibStore(Store):
         if not sysparam.get_bool('SYNCHRONIZED_MODE'):
             self.remove(obj)
 
+    def get_transaction_cache(self, name):
+        """Get a cache that is only valid for the current transaction
+
+        The cache is a dict that will be cleared when the transaction is
+        committed or rolled back (including to a savepoint).
+
+        Note that it is not cleared when objects are changed inside the
+        transaction. Values depending on them should be stored together
+        with :meth:`.get_pending_count` and be discarded if it changed.
+
+        :param name: the name of the cache
+        :returns: a dict
+        """
+        return self._transaction_caches.setdefault(name, {})
+
     def get_pending_count(self):
         """Get the quantity of pending changes
 
@@ -457,6 +713,7 @@ class StoqlibStore(Store):
 
         self._savepoints = []
         self._dirties = [[]]
+        self._transaction_caches.clear()
 
         # Reload objects on all other opened stores
         for obj in touched_objs:
@@ -518,6 +775,7 @@ class StoqlibStore(Store):
             # If we rollback completely, we need to clear all savepoints
             self._savepoints = []
             self._dirties = [[]]
+            self._transaction_caches.clear()
 
         # Rolling back resets the application name.
         self._setup_application_name()
@@ -615,6 +873,7 @@ class StoqlibStore(Store):
         # Make sure to autorelad the original values after the rollback
         for obj_info in self._cache.get_cached():
             self.autoreload(obj_info.get_obj())
+        self._transaction_caches.clear()
 
     def savepoint_exists(self, name):
         """Checks if the given savepoint's name exists
@@ -695,6 +954,8 @@ def set_default_store(store):
     if store is None and _default_store is not None:
         _default_store.close()
     _default_store = store
+    # The new store may be connected to another database
+    clear_references_cache()
 
 
 def new_store():
@@ -708,6 +969,18 @@ def new_store():
     return StoqlibStore()
 
 
+def clear_references_cache():
+    """Clears the foreign key map used by
+    :meth:`StoqlibStore.list_references`
+
+    This must be called after changing the database schema, so the
+    references are read again from the catalog the next time they
+    are needed.
+    """
+    global _references_map
+    _references_map = None
+
+
 #
 # User methods
 #
@@ -641,13 +641,15 @@ class DatabaseSettings(object):
             raise NotImplementedError(self.rdbms)
 
     def dump_database(self, filename, schema_only=False,
-                      gzip=False, format='custom'):
+                      gzip=False, format='custom', exclude_schemas=None):
         """Dump the contents of the current database
 
         :param filename: filename to write the database dump to
         :param schema_only: If only the database schema will be dumped
         :param gzip: if the dump should be compressed using gzip -9
         :param format: database dump format, defaults to ``custom``
+        :param exclude_schemas: a list of database schemas that should not
+          be dumped, like the one used by :mod:`stoqlib.database.archive`
         """
         log.info("Dumping database to %s" % filename)
 
@@ -659,6 +661,8 @@ class DatabaseSettings(object):
                 args.append('--compress=9')
             if schema_only:
                 args.append('--schema-only')
+            for schema in exclude_schemas or []:
+                args.append('--exclude-schema=%s' % (schema, ))
             if filename is not None:
                 args.extend(['-f', filename])
             args.extend(self.get_tool_args())
@@ -699,12 +703,14 @@ class DatabaseSettings(object):
         else:
             raise NotImplementedError(self.rdbms)
 
-    def dump_table(self, table, filename=None):
+    def dump_table(self, table, filename=None, data_only=True):
         """Dump the contents of a table.
-        Note this does not include the schema itself, just the data.
+        Note this does not include the schema itself, just the data,
+        unless *data_only* is ``False``.
         To get the data call `.read()` on the returned object.
 
         :param table: table to write
+        :param data_only: if only the data of the table will be dumped
         :param proc: a Process instance
         """
         log.info("Dumping table to %s" % table)
@@ -713,8 +719,9 @@ class DatabaseSettings(object):
             args = ['pg_dump',
                     '--format=custom',
                     '--encoding=UTF-8',
-                    '--data-only',
                     '--table=%s' % (table, )]
+            if data_only:
+                args.append('--data-only')
             if filename is not None:
                 args.extend(['-f', filename])
             args.extend(self.get_tool_args())
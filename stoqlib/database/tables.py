@@ -198,8 +198,18 @@ def _get_tables_cache():
 def get_table_type_by_name(table_name):
     """Gets a table by name.
 
+    Note that only the module defining the table will be imported,
+    unless it is a plugin's table.
+
     :param table_name: name of the table
     """
+    if table_name in _tables_cache:
+        return _tables_cache[table_name]
+
+    for path, table_names in _tables:
+        if table_name in table_names:
+            return namedAny('stoqlib.domain.%s.%s' % (path, table_name))
+
     return _get_tables_cache()[table_name]
 
 
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+# vi:si:et:sw=4:sts=4:ts=4
+
+##
+## Copyright (C) 2016 Stoq Tecnologia <http://stoq.link>
+## All rights reserved
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU Lesser General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU Lesser General Public License
+## along with this program; if not, write to the Free Software
+## Foundation, Inc., or visit: http://www.gnu.org/.
+##
+## Author(s): Stoq Team <stoq-devel@async.com.br>
+##
+
+
+"""Tests for module :class:`stoqlib.database.archive`"""
+
+import datetime
+
+from stoqlib.database.archive import (archive_history,
+                                      get_archive_partitions,
+                                      get_partition_name)
+from stoqlib.domain.event import Event
+from stoqlib.domain.product import StockTransactionHistory
+from stoqlib.domain.test.domaintest import DomainTest
+from stoqlib.lib.dateutils import localdate, localtoday
+
+
+class ArchiveTest(DomainTest):
+    def _count(self, table):
+        return self.store.execute(
+            'SELECT COUNT(*) FROM %s' % (table, )).get_one()[0]
+
+    def test_get_partition_name(self):
+        self.assertEqual(
+            get_partition_name(u'stock_transaction_history', 2015),
+            u'archive.stock_transaction_history_2015')
+
+    def test_archive_history(self):
+        old = self.create_stock_transaction_history()
+        old.date = localdate(1990, 5, 1)
+        older = self.create_stock_transaction_history()
+        older.date = localdate(1989, 5, 1)
+        recent = self.create_stock_transaction_history()
+        Event(store=self.store, description=u'old event',
+              date=localdate(1990, 2, 1))
+
+        archived = archive_history(self.store, datetime.date(1991, 1, 1))
+        self.assertEqual(archived, {
+            u'archive.event_1990': 1,
+            u'archive.stock_transaction_history_1989': 1,
+            u'archive.stock_transaction_history_1990': 1,
+        })
+        self.assertEqual(set(get_archive_partitions(self.store)), {
+            u'archive.event_1990',
+            u'archive.stock_transaction_history_1989',
+            u'archive.stock_transaction_history_1990',
+            u'archive.transaction_entry_1989',
+            u'archive.transaction_entry_1990',
+        })
+        self.assertEqual(self._count(u'archive.transaction_entry_1990'), 1)
+
+        self.store.invalidate()
+        results = self.store.find(StockTransactionHistory,
+                                  StockTransactionHistory.id.is_in(
+                                      [old.id, older.id, recent.id]))
+        self.assertEqual(set(results), {recent})
+
+        # Nothing else to archive
+        self.assertEqual(
+            archive_history(self.store, datetime.date(1991, 1, 1)), {})
+
+    def test_archive_history_open_period(self):
+        with self.assertRaises(ValueError):
+            archive_history(self.store,
+                            localtoday() + datetime.timedelta(days=1))
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+# vi:si:et:sw=4:sts=4:ts=4
+
+##
+## Copyright (C) 2016 Stoq Tecnologia <http://stoq.link>
+## All rights reserved
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU Lesser General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU Lesser General Public License
+## along with this program; if not, write to the Free Software
+## Foundation, Inc., or visit: http://www.gnu.org/.
+##
+## Author(s): Stoq Team <stoq-devel@async.com.br>
+##
+
+"""Tests for module :class:`stoqlib.database.debug`"""
+
+import io
+import json
+
+from stoqlib.database.debug import (StoqlibQueryProfiler,
+                                    get_statement_fingerprint)
+from stoqlib.domain.person import ClientCategory
+from stoqlib.domain.test.domaintest import DomainTest
+
+
+class StoqlibQueryProfilerTest(DomainTest):
+    def setUp(self):
+        super(StoqlibQueryProfilerTest, self).setUp()
+        self.profiler = StoqlibQueryProfiler(n_plus_one_threshold=3,
+                                             collect_stacks=True)
+        self.profiler.install()
+
+    def tearDown(self):
+        self.profiler.remove()
+        super(StoqlibQueryProfilerTest, self).tearDown()
+
+    def _find_categories(self, names):
+        for name in names:
+            self.store.find(ClientCategory, name=name).one()
+
+    def test_get_statement_fingerprint(self):
+        self.assertEqual(
+            get_statement_fingerprint(
+                "SELECT 1 FROM sale WHERE id IN (%s,%s, %s) AND "
+                "status = 'it''s' AND  total > 10.5"),
+            "SELECT ? FROM sale WHERE id IN (?) AND status = ? AND total > ?")
+
+    def test_stats(self):
+        self.profiler.start_operation(u'test')
+        self._find_categories([u'foo', u'bar'])
+
+        stats = [s for s in self.profiler.get_stats()
+                 if 'client_category' in s.fingerprint]
+        self.assertEqual(len(stats), 1)
+        self.assertEqual(stats[0].count, 2)
+        self.assertEqual(stats[0].rows, 0)
+        self.assertEqual(stats[0].max_per_operation, 2)
+        self.assertIn('test_debug.py', stats[0].call_site)
+        self.assertIn('_find_categories', stats[0].call_site)
+        self.assertEqual(self.profiler.get_n_plus_one_candidates(), [])
+
+        self.profiler.reset()
+        self.assertEqual(self.profiler.get_stats(), [])
+
+    def test_n_plus_one(self):
+        self.profiler.start_operation(u'test')
+        self._find_categories([u'foo', u'bar', u'baz', u'qux'])
+        candidates = self.profiler.get_n_plus_one_candidates()
+        self.assertEqual(len(candidates), 1)
+        self.assertEqual(candidates[0].max_per_operation, 4)
+
+        # A new operation starts counting again
+        self.profiler.start_operation(u'other')
+        self._find_categories([u'foo'])
+        candidates = self.profiler.get_n_plus_one_candidates()
+        self.assertEqual(candidates[0].count, 5)
+        self.assertEqual(candidates[0].max_per_operation, 4)
+
+    def test_dump(self):
+        self._find_categories([u'foo'])
+
+        f = io.StringIO()
+        self.profiler.dump_json(f)
+        report = json.loads(f.getvalue())
+        self.assertTrue(any('client_category' in s['fingerprint']
+                            for s in report['statements']))
+        self.assertEqual(report['n_plus_one'], [])
+
+        f = io.StringIO()
+        self.profiler.dump_collapsed(f)
+        lines = f.getvalue().splitlines()
+        self.assertTrue(lines)
+        self.assertTrue(any('test_debug.py:_find_categories' in l
+                            for l in lines))
+        for line in lines:
+            stack, value = line.rsplit(' ', 1)
+            int(value)
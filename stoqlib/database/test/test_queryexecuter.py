@@ -28,6 +28,7 @@ import mock
 from stoqlib.domain.test.domaintest import DomainTest
 from stoqlib.domain.person import ClientCategory
 from stoqlib.database.queryexecuter import (QueryExecuter,
+                                            SearchResultCache,
                                             StringQueryState)
 
 
@@ -100,6 +101,94 @@ class QueryExecuterTest(DomainTest):
         self.assertEqual(self._search_string_not(u'eye').count(), 0)
         self.assertEqual(self._search_string_not(u'moon 120').count(), 1)
 
+    def test_search_result_cache(self):
+        category = self.create_client_category(u'EYE MOON FLARE 110 0.5')
+        self.create_client_category(u'EYE SUN FLARE 120 1.0')
+        self.qe.set_limit(10)
+        self.qe.enable_result_cache()
+        cache = self.qe.get_result_cache()
+
+        self.assertEqual(self._search_string_all(u'eye').count(), 2)
+        self.assertEqual(cache.get_stats()['misses'], 1)
+        results = self._search_string_all(u'eye')
+        self.assertEqual(set(results), set(self.store.find(ClientCategory)))
+        self.assertEqual(list(results.fast_iter())[0].name,
+                         u'EYE MOON FLARE 110 0.5')
+        self.assertEqual(cache.get_stats()['hits'], 1)
+
+        # Modifying something on the table should invalidate the cache
+        category.name = u'EYE MOON FLARE 130 0.5'
+        self.assertEqual(self._search_string_all(u'eye 130').count(), 1)
+        self.assertEqual(self._search_string_all(u'eye').count(), 2)
+        self.assertEqual(cache.get_stats()['hits'], 1)
+        self.assertEqual(cache.get_stats()['misses'], 3)
+
+        self.create_client_category(u'EYE SUN STONE 120 0.5')
+        self.assertEqual(self._search_string_all(u'eye').count(), 3)
+        self.assertEqual(cache.get_stats()['misses'], 4)
+
+        # Lazy searches (without a limit) are not cached
+        self.qe.set_limit(-1)
+        self.assertEqual(self._search_string_all(u'eye').count(), 3)
+        self.assertEqual(cache.get_stats()['misses'], 4)
+
+        self.qe.disable_result_cache()
+        self.assertIsNone(self.qe.get_result_cache())
+
+    def test_search_result_cache_eviction(self):
+        self.create_client_category(u'EYE MOON FLARE 110 0.5')
+        self.qe.set_limit(10)
+        self.qe.enable_result_cache(SearchResultCache(maxsize=2))
+        cache = self.qe.get_result_cache()
+
+        self._search_string_all(u'eye')
+        self._search_string_all(u'moon')
+        self._search_string_all(u'flare')
+        self.assertEqual(cache.get_stats(),
+                         dict(hits=0, misses=3, evictions=1, entries=2))
+
+        # 'eye' was the least recently used
+        self._search_string_all(u'eye')
+        self.assertEqual(cache.get_stats()['misses'], 4)
+        self._search_string_all(u'flare')
+        self.assertEqual(cache.get_stats()['hits'], 1)
+
+        cache.clear()
+        self.assertEqual(cache.get_stats()['entries'], 0)
+
+    def test_search_result_cache_max_age(self):
+        self.create_client_category(u'EYE MOON FLARE 110 0.5')
+        self.qe.set_limit(10)
+        self.qe.enable_result_cache(SearchResultCache(max_age=0))
+        cache = self.qe.get_result_cache()
+
+        # The results expire even if nothing was modified
+        self._search_string_all(u'eye')
+        self._search_string_all(u'eye')
+        self.assertEqual(cache.get_stats()['hits'], 0)
+        self.assertEqual(cache.get_stats()['misses'], 2)
+
+    def test_search_result_cache_tables(self):
+        category = self.create_client_category(u'EYE MOON FLARE 110 0.5')
+        self.qe.set_limit(10)
+        self.qe.enable_result_cache()
+        cache = self.qe.get_result_cache()
+
+        self.assertEqual(self._search_string_all(u'eye').count(), 1)
+        self.assertEqual(cache.get_stats()['misses'], 1)
+
+        # Modifying other tables should not invalidate the cache
+        self.create_sellable()
+        self.assertEqual(self._search_string_all(u'eye').count(), 1)
+        self.assertEqual(cache.get_stats()['hits'], 1)
+        self.assertEqual(cache.get_stats()['misses'], 1)
+
+        # But removing something from the table should
+        self.store.remove(category)
+        self.assertEqual(self._search_string_all(u'eye').count(), 0)
+        self.assertEqual(cache.get_stats()['hits'], 1)
+        self.assertEqual(cache.get_stats()['misses'], 2)
+
     def test_search_async(self):
         self.assertEqual(self.store.find(ClientCategory).count(), 0)
         try:
@@ -25,10 +25,12 @@
 """Tests for module :class:`stoqlib.database.runtime`"""
 
 import mock
+from storm.expr import Desc
 
 from stoqlib.database.exceptions import InterfaceError
 from stoqlib.database.properties import UnicodeCol
-from stoqlib.database.runtime import new_store, StoqlibStore, autoreload_object
+from stoqlib.database.runtime import (new_store, StoqlibStore, autoreload_object,
+                                      clear_references_cache)
 from stoqlib.domain.base import Domain
 from stoqlib.domain.person import Person, Client, ClientView
 from stoqlib.domain.test.domaintest import DomainTest
@@ -417,6 +419,46 @@ class StoqlibStoreTest(DomainTest):
         self.assertTrue(obj.was_updated)
         self.assertEqual(obj.on_update_called_count, call_count)
 
+    def test_prefetch(self):
+        sale = self.create_sale()
+        for i in range(3):
+            self.add_product(sale)
+
+        with self.count_tracer() as tracer:
+            items = list(sale.get_items())
+            self.store.prefetch(items, 'sellable.product.storable',
+                                'sellable.product.sellable')
+            # 1 for the items and 1 for each reference in the paths. The
+            # last one is already loaded.
+            self.assertEqual(tracer.count, 4)
+
+            storables = [item.sellable.product.storable for item in items]
+            self.assertEqual(len(storables), 3)
+            self.assertNotIn(None, storables)
+            self.assertEqual(tracer.count, 4)
+
+    def test_list_references(self):
+        clear_references_cache()
+        refs = self.store.list_references(Person.id)
+        self.assertIn((u'client', u'person_id', u'person', u'id', u'c', u'a'),
+                      refs)
+
+        # The catalog is only queried on the first call
+        with self.count_tracer() as tracer:
+            self.assertEqual(self.store.list_references(Person.id), refs)
+            self.assertEqual(tracer.count, 0)
+
+        clear_references_cache()
+        with self.count_tracer() as tracer:
+            self.assertEqual(self.store.list_references(Person.id), refs)
+            self.assertEqual(tracer.count, 1)
+
+    def test_prefetch_invalid_path(self):
+        sale = self.create_sale()
+        self.add_product(sale)
+        with self.assertRaises(TypeError):
+            self.store.prefetch(sale.get_items(), 'sellable.description')
+
     def _assert_nothing_made(self, obj):
         self.assertFalse(obj.was_updated)
         self.assertFalse(obj.was_deleted)
@@ -426,6 +468,19 @@ class StoqlibStoreTest(DomainTest):
 
 class TestStoqlibResultSet(DomainTest):
 
+    def test_prefetch(self):
+        sale = self.create_sale()
+        for i in range(2):
+            self.add_product(sale)
+
+        with self.count_tracer() as tracer:
+            items = sale.get_items().prefetch('sellable.product')
+            self.assertEqual(len(items), 2)
+            self.assertEqual(tracer.count, 3)
+            for item in items:
+                self.assertEqual(item.sellable.product.sellable, item.sellable)
+            self.assertEqual(tracer.count, 3)
+
     def test_fast_iter_single_table(self):
         results = self.store.find(Person).order_by(Person.te_id)
         # Make sure there are results so the test makes sense
@@ -462,3 +517,44 @@ class TestStoqlibResultSet(DomainTest):
         for obj, tpl in zip(results, results.fast_iter()):
             for prop in ['name', 'status', 'cpf']:
                 self.assertEqual(getattr(obj, prop), getattr(tpl, prop))
+
+    def test_get_projection(self):
+        results = self.store.find(ClientView)
+        name, cpf = results.get_projection(['name', 'cpf'])
+        self.assertIs(name, ClientView.name)
+        self.assertIs(cpf, ClientView.cpf)
+        # status_str is a python property
+        self.assertIsNone(results.get_projection(['name', 'status_str']))
+
+        results = self.store.find(Person)
+        self.assertEqual(len(results.get_projection(['name'])), 1)
+        self.assertIsNone(self.store.find((Person, Client)).get_projection(
+            ['name']))
+
+    def test_fetch_chunks(self):
+        results = self.store.find(Person).order_by(Person.te_id)
+        # Make sure there are enough results so the test makes sense
+        assert results.count() > 2
+
+        chunks = list(results.fetch_chunks(chunk_size=2))
+        self.assertTrue(all(len(chunk) <= 2 for chunk in chunks))
+        # The results come in the order of the query
+        self.assertEqual(sum(chunks, []), list(results))
+
+        results = results.order_by(Desc(Person.te_id))
+        chunks = list(results.fetch_chunks(chunk_size=2))
+        self.assertEqual(sum(chunks, []), list(results))
+
+        columns = results.get_projection(['id', 'name'])
+        with self.count_tracer() as tracer:
+            chunks = list(results.fetch_chunks(columns=columns, chunk_size=2))
+            # The query is declared as a cursor only once. Then there is
+            # one fetch for each chunk (plus an empty one if the last chunk
+            # was full) and the cursor is closed
+            self.assertLessEqual(tracer.count, len(chunks) + 3)
+        self.assertEqual(sum(chunks, []),
+                         [(p.id, p.name) for p in results])
+
+    def test_count_with_group_by(self):
+        results = self.store.find(Person.name).group_by(Person.name)
+        self.assertEqual(results.count(), len(list(results)))
@@ -31,7 +31,8 @@ import logging
 import warnings
 
 from storm.exceptions import NotOneError, ClosedError, LostObjectError
-from storm.expr import And, Alias, Like, Max, Select, Update, Undef
+from storm.expr import (And, Alias, In, Like, Max, Select, Union, Update,
+                        Undef)
 from storm.info import get_cls_info, get_obj_info
 from storm.properties import Property
 from storm.references import Reference
@@ -178,6 +179,19 @@ class Domain(ORMObject):
         elif stoq_pending == _OBJ_UPDATED:
             self.on_update()
 
+    def _get_merge_objects(self, other):
+        # merge_with accepts both an object and a list of objects
+        if isinstance(other, (list, tuple)):
+            return list(other)
+        return [other]
+
+    def _get_merge_query(self, column, other):
+        # A query matching the rows referencing the objects being merged
+        ids = [obj.id for obj in self._get_merge_objects(other)]
+        if len(ids) == 1:
+            return column == ids[0]
+        return In(column, ids)
+
     #
     # Public API
     #
@@ -333,6 +347,11 @@ class Domain(ORMObject):
         After this it should be safe to remove the `other` object. Since there
         is no one referencing it anymore.
 
+        `other` can also be a list of objects, to merge all of them into
+        this one at once. In that case the references are still updated
+        by one statement for each referencing column.
+
+        :param other: the object to merge, or a list of objects
         :param skip: A set of (table, column) that should be skiped by the
           automatic update. This are normally tables that require a special
           treatment, like when there are constraints.
@@ -341,19 +360,22 @@ class Domain(ORMObject):
           object (given that the other attribute is not empty as well)
         """
         skip = skip or set()
-        event_skip = DomainMergeEvent.emit(self, other)
-        if event_skip:
-            skip = skip.union(event_skip)
+        others = self._get_merge_objects(other)
+        for obj in others:
+            event_skip = DomainMergeEvent.emit(self, obj)
+            if event_skip:
+                skip = skip.union(event_skip)
 
         if copy_empty_values:
-            self.copy_empty_values(other)
+            for obj in others:
+                self.copy_empty_values(obj)
 
         refs = self.store.list_references(type(self).id)
         for (table, column, other_table, other_column, u, d) in refs:
             if (table, column) in skip:
                 continue
 
-            clause = Field(table, column) == other.id
+            clause = self._get_merge_query(Field(table, column), others)
             self.store.execute(Update({column: self.id}, clause, table))
 
     def copy_empty_values(self, other):
@@ -423,6 +445,51 @@ class Domain(ORMObject):
         lower_value = store.find(cls).min(cls.identifier)
         return min(lower_value or 0, 0) - 1
 
+    @classmethod
+    def get_removable_ids(cls, store, ids, skip=None):
+        """Check which of the given objects can be removed from the database
+
+        This is the same as :meth:`.can_remove`, but checks all the ids
+        using a single query, instead of one query for each object.
+
+        :param store: a store
+        :param ids: an iterable with the ids of the objects to check
+        :param skip: an itarable containing the (table, column) to skip
+            the check. Use this to avoid false positives when you will
+            delete those skipped by hand before the objects.
+        :returns: a set with the ids that are not referenced by any
+            other object
+        """
+        ids = set(ids)
+        if not ids:
+            return set()
+
+        skip = skip or set()
+        selects = []
+        refs = store.list_references(cls.id)
+
+        for t_name, c_name, ot_name, oc_name, u, d in refs:
+            if (t_name, c_name) in skip:
+                continue
+
+            column = Field(t_name, c_name)
+            selects.append(
+                Select(columns=[column], tables=[t_name],
+                       where=In(column, list(ids))))
+
+        # If everything was skipped, all objects can be removed
+        if not len(selects):
+            return ids
+
+        if len(selects) > 1:
+            query = Union(*selects)
+        else:
+            query = selects[0]
+            query.distinct = True
+
+        referenced = set(row[0] for row in store.execute(query))
+        return ids - referenced
+
     @classmethod
     def find_distinct_values(cls, store, attr, exclude_empty=True):
         """Find distinct values for a given attr
@@ -29,7 +29,8 @@ Commission management
 
 from decimal import Decimal
 
-from storm.expr import Join, Cast
+from kiwi.currency import currency
+from storm.expr import And, Cast, Coalesce, Join, Select, Sum
 from storm.references import Reference
 
 from stoqlib.database.properties import PercentCol, PriceCol
@@ -39,12 +40,48 @@ from stoqlib.domain.base import Domain
 from stoqlib.domain.payment.method import PaymentMethod
 from stoqlib.domain.payment.payment import Payment
 from stoqlib.domain.person import Person, SalesPerson, Branch
-from stoqlib.domain.sale import Sale
+from stoqlib.domain.sale import Sale, SaleItem
 from stoqlib.lib.defaults import quantize
 from stoqlib.lib.translation import stoqlib_gettext
 
 _ = stoqlib_gettext
 
+#: The commission values to be used for some sellables. That is the
+#: source of the sellable itself or, if it has none, the source of the
+#: nearest category up in its category tree.
+#: The %s must be replaced by one placeholder for each sellable id
+_COMMISSION_SOURCES_SQL = """
+    WITH RECURSIVE _sellable_categories(sellable_id, category_id, depth) AS (
+        SELECT id, category_id, 1
+          FROM sellable
+          WHERE id IN (%s) AND category_id IS NOT NULL
+      UNION ALL
+        SELECT _sellable_categories.sellable_id,
+               sellable_category.category_id,
+               _sellable_categories.depth + 1
+          FROM sellable_category
+          JOIN _sellable_categories
+            ON sellable_category.id = _sellable_categories.category_id
+          WHERE sellable_category.category_id IS NOT NULL
+    ), _sources(sellable_id, direct_value, installments_value, depth) AS (
+        SELECT sellable_id, direct_value, installments_value, 0
+          FROM commission_source
+          WHERE sellable_id IN (%s)
+      UNION ALL
+        SELECT _sellable_categories.sellable_id,
+               commission_source.direct_value,
+               commission_source.installments_value,
+               _sellable_categories.depth
+          FROM commission_source
+          JOIN _sellable_categories
+            ON commission_source.category_id = _sellable_categories.category_id
+    )
+    SELECT DISTINCT ON (sellable_id)
+           sellable_id, direct_value, installments_value
+      FROM _sources
+      ORDER BY sellable_id, depth
+"""
+
 
 class CommissionSource(Domain):
     """Commission Source object implementation
@@ -81,6 +118,34 @@ class CommissionSource(Domain):
     #: the |sellable|
     sellable = Reference(sellable_id, 'Sellable.id')
 
+    #
+    #  Public API
+    #
+
+    @classmethod
+    def get_values(cls, store, sellable_ids):
+        """Get the commission values of many sellables at once
+
+        The values of a sellable come from its own commission source or,
+        if it doesn't have one, from the nearest |sellablecategory| in
+        its category tree that has one. The whole tree is walked by the
+        database using a single query.
+
+        :param store: a store
+        :param sellable_ids: a list of |sellable| ids
+        :returns: a dict mapping the sellable id to a tuple containing
+            its ``(direct_value, installments_value)``. Sellables without
+            a commission source will not be present in it
+        """
+        ids = list(sellable_ids)
+        if not ids:
+            return {}
+        placeholders = ', '.join('?' * len(ids))
+        result = store.execute(
+            _COMMISSION_SOURCES_SQL % (placeholders, placeholders),
+            tuple(ids) * 2)
+        return dict((row[0], (row[1], row[2])) for row in result)
+
 
 class Commission(Domain):
     """Commission object implementation
@@ -127,14 +192,88 @@ class Commission(Domain):
         if need_calculate_value:
             self._calculate_value()
 
+    #
+    #  Public API
+    #
+
+    @classmethod
+    def create_for_sales(cls, store, sales):
+        """Creates the commissions for all the payments of many sales
+
+        The |saleitems|, the commission values of their sellables and the
+        |payments| of all the sales are fetched at once, instead of once
+        for each payment. Payments that already have a commission are
+        skipped, like in :meth:`stoqlib.domain.sale.Sale.create_commission`.
+
+        :param store: a store
+        :param sales: a list of |sales|
+        :returns: a list with the created commissions
+        """
+        sales = list(sales)
+        if not sales:
+            return []
+
+        sale_items = store.find(SaleItem, SaleItem.sale_id.is_in(
+            [sale.id for sale in sales])).prefetch('ipi_info')
+        sources = CommissionSource.get_values(
+            store, set(item.sellable_id for item in sale_items))
+        items = {}
+        for item in sale_items:
+            items.setdefault(item.sale_id, []).append(item)
+
+        payments_query = And(
+            Payment.group_id.is_in([sale.group_id for sale in sales]),
+            Payment.status != Payment.STATUS_CANCELLED)
+        payments = {}
+        for payment in store.find(Payment, payments_query).order_by(
+                Payment.open_date):
+            payments.setdefault(payment.group_id, []).append(payment)
+        with_commission = set(store.find(
+            Commission.payment_id,
+            Commission.payment_id.is_in(Select(Payment.id,
+                                               where=payments_query))))
+
+        commissions = []
+        for sale in sales:
+            sale_payments = payments.get(sale.group_id, [])
+            if len([p for p in sale_payments if not p.is_outpayment()]) <= 1:
+                commission_type = cls.DIRECT
+            else:
+                commission_type = cls.INSTALLMENTS
+
+            for payment in sale_payments:
+                if payment.id in with_commission:
+                    continue
+                # The value is calculated below, using the items and
+                # sources that were already fetched
+                commission = cls(store=store, sale=sale, payment=payment,
+                                 commission_type=commission_type, value=0)
+                commission._calculate_value(items.get(sale.id, []), sources)
+                if payment.is_outpayment():
+                    commission.value = -commission.value
+                commissions.append(commission)
+
+        return commissions
+
     #
     #  Private
     #
 
-    def _calculate_value(self):
-        """Calculates the commission amount to be paid"""
+    def _calculate_value(self, items=None, sources=None):
+        """Calculates the commission amount to be paid
 
-        relative_percentage = self._get_payment_percentage()
+        :param items: the |saleitems| of the sale, if they were
+            already fetched
+        :param sources: the commission values of the items' sellables,
+            as returned by :meth:`CommissionSource.get_values`
+        """
+        if items is None:
+            items = self.sale.get_items().prefetch('ipi_info')
+        if sources is None:
+            sources = CommissionSource.get_values(
+                self.store, set(item.sellable_id for item in items))
+
+        relative_percentage = self._get_payment_percentage(items)
 
         # The commission is calculated for all sellable items
         # in sale; a relative percentage is given for each payment
@@ -146,8 +285,9 @@ class Commission(Domain):
         #   sales person is also going to be 20% and 80% of the complete
         #   commission amount for the sale when that specific payment is payed.
         value = Decimal(0)
-        for sellable_item in self.sale.get_items():
-            value += (self._get_commission(sellable_item.sellable) *
+        for sellable_item in items:
+            source = sources.get(sellable_item.sellable_id)
+            value += (self._get_commission(source) *
                       sellable_item.get_total() *
                       relative_percentage)
 
@@ -155,42 +295,34 @@ class Commission(Domain):
         # digits. Round it to only two
         self.value = quantize(value)
 
-    def _get_payment_percentage(self):
+    def _get_payment_percentage(self, items):
         """Return the payment percentage of sale"""
-        total = self.sale.get_sale_subtotal()
+        # The same as sale.get_sale_subtotal(), but using the items
+        # that were already fetched
+        total = currency(sum(item.get_total() for item in items))
         if total == 0:
             return 0
         else:
             return self.payment.value / total
 
-    def _get_commission(self, sellable):
+    def _get_commission(self, source):
         """Return the properly commission percentage to be used to
-        calculate the commission amount, for a given sellable.
-        """
-
-        store = self.store
-        source = store.find(CommissionSource, sellable=sellable).one()
-        if not source and sellable.category:
-            source = self._get_category_commission(sellable.category)
+        calculate the commission amount, for a given commission source.
 
+        :param source: a tuple with the ``(direct_value, installments_value)``
+            of the source or ``None`` if there's no source
+        """
         value = 0
         if source:
+            direct_value, installments_value = source
             if self.commission_type == self.DIRECT:
-                value = source.direct_value
+                value = direct_value
             else:
-                value = source.installments_value
+                value = installments_value
             value /= Decimal(100)
 
         return value
 
-    def _get_category_commission(self, category):
-        if category:
-            store = self.store
-            source = store.find(CommissionSource, category=category).one()
-            if not source:
-                return self._get_category_commission(category.category)
-            return source
-
 #
 # Views
 #
@@ -218,6 +350,9 @@ class CommissionView(Viewable):
     code = Commission.id
     commission_value = Commission.value
     commission_percentage = Commission.value / Payment.value * 100
+    items_quantity = Coalesce(
+        Select(Sum(SaleItem.quantity), tables=[SaleItem],
+               where=SaleItem.sale_id == Sale.id), 0)
 
     # Payment
     payment_id = Payment.id
@@ -251,8 +386,7 @@ class CommissionView(Viewable):
             # zero means 'this sale does not changed our stock'
             return Decimal(0)
 
-        # FIXME: This is doing one extra query per row when printing the report
-        return self.sale.get_items_total_quantity()
+        return self.items_quantity
 
     @property
     def payment_amount(self):
@@ -28,6 +28,7 @@
 
 import base64
 
+from storm.expr import And, Eq, Func
 from storm.references import Reference
 from zope.interface import implementer
 
@@ -47,6 +48,11 @@ _ = stoqlib_gettext
 class Image(Domain):
     """Class responsible for storing images and it's description
 
+    Note that loading an image object will fetch both :obj:`.image` and
+    :obj:`.thumbnail` from the database, which can be quite big. When only
+    one of them is needed (e.g. to display it), use :meth:`.get_image_data`
+    and :meth:`.get_thumbnails` instead.
+
     See also:
     `schema <http://doc.stoq.com.br/schema/tables/image.html>`__
 
@@ -101,6 +107,67 @@ class Image(Domain):
     def get_base64_encoded(self):
         return base64.b64encode(self.image).decode()
 
+    @classmethod
+    def get_main_image_id(cls, store, sellable):
+        """Get the id of the main image of a |sellable|
+
+        :param store: a store
+        :param sellable: the |sellable|
+        :returns: the image id or ``None`` if the sellable has no main image
+        """
+        return store.find(cls.id, And(cls.sellable_id == sellable.id,
+                                      Eq(cls.is_main, True))).one()
+
+    @classmethod
+    def get_image_data(cls, store, image_id):
+        """Get the data of an image without loading its thumbnail
+
+        :param store: a store
+        :param image_id: the id of the image
+        :returns: the image bytes
+        """
+        return store.find(cls.image, cls.id == image_id).one()
+
+    @classmethod
+    def get_thumbnails(cls, store, image_ids, cache=None):
+        """Get the thumbnails of some images without loading the images
+
+        If a *cache* is given, only the hash of the thumbnails will be
+        fetched at first and just the ones missing on it will be
+        transfered from the database and added to it.
+
+        :param store: a store
+        :param image_ids: a sequence of image ids
+        :param cache: an object with a ``get(digest)`` method, returning
+            the data for a md5 hex digest or ``None``, and a ``put(data)``
+            method, like :class:`stoqlib.lib.imageutils.ThumbnailCache`
+        :returns: a dict mapping the image ids to their thumbnail data.
+            Images without a thumbnail are mapped to ``None``
+        """
+        thumbnails = {}
+        missing = set(image_ids)
+        if not missing:
+            return thumbnails
+
+        if cache is not None:
+            digests = store.find((cls.id, Func('md5', cls.thumbnail)),
+                                 cls.id.is_in(missing))
+            for image_id, digest in digests:
+                data = digest and cache.get(digest)
+                if data is not None:
+                    thumbnails[image_id] = data
+                    missing.discard(image_id)
+
+        if missing:
+            results = store.find((cls.id, cls.thumbnail),
+                                 cls.id.is_in(missing))
+            for image_id, data in results:
+                thumbnails[image_id] = data
+                if data is not None and cache is not None:
+                    cache.put(data)
+
+        return thumbnails
+
     #
     #  IDescribable implementation
     #
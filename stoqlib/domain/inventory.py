@@ -28,13 +28,14 @@
 import collections
 from decimal import Decimal
 
-from storm.expr import And, Eq, Cast, Join, LeftJoin, Or, Coalesce
+from storm.expr import (And, Eq, Ne, Not, Cast, Join, LeftJoin, Or, Coalesce,
+                        Exists, Insert, Select)
 from storm.references import Reference, ReferenceSet
 
 from stoqlib.database.properties import (QuantityCol, PriceCol, DateTimeCol,
                                          IntCol, UnicodeCol, IdentifierCol,
                                          IdCol, BoolCol, EnumCol)
-from stoqlib.database.expr import StatementTimestamp
+from stoqlib.database.expr import Case, StatementTimestamp, TransactionTimestamp
 from stoqlib.database.viewable import Viewable
 from stoqlib.domain.base import Domain, IdentifiableDomain
 from stoqlib.domain.fiscal import FiscalBookEntry
@@ -42,6 +43,7 @@ from stoqlib.domain.person import LoginUser, Person, Branch
 from stoqlib.domain.product import (StockTransactionHistory, StorableBatch, Product,
                                     Storable, ProductStockItem)
 from stoqlib.domain.sellable import Sellable
+from stoqlib.exceptions import StockError
 from stoqlib.lib.dateutils import localnow
 from stoqlib.lib.translation import stoqlib_gettext
 
@@ -368,22 +370,99 @@ class Inventory(IdentifiableDomain):
             raise AssertionError("You can not close an inventory which is "
                                  "already closed!")
 
-        for item in self.inventory_items:
-            if (item.actual_quantity is None or
-                    item.recorded_quantity == item.actual_quantity):
-                continue
-
-            # FIXME: We are setting this here because, when generating a
-            # sintegra file, even if this item wasn't really adjusted (e.g.
-            # adjustment_qty bellow is 0) it needs to be specified and not
-            # setting this would result on self.get_cost returning 0.  Maybe
-            # we should resolve this in another way
-            # We don't call item.adjust since it needs an invoice number
-            item.is_adjusted = True
+        # FIXME: We are setting this here because, when generating a
+        # sintegra file, even if this item wasn't really adjusted (e.g.
+        # adjustment_qty bellow is 0) it needs to be specified and not
+        # setting this would result on self.get_cost returning 0.  Maybe
+        # we should resolve this in another way
+        # We don't call item.adjust since it needs an invoice number
+        self.inventory_items.find(
+            Ne(InventoryItem.actual_quantity, None),
+            InventoryItem.recorded_quantity != InventoryItem.actual_quantity,
+        ).set(is_adjusted=True)
 
         self.close_date = StatementTimestamp()
         self.status = Inventory.STATUS_CLOSED
 
+    def adjust_items(self, invoice_number, reason):
+        """Adjust all the counted items of this inventory at once
+
+        This does the same as calling :meth:`InventoryItem.adjust` for each
+        counted item that was not adjusted yet, using its counted quantity as
+        the actual one, but the stock transactions and fiscal book entries
+        are created by a fixed number of statements, no matter how many
+        items the inventory has.
+
+        :param invoice_number: invoice number to register
+        :param reason: the reason of the adjustment
+        :raises: :exc:`stoqlib.exceptions.StockError` if there is not
+            enough stock to decrease any of the items
+        """
+        assert self.is_open()
+        store = self.store
+
+        pending = self.inventory_items.find(
+            Eq(InventoryItem.is_adjusted, False),
+            Ne(InventoryItem.counted_quantity, None))
+        pending.set(InventoryItem.actual_quantity == InventoryItem.counted_quantity,
+                    reason=reason)
+
+        # Items not controlling stock yet need to have their storable created,
+        # which is done one by one. They should be very few anyway
+        for item in pending.find(Not(Exists(Select(
+                1, tables=[Storable],
+                where=Storable.id == InventoryItem.product_id)))):
+            item.adjust(invoice_number)
+
+        difference = InventoryItem.actual_quantity - InventoryItem.recorded_quantity
+        tables = [InventoryItem,
+                  LeftJoin(ProductStockItem,
+                           And(ProductStockItem.storable_id == InventoryItem.product_id,
+                               ProductStockItem.branch_id == self.branch_id,
+                               Or(ProductStockItem.batch_id == InventoryItem.batch_id,
+                                  And(Eq(ProductStockItem.batch_id, None),
+                                      Eq(InventoryItem.batch_id, None)))))]
+        query = And(InventoryItem.inventory_id == self.id,
+                    Eq(InventoryItem.is_adjusted, False),
+                    Ne(InventoryItem.actual_quantity, None),
+                    difference != 0,
+                    Exists(Select(1, tables=[Storable],
+                                  where=Storable.id == InventoryItem.product_id)))
+
+        missing = store.using(*tables).find(
+            InventoryItem,
+            And(query, difference < 0,
+                -difference > Coalesce(ProductStockItem.quantity, 0)))
+        if not missing.is_empty():
+            raise StockError(
+                _('Quantity to decrease is greater than the available stock.'))
+
+        StockTransactionHistory.create_from_query(
+            store, StockTransactionHistory.TYPE_INVENTORY_ADJUST,
+            tables=tables, where=query,
+            storable_id=InventoryItem.product_id,
+            branch_id=Cast(self.branch_id, 'uuid'),
+            batch_id=InventoryItem.batch_id,
+            quantity=difference,
+            # Decreases use the current stock cost, just like decrease_stock
+            unit_cost=Case(difference < 0, ProductStockItem.stock_cost),
+            object_id=InventoryItem.id)
+
+        entry_columns = collections.OrderedDict([
+            (FiscalBookEntry.date, TransactionTimestamp()),
+            (FiscalBookEntry.entry_type, FiscalBookEntry.TYPE_INVENTORY),
+            (FiscalBookEntry.is_reversal, False),
+            (FiscalBookEntry.invoice_number, invoice_number),
+            (FiscalBookEntry.branch_id, Cast(self.branch_id, 'uuid')),
+            (FiscalBookEntry.cfop_id, InventoryItem.cfop_data_id),
+        ])
+        store.execute(Insert(
+            entry_columns, table=FiscalBookEntry,
+            values=Select(list(entry_columns.values()), where=query,
+                          tables=tables)))
+
+        store.find(InventoryItem, query).set(is_adjusted=True)
+
     def all_items_counted(self):
         """Checks if all items of this inventory were counted
 
@@ -497,15 +576,7 @@ class Inventory(IdentifiableDomain):
         if extra_query:
             query = And(query, extra_query)
 
-        tables = [Sellable,
-                  Join(Product, Product.id == Sellable.id),
-                  Join(Storable, Storable.id == Product.id),
-                  LeftJoin(StorableBatch, StorableBatch.storable_id == Storable.id),
-                  LeftJoin(ProductStockItem,
-                           And(ProductStockItem.storable_id == Storable.id,
-                               Or(ProductStockItem.batch_id == StorableBatch.id,
-                                  Eq(ProductStockItem.batch_id, None)))),
-                  ]
+        tables = cls._get_inventory_tables()
         return store.using(*tables).find(
             (Sellable, Product, Storable, StorableBatch, ProductStockItem),
             query)
@@ -514,6 +585,11 @@ class Inventory(IdentifiableDomain):
     def create_inventory(cls, store, branch, responsible, query=None):
         """Create a inventory with products that match the given query
 
+        The |inventoryitems| are created by a single ``INSERT ... SELECT``
+        over the same data returned by :meth:`.get_sellables_for_inventory`,
+        so opening an inventory for a large branch does not need to load
+        each product in memory.
+
         :param store: A store to open the inventory in
         :param query: A query to restrict the products that should be in the inventory.
         """
@@ -521,24 +597,54 @@ class Inventory(IdentifiableDomain):
                         open_date=localnow(),
                         branch_id=branch.id,
                         responsible_id=responsible.id)
-
-        for data in cls.get_sellables_for_inventory(store, branch, query):
-            sellable, product, storable, batch, stock_item = data
-            quantity = stock_item and stock_item.quantity or 0
-            if storable.is_batch:
-                # This used to test 'stock_item.quantity > 0' too to avoid
-                # creating inventory items for old batches not used anymore.
-                # We can't do that since that would make it impossible to
-                # adjust a batch that was wrongly set to 0. We need to find a
-                # way to mark the batches as "not used anymore" because they
-                # tend to grow to very large proportions and we are duplicating
-                # everyone here
-                if batch and stock_item:
-                    inventory.add_product(product, quantity, batch=batch)
-            else:
-                inventory.add_product(product, quantity)
+        # Make sure the inventory is on the database, since the items
+        # will reference it directly
+        store.flush()
+
+        # This used to test 'stock_item.quantity > 0' too for batches to
+        # avoid creating inventory items for old batches not used anymore.
+        # We can't do that since that would make it impossible to adjust a
+        # batch that was wrongly set to 0. We need to find a way to mark the
+        # batches as "not used anymore" because they tend to grow to very
+        # large proportions and we are duplicating everyone here
+        clause = Or(Eq(Storable.is_batch, False),
+                    And(Ne(StorableBatch.id, None),
+                        Ne(ProductStockItem.id, None)))
+        where = And(ProductStockItem.branch_id == branch.id, clause)
+        if query:
+            where = And(where, query)
+
+        columns = collections.OrderedDict([
+            (InventoryItem.inventory_id, Cast(inventory.id, 'uuid')),
+            (InventoryItem.product_id, Product.id),
+            (InventoryItem.batch_id,
+             Case(Eq(Storable.is_batch, True), StorableBatch.id)),
+            (InventoryItem.product_cost, Sellable.cost),
+            (InventoryItem.recorded_quantity,
+             Coalesce(ProductStockItem.quantity, 0)),
+            (InventoryItem.reason, u''),
+        ])
+        select = Select(list(columns.values()), where=where,
+                        tables=cls._get_inventory_tables())
+        store.execute(Insert(columns, table=InventoryItem, values=select))
         return inventory
 
+    #
+    #  Private
+    #
+
+    @classmethod
+    def _get_inventory_tables(cls):
+        return [Sellable,
+                Join(Product, Product.id == Sellable.id),
+                Join(Storable, Storable.id == Product.id),
+                LeftJoin(StorableBatch, StorableBatch.storable_id == Storable.id),
+                LeftJoin(ProductStockItem,
+                         And(ProductStockItem.storable_id == Storable.id,
+                             Or(ProductStockItem.batch_id == StorableBatch.id,
+                                Eq(ProductStockItem.batch_id, None)))),
+                ]
+
 
 class InventoryItemsView(Viewable):
     """Holds information about |inventoryitems|
@@ -37,10 +37,12 @@ from decimal import Decimal
 
 from kiwi.currency import currency
 from kiwi.python import Settable
+from storm.expr import (SQL, And, Cast, Coalesce, Eq, Join, LeftJoin, Max,
+                        Or, Sum)
 from storm.references import Reference, ReferenceSet
 from zope.interface import implementer
 
-from stoqlib.database.expr import Round
+from stoqlib.database.expr import Field, Round
 from stoqlib.database.properties import (UnicodeCol, DateTimeCol, PriceCol,
                                          QuantityCol, IdentifierCol,
                                          IdCol, EnumCol)
@@ -48,15 +50,22 @@ from stoqlib.domain.base import Domain, IdentifiableDomain
 from stoqlib.domain.events import StockOperationConfirmedEvent
 from stoqlib.domain.fiscal import Invoice
 from stoqlib.domain.interfaces import IContainer, IInvoice, IInvoiceItem
-from stoqlib.domain.product import StockTransactionHistory
+from stoqlib.domain.product import (ProductStockItem, StockTransactionHistory,
+                                    Storable)
 from stoqlib.domain.taxes import check_tax_info_presence
-from stoqlib.exceptions import DatabaseInconsistency
+from stoqlib.exceptions import DatabaseInconsistency, StockError
 from stoqlib.lib.dateutils import localnow
 from stoqlib.lib.defaults import DECIMAL_PRECISION, quantize
 from stoqlib.lib.translation import stoqlib_gettext
 
 _ = stoqlib_gettext
 
+#: The stock difference of some loan items, to be joined with them.
+#: The %s must be replaced by one ``(id, quantity)`` row for each item
+_LOAN_ITEM_STOCK_SQL = """
+    (VALUES %s) AS _loan_item_stock(id, quantity)
+"""
+
 
 @implementer(IInvoiceItem)
 class LoanItem(Domain):
@@ -186,10 +195,7 @@ class LoanItem(Domain):
         synchronize the stock (increase or decrease it). That counts
         for object creation too.
         """
-        loaned = self._original_quantity - self.quantity
-        returned = self.return_quantity - self._original_return_quantity
-        diff_quantity = loaned + returned
-
+        diff_quantity = self._get_stock_difference()
         if diff_quantity > 0:
             self.storable.increase_stock(diff_quantity, self.branch,
                                          StockTransactionHistory.TYPE_RETURNED_LOAN,
@@ -200,10 +206,7 @@ class LoanItem(Domain):
                                          StockTransactionHistory.TYPE_LOANED,
                                          self.id, batch=self.batch)
 
-        # Reset the values used to calculate the stock quantity, just like
-        # when the object as loaded from the database again.
-        self._original_quantity = self.quantity
-        self._original_return_quantity = self.return_quantity
+        self._reset_stock_difference()
 
     def get_remaining_quantity(self):
         """The remaining quantity that wasn't returned/sold yet
@@ -232,6 +235,23 @@ class LoanItem(Domain):
         """
         self.price = quantize(self.base_price * (1 - Decimal(discount) / 100))
 
+    #
+    #  Private
+    #
+
+    def _get_stock_difference(self):
+        # How much the stock should be increased (if positive) or
+        # decreased (if negative) since the last synchronization
+        loaned = self._original_quantity - self.quantity
+        returned = self.return_quantity - self._original_return_quantity
+        return loaned + returned
+
+    def _reset_stock_difference(self):
+        # Reset the values used to calculate the stock quantity, just like
+        # when the object as loaded from the database again.
+        self._original_quantity = self.quantity
+        self._original_return_quantity = self.return_quantity
+
 
 @implementer(IContainer)
 @implementer(IInvoice)
@@ -536,15 +556,71 @@ class Loan(IdentifiableDomain):
     def sync_stock(self):
         """Synchronizes the stock of *self*'s :class:`loan items <LoanItem>`
 
-        Just a shortcut to call :meth:`LoanItem.sync_stock` of all of
-        *self*'s :class:`loan items <LoanItem>` instead of having
-        to do that one by one.
+        This is the same as calling :meth:`LoanItem.sync_stock` for each
+        one of *self*'s :class:`loan items <LoanItem>`, but the stock of
+        all of them is increased/decreased at once, using a single
+        set-based operation, instead of one by one.
+
+        :raises: :exc:`stoqlib.exceptions.StockError` if there is not
+            enough stock to decrease for any of the items
         """
-        for loan_item in self.get_items():
-            # No need to sync stock for products that dont need.
-            if not loan_item.sellable.product.manage_stock:
-                continue
-            loan_item.sync_stock()
+        store = self.store
+        items = [item for item in self.get_items().prefetch('sellable.product')
+                 # No need to sync stock for products that dont need.
+                 if item.sellable.product.manage_stock]
+        quantities = [(item.id, item._get_stock_difference())
+                      for item in items]
+        quantities = [row for row in quantities if row[1]]
+        if not quantities:
+            return
+
+        values = SQL(
+            _LOAN_ITEM_STOCK_SQL % ', '.join(
+                ['(CAST(? AS uuid), CAST(? AS numeric))'] * len(quantities)),
+            tuple(value for row in quantities for value in row))
+        quantity = Field('_loan_item_stock', 'quantity')
+        tables = [
+            LoanItem,
+            Join(values, Field('_loan_item_stock', 'id') == LoanItem.id),
+            Join(Storable, Storable.id == LoanItem.sellable_id),
+            LeftJoin(ProductStockItem,
+                     And(ProductStockItem.storable_id == Storable.id,
+                         ProductStockItem.branch_id == self.branch_id,
+                         Or(ProductStockItem.batch_id == LoanItem.batch_id,
+                            And(Eq(ProductStockItem.batch_id, None),
+                                Eq(LoanItem.batch_id, None)))))]
+
+        # The same storable/batch may be in more than one item, so the
+        # quantities need to be summed before comparing with the stock
+        missing = store.using(*tables).find(LoanItem.sellable_id, quantity < 0)
+        missing = missing.group_by(LoanItem.sellable_id, LoanItem.batch_id)
+        missing = missing.having(-Sum(quantity) >
+                                 Coalesce(Max(ProductStockItem.quantity), 0))
+        if not missing.is_empty():
+            raise StockError(
+                _('Quantity to decrease is greater than the available stock.'))
+
+        StockTransactionHistory.create_from_query(
+            store, StockTransactionHistory.TYPE_RETURNED_LOAN,
+            tables=tables, where=quantity > 0,
+            storable_id=Storable.id,
+            branch_id=Cast(self.branch_id, 'uuid'),
+            batch_id=LoanItem.batch_id,
+            quantity=quantity,
+            object_id=LoanItem.id)
+        StockTransactionHistory.create_from_query(
+            store, StockTransactionHistory.TYPE_LOANED,
+            tables=tables, where=quantity < 0,
+            storable_id=Storable.id,
+            branch_id=Cast(self.branch_id, 'uuid'),
+            batch_id=LoanItem.batch_id,
+            quantity=quantity,
+            # Just like decrease_stock, use the current stock cost
+            unit_cost=ProductStockItem.stock_cost,
+            object_id=LoanItem.id)
+
+        for item in items:
+            item._reset_stock_difference()
 
     def can_close(self):
         """Checks if the loan can be closed. A loan can be closed if it is
@@ -553,10 +629,10 @@ class Loan(IdentifiableDomain):
         """
         if self.status != Loan.STATUS_OPEN:
             return False
-        for item in self.get_items():
-            if item.sale_quantity + item.return_quantity != item.quantity:
-                return False
-        return True
+        pending = self.get_items().find(
+            LoanItem.sale_quantity + LoanItem.return_quantity !=
+            LoanItem.quantity)
+        return pending.is_empty()
 
     def get_sale_base_subtotal(self):
         """Get the base subtotal of items
@@ -572,12 +648,21 @@ class Loan(IdentifiableDomain):
 
     def close(self):
         """Closes the loan. At this point, all the loan items have been
-        returned to stock or sold."""
+        returned to stock or sold.
+
+        The stock of the items that was not synchronized yet will
+        be, using :meth:`.sync_stock`.
+        """
         assert self.can_close()
+        self.sync_stock()
         self.close_date = localnow()
         self.status = Loan.STATUS_CLOSED
 
     def confirm(self):
+        # Decrease the stock of all the loaned items at once. If the
+        # stock was already synchronized, this will not do anything
+        self.sync_stock()
+
         # Save the operation nature and branch in Invoice table.
         self.invoice.operation_nature = self.operation_nature
         self.invoice.branch = self.branch
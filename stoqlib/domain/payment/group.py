@@ -37,8 +37,10 @@ differently
 
 # pylint: enable=E1101
 
+import collections
+
 from kiwi.currency import currency
-from storm.expr import And, In, Not
+from storm.expr import And, In, LeftJoin, Sum
 from storm.references import Reference
 from zope.interface import implementer
 
@@ -51,6 +53,12 @@ from stoqlib.lib.translation import stoqlib_gettext
 
 _ = stoqlib_gettext
 
+#: The totals of a |paymentgroup|, as returned by the ``get_total_*``
+#: methods of :class:`PaymentGroup`
+PaymentGroupTotals = collections.namedtuple(
+    'PaymentGroupTotals', ['paid', 'value', 'to_pay', 'confirmed',
+                           'discount', 'interest', 'penalty'])
+
 
 @implementer(IContainer)
 class PaymentGroup(Domain):
@@ -132,14 +140,6 @@ class PaymentGroup(Domain):
     # Private
     #
 
-    def _get_paid_payments(self):
-        return self.store.find(Payment,
-                               And(Payment.group_id == self.id,
-                                   In(Payment.status,
-                                      [Payment.STATUS_PAID,
-                                       Payment.STATUS_REVIEWING,
-                                       Payment.STATUS_CONFIRMED])))
-
     def _get_preview_payments(self):
         return self.store.find(Payment,
                                status=Payment.STATUS_PREVIEW,
@@ -160,10 +160,112 @@ class PaymentGroup(Domain):
         #        sale/purchase/renegotiation?
         return currency(payments.sum(attr) or 0)
 
+    @classmethod
+    def _get_totals_from_results(cls, results):
+        totals = {}
+        for (group_id, payment_type, status, sale_id, purchase_id,
+             renegotiation_id, value, discount, interest, penalty) in results:
+            # The same rules used by _get_payments_sum
+            if sale_id is not None or renegotiation_id is not None:
+                sign = 1 if payment_type == Payment.TYPE_IN else -1
+            elif purchase_id is not None:
+                sign = 1 if payment_type == Payment.TYPE_OUT else -1
+            else:
+                sign = 1
+
+            group_totals = totals.setdefault(
+                group_id, dict.fromkeys(PaymentGroupTotals._fields, 0))
+            if status == Payment.STATUS_CANCELLED:
+                continue
+            group_totals['value'] += sign * value
+            group_totals['discount'] += sign * (discount or 0)
+            group_totals['interest'] += sign * (interest or 0)
+            group_totals['penalty'] += sign * (penalty or 0)
+            if status in [Payment.STATUS_PAID, Payment.STATUS_REVIEWING,
+                          Payment.STATUS_CONFIRMED]:
+                group_totals['paid'] += sign * value
+            if status == Payment.STATUS_PENDING:
+                group_totals['to_pay'] += sign * value
+            if status != Payment.STATUS_PREVIEW:
+                group_totals['confirmed'] += sign * value
+
+        return dict((group_id, PaymentGroupTotals(
+            **dict((k, currency(v)) for k, v in group_totals.items())))
+            for group_id, group_totals in totals.items())
+
+    #
+    # Classmethods
+    #
+
+    @classmethod
+    def get_totals_for_groups(cls, store, groups):
+        """Get the totals of many groups at once
+
+        All the totals of the groups are calculated by a single query and
+        kept in a cache until something changes in the store or the
+        transaction ends. Note that changes done directly on the database
+        (e.g. by an ``UPDATE`` statement) will not be noticed.
+
+        :param store: a store
+        :param groups: a sequence of |paymentgroups|
+        :returns: a dict mapping the group ids to their
+          :class:`PaymentGroupTotals`
+        """
+        from stoqlib.domain.payment.renegotiation import PaymentRenegotiation
+        from stoqlib.domain.purchase import PurchaseOrder
+        from stoqlib.domain.sale import Sale
+
+        cache = store.get_transaction_cache(u'payment_group_totals')
+        pending_count = store.get_pending_count()
+        totals = {}
+        missing = set()
+        for group in groups:
+            cached = cache.get(group.id)
+            if cached is not None and cached[0] == pending_count:
+                totals[group.id] = cached[1]
+            else:
+                missing.add(group.id)
+        if not missing:
+            return totals
+
+        tables = [
+            Payment,
+            LeftJoin(Sale, Sale.group_id == Payment.group_id),
+            LeftJoin(PurchaseOrder,
+                     PurchaseOrder.group_id == Payment.group_id),
+            LeftJoin(PaymentRenegotiation,
+                     PaymentRenegotiation.group_id == Payment.group_id),
+        ]
+        columns = [Payment.group_id, Payment.payment_type, Payment.status,
+                   Sale.id, PurchaseOrder.id, PaymentRenegotiation.id]
+        results = store.using(*tables).find(
+            tuple(columns + [Sum(Payment.value), Sum(Payment.discount),
+                             Sum(Payment.interest), Sum(Payment.penalty)]),
+            In(Payment.group_id, list(missing)))
+        results = cls._get_totals_from_results(results.group_by(*columns))
+
+        # The query flushed the store, so take the count again
+        pending_count = store.get_pending_count()
+        empty = PaymentGroupTotals(*[currency(0)] * 7)
+        for group_id in missing:
+            totals[group_id] = results.get(group_id, empty)
+            cache[group_id] = (pending_count, totals[group_id])
+
+        return totals
+
     #
     # Public API
     #
 
+    def get_totals(self):
+        """Get all the totals of this group
+
+        See :meth:`.get_totals_for_groups` for more information.
+
+        :returns: a :class:`PaymentGroupTotals`
+        """
+        return self.get_totals_for_groups(self.store, [self])[self.id]
+
     def get_order_object(self):
         """Get the order object related to this payment group"""
         for obj in [self.sale, self.purchase, self._renegotiation,
@@ -216,8 +318,7 @@ class PaymentGroup(Domain):
 
         :returns: the total paid value
         """
-        return self._get_payments_sum(self._get_paid_payments(),
-                                      Payment.value)
+        return self.get_totals().paid
 
     def get_total_value(self):
         """Returns the sum of all |payment| values.
@@ -229,18 +330,12 @@ class PaymentGroup(Domain):
 
         :returns: the total payment value or zero.
         """
-        return self._get_payments_sum(self.get_valid_payments(),
-                                      Payment.value)
+        return self.get_totals().value
 
     def get_total_to_pay(self):
         """Returns the total amount to be paid to have the group fully paid.
         """
-        payments = self.store.find(
-            Payment,
-            And(Payment.group_id == self.id,
-                Payment.status == Payment.STATUS_PENDING))
-
-        return self._get_payments_sum(payments, Payment.value)
+        return self.get_totals().to_pay
 
     def get_total_confirmed_value(self):
         """Returns the sum of all confirmed payments values
@@ -254,13 +349,7 @@ class PaymentGroup(Domain):
 
         :returns: the total confirmed payments value
         """
-        payments = self.store.find(
-            Payment,
-            And(Payment.group_id == self.id,
-                Not(In(Payment.status,
-                       [Payment.STATUS_CANCELLED, Payment.STATUS_PREVIEW]))))
-
-        return self._get_payments_sum(payments, Payment.value)
+        return self.get_totals().confirmed
 
     # FIXME: with proper database transactions we can probably remove this
     def clear_unused(self):
@@ -323,24 +412,21 @@ class PaymentGroup(Domain):
 
         :returns: the total payment discount or zero.
         """
-        return self._get_payments_sum(self.get_valid_payments(),
-                                      Payment.discount)
+        return self.get_totals().discount
 
     def get_total_interest(self):
         """Returns the sum of all |payment| interests.
 
         :returns: the total payment interest or zero.
         """
-        return self._get_payments_sum(self.get_valid_payments(),
-                                      Payment.interest)
+        return self.get_totals().interest
 
     def get_total_penalty(self):
         """Returns the sum of all |payment| penalties.
 
         :returns: the total payment penalty or zero.
         """
-        return self._get_payments_sum(self.get_valid_payments(),
-                                      Payment.penalty)
+        return self.get_totals().penalty
 
     def get_valid_payments(self):
         """Returns all |payments| that are not cancelled.
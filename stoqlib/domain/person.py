@@ -60,8 +60,8 @@ import operator
 
 from kiwi.currency import currency
 from kiwi.datatypes import converter
-from storm.expr import (And, Coalesce, Eq, Join, LeftJoin, Or, Update, Select,
-                        Alias, Sum)
+from storm.expr import (And, Coalesce, Eq, In, Join, LeftJoin, Or, Update,
+                        Select, Alias, Sum)
 from storm.info import ClassAlias
 from storm.references import Reference, ReferenceSet
 from zope.interface import implementer
@@ -517,44 +517,60 @@ class Person(Domain):
         return self.individual or self.company
 
     def merge_facet(self, this_facet, other_facet):
-        if not other_facet:
+        """Merges the facets of the other persons into this person's one
+
+        :param this_facet: the facet of this person, or ``None``
+        :param other_facet: the facet of the other person, or a list
+          of facets if more than one person is being merged
+        """
+        other_facets = [facet for facet in self._get_merge_objects(other_facet)
+                        if facet]
+        if not other_facets:
             return
 
-        if this_facet is not None:
+        if this_facet is None:
+            # If the other person has the facet but we dont, we just need
+            # to fix the reference of that facet.
+            this_facet = other_facets.pop(0)
+            this_facet.person = self
+
+        if other_facets:
             # if the other person has the facet and so do we, se should: Fix all
             # objects that reference that facet and make them reference this
             # facet; and remove that facet.
-            this_facet.merge_with(other_facet)
-        else:
-            # If the other person has the facet but we dont, we just need
-            # to fix the reference of that facet.
-            other_facet.person = self
+            this_facet.merge_with(other_facets)
 
     def merge_with(self, other, copy_empty_values=True):
         """Merges this person with other objects
 
         This will fix all references that point to the other person, and make
         them point to this person.
+
+        :param other: the person to merge, or a list of persons to merge
+          all at once
         """
+        others = self._get_merge_objects(other)
         skip = set([('person', 'merged_with_id')])
         facets = ['branch', 'individual', 'company', 'client', 'transporter',
                   'supplier', 'sales_person', 'login_user', 'employee']
         for facet in facets:
             skip.add((facet, 'person_id'))
             this_facet = getattr(self, facet)
-            other_facet = getattr(other, facet)
-            self.merge_facet(this_facet, other_facet)
+            other_facets = [getattr(obj, facet) for obj in others]
+            self.merge_facet(this_facet, other_facets)
 
         skip.add(('address', 'person_id'))
         if copy_empty_values:
-            if other.notes:
-                self.notes += '\n' + other.notes
+            for obj in others:
+                if obj.notes:
+                    self.notes += '\n' + obj.notes
 
-            if self.address and other.address:
-                self.address.copy_empty_values(other.address)
+                if self.address and obj.address:
+                    self.address.copy_empty_values(obj.address)
 
-        super(Person, self).merge_with(other, skip, copy_empty_values)
-        other.merged_with_id = self.id
+        super(Person, self).merge_with(others, skip, copy_empty_values)
+        for obj in others:
+            obj.merged_with_id = self.id
 
     def get_description(self):
         return self.name
@@ -684,7 +700,8 @@ class Individual(Domain):
         # If we copied the value from the other object, we also need to reset
         # it, so that there are no duplicate documents in the database
         if copy_empty_values:
-            other.cpf = u''
+            for obj in self._get_merge_objects(other):
+                obj.cpf = u''
 
     def get_marital_statuses(self):
         return [(self.marital_statuses[i], i)
@@ -808,7 +825,8 @@ class Company(Domain):
         # If we copied the value from the other object, we also need to reset
         # it, so that there are no duplicate documents in the database
         if copy_empty_values:
-            other.cnpj = u''
+            for obj in self._get_merge_objects(other):
+                obj.cnpj = u''
 
     def get_cnpj_number(self):
         """Returns the cnpj number without any non-numeric characters
@@ -1098,17 +1116,57 @@ class Client(Domain):
         if max_date:
             return max_date.date()
 
+    @classmethod
+    def _get_payments_totals(cls, store, clients, total, query):
+        totals = dict((client.person_id, 0) for client in clients)
+        if not totals:
+            return totals
+
+        results = store.using(*_ClientPaymentsTables).find(
+            (PaymentGroup.payer_id, total),
+            And(query, In(PaymentGroup.payer_id, list(totals.keys()))))
+        for payer_id, value in results.group_by(PaymentGroup.payer_id):
+            totals[payer_id] = value or 0
+        return totals
+
+    @classmethod
+    def get_remaining_store_credits(cls, store, clients):
+        """Get the :obj:`.remaining_store_credit` of many clients at once
+
+        :param store: a store
+        :param clients: a sequence of |clients|
+        :returns: a dict mapping the client ids to their remaining
+          store credit
+        """
+        debits = cls._get_payments_totals(store, clients,
+                                          _store_credit_debit,
+                                          _store_credit_query)
+        return dict((client.id,
+                     currency(client.credit_limit - debits[client.person_id]))
+                    for client in clients)
+
+    @classmethod
+    def get_credit_account_balances(cls, store, clients):
+        """Get the :obj:`.credit_account_balance` of many clients at once
+
+        :param store: a store
+        :param clients: a sequence of |clients|
+        :returns: a dict mapping the client ids to their credit balance
+        """
+        balances = cls._get_payments_totals(store, clients,
+                                            _credit_account_balance,
+                                            _credit_account_query)
+        return dict((client.id, currency(balances[client.person_id]))
+                    for client in clients)
+
     @property
     def remaining_store_credit(self):
-        from stoqlib.domain.payment.views import InPaymentView
-        status_query = Or(InPaymentView.status == Payment.STATUS_PENDING,
-                          InPaymentView.status == Payment.STATUS_CONFIRMED)
-        query = And(InPaymentView.person_id == self.person.id,
-                    status_query,
-                    InPaymentView.method_name == u'store_credit')
+        """The store credit this client still has to spend
 
-        debit = self.store.find(InPaymentView, query).sum(InPaymentView.value) or currency('0.0')
-        return currency(self.credit_limit - debit)
+        This is the :obj:`.credit_limit` less the value of the pending and
+        confirmed store credit payments.
+        """
+        return self.get_remaining_store_credits(self.store, [self])[self.id]
 
     def get_credit_transactions(self):
         """Returns all credit payments (in and out) associated  with a client's
@@ -1141,16 +1199,7 @@ class Client(Domain):
         """Returns a client's credit balance.
 
         :returns: The client's credit balance."""
-        transactions = self.get_credit_transactions()
-
-        balance = 0
-        for payment in transactions:
-            if payment.payment_type == payment.TYPE_OUT:
-                balance += payment.paid_value
-            else:
-                balance -= payment.paid_value
-
-        return currency(balance)
+        return self.get_credit_account_balances(self.store, [self])[self.id]
 
     @property
     def salary(self):
@@ -1294,8 +1343,16 @@ class Supplier(Domain):
         subselect = Select(columns=[ProductSupplierInfo.product_id],
                            tables=[ProductSupplierInfo],
                            where=(ProductSupplierInfo.supplier_id == self.id))
-        clause = And(ProductSupplierInfo.supplier_id == other.id,
+        other_query = self._get_merge_query(ProductSupplierInfo.supplier_id,
+                                            other)
+        clause = And(other_query,
                      NotIn(ProductSupplierInfo.product_id, subselect))
+        if len(self._get_merge_objects(other)) > 1:
+            # More than one of the other suppliers may have the same product,
+            # but only one of them can be migrated
+            clause = And(clause, In(ProductSupplierInfo.id, Select(
+                columns=[ProductSupplierInfo.id], tables=[ProductSupplierInfo],
+                where=other_query, distinct=[ProductSupplierInfo.product_id])))
         self.store.execute(Update({ProductSupplierInfo.supplier_id: self.id},
                                   clause, ProductSupplierInfo))
 
@@ -1442,7 +1499,7 @@ class Employee(Domain):
 
         # To merged employees: change the EmployeeRoleHistory status to inactive.
         # This is necessary to show that the employee has only an active role.
-        clause = (EmployeeRoleHistory.employee_id == other.id)
+        clause = self._get_merge_query(EmployeeRoleHistory.employee_id, other)
         self.store.execute(Update({EmployeeRoleHistory.is_active: False},
                                   clause, EmployeeRoleHistory))
 
@@ -1553,8 +1610,15 @@ class LoginUser(Domain):
         subselect = Select(columns=[UserBranchAccess.branch_id],
                            tables=[UserBranchAccess],
                            where=(UserBranchAccess.user_id == self.id))
-        clause = And(UserBranchAccess.user_id == other.id,
+        other_query = self._get_merge_query(UserBranchAccess.user_id, other)
+        clause = And(other_query,
                      NotIn(UserBranchAccess.branch_id, subselect))
+        if len(self._get_merge_objects(other)) > 1:
+            # More than one of the other users may have access to the same
+            # branch, but only one of those can be migrated
+            clause = And(clause, In(UserBranchAccess.id, Select(
+                columns=[UserBranchAccess.id], tables=[UserBranchAccess],
+                where=other_query, distinct=[UserBranchAccess.branch_id])))
         self.store.execute(Update({UserBranchAccess.user_id: self.id},
                                   clause, UserBranchAccess))
 
@@ -2082,6 +2146,28 @@ class UserBranchAccess(Domain):
 #
 
 
+_ClientPaymentsTables = [
+    Payment,
+    Join(PaymentGroup, PaymentGroup.id == Payment.group_id),
+    Join(PaymentMethod, PaymentMethod.id == Payment.method_id),
+]
+
+# Credit payments going out of the store add credit to the client account,
+# the ones coming in use that credit
+_credit_account_balance = Sum(Case(
+    condition=Payment.payment_type == Payment.TYPE_OUT,
+    result=Payment.paid_value,
+    else_=-Payment.paid_value))
+_credit_account_query = And(Payment.status == Payment.STATUS_PAID,
+                            PaymentMethod.method_name == u'credit')
+
+_store_credit_debit = Sum(Payment.value)
+_store_credit_query = And(Payment.payment_type == Payment.TYPE_IN,
+                          In(Payment.status, [Payment.STATUS_PENDING,
+                                              Payment.STATUS_CONFIRMED]),
+                          PaymentMethod.method_name == u'store_credit')
+
+
 @implementer(IDescribable)
 class ClientView(Viewable):
     """Stores information about clients.
@@ -2180,6 +2266,28 @@ class ClientView(Viewable):
         ).order_by(cls.name)
 
 
+class ClientBalanceView(ClientView):
+    """A :class:`ClientView` with the client's credit balances
+
+    The balances are subqueries restricted to each client's payments,
+    so they are only calculated for the clients being fetched.
+    """
+
+    #: the client's :obj:`Client.credit_account_balance`
+    credit_account_balance = Coalesce(Select(
+        columns=[_credit_account_balance],
+        tables=_ClientPaymentsTables,
+        where=And(_credit_account_query,
+                  PaymentGroup.payer_id == Person.id)), 0)
+
+    #: the client's :obj:`Client.remaining_store_credit`
+    remaining_store_credit = Client.credit_limit - Coalesce(Select(
+        columns=[_store_credit_debit],
+        tables=_ClientPaymentsTables,
+        where=And(_store_credit_query,
+                  PaymentGroup.payer_id == Person.id)), 0)
+
+
 @implementer(IDescribable)
 class EmployeeView(Viewable):
 
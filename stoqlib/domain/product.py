@@ -89,7 +89,7 @@ from kiwi.currency import currency
 from storm.references import Reference, ReferenceSet
 from storm.exceptions import NotOneError
 from storm.expr import (And, Eq, LeftJoin, Alias, Sum, Coalesce, Select, Join,
-                        Cast, Or, In)
+                        Cast, Or, In, Insert, Max, SQL)
 from zope.interface import implementer
 
 from stoqlib.database.expr import (Field, TransactionTimestamp,
@@ -203,6 +203,25 @@ class ProductSupplierInfo(Domain):
         return self.branch.get_description() if self.branch else _(u'All Branches')
 
 
+#: The ids of all the |product_component| of some products, recursively.
+#: The %s must be replaced by one placeholder for each product id.
+#: Using UNION instead of UNION ALL makes sure this finishes even when
+#: a product is a component of itself.
+_COMPONENTS_TREE_SQL = """
+    WITH RECURSIVE _components_tree(id, component_id) AS (
+        SELECT id, component_id
+          FROM product_component
+         WHERE product_id IN (%s)
+      UNION
+        SELECT product_component.id, product_component.component_id
+          FROM product_component
+          JOIN _components_tree
+            ON product_component.product_id = _components_tree.component_id
+    )
+    SELECT id FROM _components_tree
+"""
+
+
 @implementer(IDescribable)
 class Product(Domain):
     """A Product is a thing that can be:
@@ -491,6 +510,42 @@ class Product(Domain):
 
         return target
 
+    def _get_manufacture_time(self, quantity, tree, balances, lead_times):
+        # Components maximum lead time
+        comp_max_time = 0
+        for i in tree[self.id]:
+            component = i.component
+            # Products without manage stock control doesnt have storable
+            if not component.manage_stock:
+                continue
+            needed = quantity * i.quantity
+            stock = balances.get(component.id, 0)
+            # We have enough of this component items to produce.
+            if stock >= needed:
+                continue
+            if tree[component.id]:
+                lead_time = component._get_manufacture_time(
+                    needed, tree, balances, lead_times)
+            else:
+                lead_time = lead_times.get(component.id) or 0
+            comp_max_time = max(comp_max_time, lead_time)
+        return self.production_time + comp_max_time
+
+    @classmethod
+    def _check_components_cycle(cls, tree, product_id, path, checked):
+        if product_id in checked:
+            return
+        path.append(product_id)
+        for component in tree[product_id]:
+            if component.component_id in path:
+                raise ValueError(
+                    "Product %r is a component of itself" % (
+                        component.component.description, ))
+            cls._check_components_cycle(tree, component.component_id, path,
+                                        checked)
+        path.pop()
+        checked.add(product_id)
+
     #
     #  Public API
     #
@@ -599,26 +654,30 @@ class Product(Domain):
         obtain missing |components| will also be considered (using the max
         lead time from the |suppliers|)
 
+        The whole tree of |components|, their stock and their lead times
+        are fetched at once, instead of querying each component.
+
         :param quantity:
         :param branch: the |branch|
         """
         assert self.is_composed
 
-        # Components maximum lead time
-        comp_max_time = 0
-        for i in self.get_components():
-            # Products without manage stock control doesnt have storable
-            if not i.component.manage_stock:
-                continue
-            storable = i.component.storable
-            needed = quantity * i.quantity
-            stock = storable.get_balance_for_branch(branch)
-            # We have enough of this component items to produce.
-            if stock >= needed:
-                continue
-            comp_max_time = max(comp_max_time,
-                                i.component.get_max_lead_time(needed, branch))
-        return self.production_time + comp_max_time
+        store = self.store
+        tree = Product.get_components_tree(store, [self])
+        product_ids = set(c.component_id
+                          for components in tree.values() for c in components)
+        balances = dict(store.find(
+            (ProductStockItem.storable_id, Sum(ProductStockItem.quantity)),
+            And(ProductStockItem.storable_id.is_in(product_ids),
+                ProductStockItem.branch_id == branch.id)).group_by(
+                    ProductStockItem.storable_id))
+        lead_times = dict(store.find(
+            (ProductSupplierInfo.product_id,
+             Max(ProductSupplierInfo.lead_time)),
+            ProductSupplierInfo.product_id.is_in(product_ids)).group_by(
+                ProductSupplierInfo.product_id))
+        return self._get_manufacture_time(quantity, tree, balances,
+                                          lead_times)
 
     def get_max_lead_time(self, quantity, branch):
         """Returns the longest lead time for this product.
@@ -779,12 +838,9 @@ class Product(Domain):
         :returns: ``True`` if the given product is one of our component or a
           component of our components, otherwise ``False``.
         """
-        for component in self.get_components():
-            if product is component.component:
-                return True
-            if component.component.is_composed_by(product):
-                return True
-        return False
+        tree = Product.get_components_tree(self.store, [self])
+        return any(component.component_id == product.id
+                   for components in tree.values() for component in components)
 
     def child_exists(self, options):
         """Check if the child already exists
@@ -883,6 +939,59 @@ class Product(Domain):
 
         return target
 
+    @classmethod
+    def get_components_tree(cls, store, products):
+        """Get the |components| of some products, recursively
+
+        The whole bill of materials of all the products is fetched using a
+        single query. The results are kept until the transaction finishes
+        or any object is changed in it, so calling this again for the same
+        products (or any of their |components|) will not query the
+        database.
+
+        :param store: a store
+        :param products: a sequence of |product|
+        :returns: a dict mapping the id of each product in the trees
+            (including the given ones) to a list with its
+            |product_component|. Products that are not composed are
+            mapped to an empty list
+        :raises: :exc:`ValueError` if a product is a component of itself
+        """
+        cache = store.get_transaction_cache(u'product_components_tree')
+        pending_count = store.get_pending_count()
+        missing = set(p.id for p in products
+                      if cache.get(p.id, (None, ))[0] != pending_count)
+        if missing:
+            placeholders = ', '.join('?' * len(missing))
+            query = SQL(_COMPONENTS_TREE_SQL % (placeholders, ),
+                        tuple(missing))
+            components = list(store.find(ProductComponent,
+                                         In(ProductComponent.id, query)))
+            store.prefetch(components, 'component')
+
+            # The queries flushed the store, so take the count again
+            pending_count = store.get_pending_count()
+            tree = dict((product_id, []) for product_id in missing)
+            for component in components:
+                tree.setdefault(component.product_id, []).append(component)
+                tree.setdefault(component.component_id, [])
+            for product_id, product_components in tree.items():
+                cache[product_id] = (pending_count, product_components)
+
+        tree = {}
+        to_visit = [p.id for p in products]
+        while to_visit:
+            product_id = to_visit.pop()
+            if product_id in tree:
+                continue
+            tree[product_id] = cache[product_id][1]
+            to_visit.extend(c.component_id for c in tree[product_id])
+
+        checked = set()
+        for product in products:
+            cls._check_components_cycle(tree, product.id, [], checked)
+        return tree
+
     def update_sellable_price(self):
         """Update the sellable price
 
@@ -1798,6 +1907,59 @@ class StockTransactionHistory(Domain):
         autoreload_object(self, obj_store=True)
         autoreload_object(self.product_stock_item, obj_store=True)
 
+    @classmethod
+    def create_from_query(cls, store, type, tables, where, storable_id,
+                          branch_id, quantity, object_id, batch_id=None,
+                          unit_cost=None):
+        """Create one transaction for each row matching the given query
+
+        This is the set-based counterpart of :meth:`Storable.increase_stock`
+        and :meth:`Storable.decrease_stock`: all the transactions are inserted
+        by a single ``INSERT ... SELECT`` and the stock trigger will update
+        the |productstockitems| without loading any object in python. Note
+        that, because of that, :class:`ProductStockUpdateEvent` is not emitted
+        and the caller is responsible for validating the quantities.
+
+        Except for *type*, the values are expressions evaluated for each row,
+        normally columns of the items responsible for the transactions.
+
+        :param store: a store
+        :param type: the type of the transactions. One of the
+            StockTransactionHistory.types
+        :param tables: the tables that will be used to select the rows
+        :param where: the query that restricts the rows
+        :param storable_id: the |storable| id for each row
+        :param branch_id: the |branch| id for each row
+        :param quantity: the quantity for each row. Positive when increasing
+            the stock and negative when decreasing it
+        :param object_id: the id of the object responsible for the transaction
+        :param batch_id: the |batch| id for each row, if any
+        :param unit_cost: the unit cost for each row, if any
+        :returns: the number of transactions created
+        """
+        user = get_current_user(store)
+        columns = collections.OrderedDict([
+            (cls.date, TransactionTimestamp()),
+            (cls.type, Cast(type, 'stock_transaction_history_type')),
+            (cls.responsible_id, Cast(user.id, 'uuid')),
+            (cls.storable_id, storable_id),
+            (cls.branch_id, branch_id),
+            (cls.batch_id, batch_id),
+            (cls.quantity, quantity),
+            (cls.unit_cost, unit_cost),
+            (cls.object_id, object_id),
+        ])
+        select = Select(list(columns.values()), where=where, tables=tables)
+        result = store.execute(Insert(columns, table=cls, values=select))
+
+        # The trigger changed the stock items behind storm's back
+        for obj_info in store._cache.get_cached():
+            obj = obj_info.get_obj()
+            if isinstance(obj, ProductStockItem):
+                store.autoreload(obj)
+
+        return result.rowcount
+
     def get_object(self):
         if self.type in [self.TYPE_INITIAL, self.TYPE_IMPORTED,
                          self.TYPE_UPDATE_STOCK_COST, self.TYPE_MANUAL_ADJUST]:
@@ -37,7 +37,8 @@ from stoqlib.database.properties import (UnicodeCol, DateTimeCol, IntCol,
                                          IdCol, EnumCol)
 from stoqlib.database.viewable import Viewable
 from stoqlib.domain.base import Domain, IdentifiableDomain
-from stoqlib.domain.product import ProductHistory, StockTransactionHistory
+from stoqlib.domain.product import (Product, ProductHistory,
+                                    StockTransactionHistory)
 from stoqlib.domain.interfaces import IContainer, IDescribable
 from stoqlib.lib.dateutils import localnow, localtoday
 from stoqlib.lib.translation import stoqlib_gettext
@@ -330,7 +331,17 @@ class ProductionItem(Domain):
     #
 
     def get_components(self):
-        return self.product.get_components()
+        """Returns the |components| needed to produce this item
+
+        The components are memoized by
+        :meth:`Product.get_components_tree <stoqlib.domain.product.Product.get_components_tree>`,
+        so calling this many times while producing will not query
+        the database again.
+
+        :returns: a list of |product_component|
+        """
+        tree = Product.get_components_tree(self.store, [self.product])
+        return tree[self.product_id]
 
     def can_produce(self, quantity):
         """Returns if we can produce a certain quantity.  We can produce a
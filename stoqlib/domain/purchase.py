@@ -642,11 +642,14 @@ class PurchaseOrder(IdentifiableDomain):
         """ This function returns some necessary data to print the purchase's
         items labels
         """
-        for purchase_item in self.get_items():
+        items = self.get_items().prefetch('sellable')
+        prices = Sellable.get_prices(self.store,
+                                     [item.sellable_id for item in items])
+        for purchase_item in items:
             sellable = purchase_item.sellable
             label_data = Settable(barcode=sellable.barcode, code=sellable.code,
                                   description=sellable.description,
-                                  price=sellable.price, sellable=sellable,
+                                  price=prices[sellable.id], sellable=sellable,
                                   quantity=purchase_item.quantity)
             yield label_data
 
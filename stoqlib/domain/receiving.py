@@ -29,7 +29,7 @@ import collections
 from decimal import Decimal
 
 from kiwi.currency import currency
-from storm.expr import And, Eq
+from storm.expr import And, Cast, Eq, Insert, Join, Max, Select, Sum
 from storm.references import Reference, ReferenceSet
 
 from stoqlib.database.properties import (PriceCol, QuantityCol, IntCol,
@@ -41,8 +41,8 @@ from stoqlib.domain.payment.group import PaymentGroup
 from stoqlib.domain.payment.method import PaymentMethod
 from stoqlib.domain.payment.payment import Payment
 from stoqlib.domain.product import (ProductHistory, StockTransactionHistory,
-                                    StorableBatch)
-from stoqlib.domain.purchase import PurchaseOrder
+                                    Storable, StorableBatch)
+from stoqlib.domain.purchase import PurchaseItem, PurchaseOrder
 from stoqlib.domain.stockdecrease import StockDecreaseItem
 from stoqlib.lib.dateutils import localnow
 from stoqlib.lib.defaults import quantize
@@ -265,11 +265,74 @@ class ReceivingOrder(IdentifiableDomain):
     #
 
     def confirm(self):
+        """Confirms this receiving order
+
+        This does the same as calling :meth:`ReceivingOrderItem.add_stock_items`
+        for each item, but the stock transactions, the product history and
+        the quantities received on the |purchase| are updated by a fixed
+        number of statements, no matter how many items were received.
+
+        :raises: :exc:`ValueError` if the quantity received of any item is
+            greater than the quantity still pending on the |purchase|
+        """
+        store = self.store
         if self.receiving_invoice:
             self.receiving_invoice.confirm()
 
-        for item in self.get_items():
-            item.add_stock_items()
+        query = ReceivingOrderItem.receiving_order_id == self.id
+
+        # More than one item may be receiving the same purchase item, so the
+        # quantities need to be summed before comparing with the pending one
+        received = Sum(ReceivingOrderItem.quantity)
+        pending = Max(PurchaseItem.quantity - PurchaseItem.quantity_received)
+        exceeding = store.using(
+            ReceivingOrderItem,
+            Join(PurchaseItem,
+                 PurchaseItem.id == ReceivingOrderItem.purchase_item_id)).find(
+                     (received, pending), query)
+        exceeding = exceeding.group_by(PurchaseItem.id).having(
+            received > pending).any()
+        if exceeding is not None:
+            raise ValueError(
+                u"Quantity received (%d) is greater than "
+                u"quantity ordered (%d)" % exceeding)
+
+        # The average stock cost is still calculated by the stock trigger,
+        # for each transaction inserted
+        StockTransactionHistory.create_from_query(
+            store, StockTransactionHistory.TYPE_RECEIVED_PURCHASE,
+            tables=[ReceivingOrderItem,
+                    Join(Storable,
+                         Storable.id == ReceivingOrderItem.sellable_id)],
+            where=query,
+            storable_id=Storable.id,
+            branch_id=Cast(self.branch_id, 'uuid'),
+            batch_id=ReceivingOrderItem.batch_id,
+            quantity=ReceivingOrderItem.quantity,
+            unit_cost=(ReceivingOrderItem.cost +
+                       ReceivingOrderItem.ipi_value / ReceivingOrderItem.quantity),
+            object_id=ReceivingOrderItem.id)
+
+        item_received = Select(
+            Sum(ReceivingOrderItem.quantity), tables=[ReceivingOrderItem],
+            where=And(query,
+                      ReceivingOrderItem.purchase_item_id == PurchaseItem.id))
+        store.find(PurchaseItem, PurchaseItem.id.is_in(
+            Select(ReceivingOrderItem.purchase_item_id, where=query))).set(
+                PurchaseItem.quantity_received ==
+                PurchaseItem.quantity_received + item_received)
+
+        history_columns = collections.OrderedDict([
+            (ProductHistory.branch_id, Cast(self.branch_id, 'uuid')),
+            (ProductHistory.sellable_id, ReceivingOrderItem.sellable_id),
+            (ProductHistory.quantity_received, ReceivingOrderItem.quantity),
+        ])
+        if self.receival_date is not None:
+            history_columns[ProductHistory.received_date] = self.receival_date
+        store.execute(Insert(
+            history_columns, table=ProductHistory,
+            values=Select(list(history_columns.values()), where=query,
+                          tables=[ReceivingOrderItem])))
 
         purchases = list(self.purchase_orders)
         for purchase in purchases:
@@ -29,20 +29,24 @@ Sale object and related objects implementation """
 # pylint: enable=E1101
 
 import collections
+import datetime
 from decimal import Decimal
 
 from kiwi.currency import currency
 from kiwi.python import Settable
 from stoqdrivers.enum import TaxType
 from storm.expr import (And, Avg, Count, LeftJoin, Join, Max, In,
-                        Or, Sum, Alias, Select, Cast, Eq, Coalesce, Ne)
+                        Or, Sum, Alias, Select, Cast, Eq, Coalesce, Ne,
+                        Delete, Insert)
 from storm.info import ClassAlias
 from storm.references import Reference, ReferenceSet
+from storm.store import AutoReload
 from zope.interface import implementer
 
 from stoqlib.api import api
 from stoqlib.database.expr import (Concat, Date, Distinct, Field, NullIf,
                                    Round, TransactionTimestamp)
+from stoqlib.database.orm import ORMObject
 from stoqlib.database.properties import (UnicodeCol, DateTimeCol, IntCol,
                                          PriceCol, QuantityCol, IdentifierCol,
                                          IdCol, BoolCol, EnumCol)
@@ -74,6 +78,7 @@ from stoqlib.domain.product import (Product, ProductHistory, Storable,
 from stoqlib.domain.returnedsale import ReturnedSale, ReturnedSaleItem
 from stoqlib.domain.sellable import Sellable, SellableCategory
 from stoqlib.domain.service import Service
+from stoqlib.domain.system import TransactionEntry
 from stoqlib.domain.taxes import check_tax_info_presence, InvoiceItemIpi
 from stoqlib.exceptions import SellError, StockError, DatabaseInconsistency
 from stoqlib.lib.dateutils import localnow
@@ -85,6 +90,27 @@ from stoqlib.lib.translation import stoqlib_gettext
 
 _ = stoqlib_gettext
 
+#: The last time the summary was caught up by SaleSummary.refresh_modified.
+#: FOR UPDATE makes concurrent refreshes wait for each other
+_SALE_SUMMARY_LAST_REFRESH_SQL = """
+    SELECT refresh_time FROM sale_summary_refresh FOR UPDATE
+"""
+#: When the oldest transaction still running on the database started.
+#: Anything it writes will have a te_time after that, even if it commits
+#: after the summary is refreshed
+_SALE_SUMMARY_OLDEST_TRANSACTION_SQL = """
+    SELECT CAST(MIN(xact_start) AS timestamp) FROM pg_stat_activity
+        WHERE datname = CURRENT_DATABASE()
+"""
+_SALE_SUMMARY_UPDATE_REFRESH_SQL = """
+    UPDATE sale_summary_refresh SET refresh_time = %s
+"""
+#: Serializes the refreshes of the same day and branch until the end of
+#: the transaction, so they don't recalculate the rows from stale data
+_SALE_SUMMARY_LOCK_SQL = """
+    SELECT pg_advisory_xact_lock(hashtext(%s))
+"""
+
 # pyflakes: Reference requires that CostCenter is imported at least once
 CostCenter  # pylint: disable=W0104
 
@@ -1297,7 +1323,9 @@ class Sale(IdentifiableDomain):
         # FIXME: We should use self.branch, but it's not supported yet
         store = self.store
         branch = get_current_branch(store)
-        for item in self.get_items():
+        items = self.get_items().prefetch('sellable.product',
+                                          'sellable.product_storable', 'batch')
+        for item in items:
             self.validate_batch(item.batch, sellable=item.sellable)
             if item.sellable.product:
                 ProductHistory.add_sold_item(store, branch, item)
@@ -1313,8 +1341,7 @@ class Sale(IdentifiableDomain):
         self.invoice.branch = branch
 
         if self._create_commission_at_confirm():
-            for payment in self.payments:
-                self.create_commission(payment)
+            self.create_commissions()
 
         if self.client:
             self.group.payer = self.client.person
@@ -1367,8 +1394,7 @@ class Sale(IdentifiableDomain):
         # This code is still here for the users that some payments created
         # (and paid) but no commission created yet.
         # This can be removed sometime in the future.
-        for payment in self.payments:
-            self.create_commission(payment)
+        self.create_commissions()
 
         self.close_date = TransactionTimestamp()
 
@@ -1908,6 +1934,18 @@ class Sale(IdentifiableDomain):
 
         return commission
 
+    def create_commissions(self):
+        """Creates the commissions for all the payments of this sale
+
+        This is the same as calling :meth:`.create_commission` for each
+        one of the :obj:`.payments`, but the items and commission sources
+        are fetched only once, instead of once for each payment.
+
+        :returns: a list with the created |commissions|
+        """
+        from stoqlib.domain.commission import Commission
+        return Commission.create_for_sales(self.store, [self])
+
     def get_first_sale_comment(self):
         first_comment = self.comments.first()
         if first_comment:
@@ -2032,6 +2070,9 @@ class Sale(IdentifiableDomain):
     def _set_sale_status(self, status):
         old_status = self.status
         self.status = status
+        if (old_status in SaleSummary.statuses or
+                status in SaleSummary.statuses):
+            SaleSummary.refresh(self.store, Sale.id == self.id)
 
         SaleStatusChangedEvent.emit(self, old_status)
 
@@ -2303,6 +2344,176 @@ class SaleComment(Domain):
     sale = Reference(sale_id, 'Sale.id')
 
 
+class SaleSummary(ORMObject):
+    """The confirmed |sales| aggregated by day, branch, salesperson
+    and |sellable|
+
+    This is used by the sold items searches and reports, so they don't
+    need to aggregate all the |saleitems| ever sold on every query.
+    It is derived from the |saleitems|, so it is not synchronized and
+    can be recreated at any time by :meth:`.rebuild`.
+
+    The rows are recalculated by :meth:`.refresh` every time the status
+    of a |sale| changes (e.g. when it is confirmed, returned or cancelled).
+    The |sales| modified without going through the domain (e.g. the ones
+    received by the synchronization) are caught up by
+    :meth:`.refresh_modified`, which should be run periodically by
+    ``stoqdbadmin refresh_sale_summary``.
+    """
+
+    __storm_table__ = 'sale_summary'
+
+    #: The statuses of the |sales| that are summarized
+    statuses = [Sale.STATUS_CONFIRMED, Sale.STATUS_RENEGOTIATED]
+
+    id = IntCol(primary=True, default=AutoReload)
+
+    #: The day the |sales| were confirmed
+    date = DateTimeCol()
+
+    branch_id = IdCol()
+    #: The |branch| where the |sales| were done
+    branch = Reference(branch_id, 'Branch.id')
+
+    salesperson_id = IdCol()
+    #: The |salesperson| responsible for the |sales|
+    salesperson = Reference(salesperson_id, 'SalesPerson.id')
+
+    sellable_id = IdCol()
+    #: The |sellable| sold
+    sellable = Reference(sellable_id, 'Sellable.id')
+
+    #: The quantity sold
+    quantity = QuantityCol()
+
+    #: The total sold, the sum of the items' price times their quantity
+    total_sold = PriceCol()
+
+    #: The total cost, the sum of the items' average cost times
+    #: their quantity
+    total_cost = PriceCol()
+
+    #
+    #  Public API
+    #
+
+    @classmethod
+    def refresh(cls, store, query):
+        """Recalculate the summary of the |sales| matching a query
+
+        The rows of each day, |branch| and |sellable| sold by those |sales|
+        are recalculated from all the |saleitems| they summarize, so this
+        can be called as many times as needed. Each day and |branch| is
+        locked until the end of the transaction, so concurrent refreshes
+        of it wait for each other and see the |sales| they committed.
+
+        :param store: a store
+        :param query: the query restricting the |sales|
+        """
+        # The summary dates are stored as timestamps, like all the others
+        confirm_date = Cast(Date(Sale.confirm_date), 'timestamp')
+        tables = [Sale, Join(SaleItem, SaleItem.sale_id == Sale.id)]
+        keys = store.using(*tables).find(
+            (confirm_date, Sale.branch_id, SaleItem.sellable_id),
+            And(query, Ne(Sale.confirm_date, None)))
+        keys.config(distinct=True)
+
+        sellables = collections.defaultdict(set)
+        for date, branch_id, sellable_id in keys:
+            sellables[date, branch_id].add(sellable_id)
+        if not sellables:
+            return
+
+        # Always lock in the same order to avoid deadlocks
+        for date, branch_id in sorted(sellables):
+            store.execute(_SALE_SUMMARY_LOCK_SQL,
+                          ('sale_summary:%s:%s' % (date.date(), branch_id), ))
+
+        summary_queries = []
+        sale_queries = []
+        for (date, branch_id), sellable_ids in sellables.items():
+            summary_queries.append(And(cls.date == date,
+                                       cls.branch_id == branch_id,
+                                       cls.sellable_id.is_in(sellable_ids)))
+            sale_queries.append(And(Sale.confirm_date >= date,
+                                    Sale.confirm_date < date + datetime.timedelta(days=1),
+                                    Sale.branch_id == branch_id,
+                                    SaleItem.sellable_id.is_in(sellable_ids)))
+
+        store.execute(Delete(Or(*summary_queries), table=cls))
+        cls._insert(store, Or(*sale_queries))
+
+    @classmethod
+    def refresh_modified(cls, store):
+        """Recalculate the summary of the |sales| modified since last time
+
+        The |sales| and |saleitems| are considered modified when their
+        transaction entry was changed after the oldest transaction running
+        the last time this was called started. That way the ones committed
+        after the last refresh are not missed, at the cost of refreshing
+        some |sales| twice.
+
+        :param store: a store
+        """
+        since = store.execute(_SALE_SUMMARY_LAST_REFRESH_SQL).get_one()[0]
+        until = store.execute(_SALE_SUMMARY_OLDEST_TRANSACTION_SQL).get_one()[0]
+        te_query = TransactionEntry.te_time >= since
+        modified_sales = Select(
+            Sale.id, where=te_query,
+            tables=[Sale, Join(TransactionEntry,
+                               TransactionEntry.id == Sale.te_id)])
+        modified_items = Select(
+            SaleItem.sale_id, where=te_query,
+            tables=[SaleItem, Join(TransactionEntry,
+                                   TransactionEntry.id == SaleItem.te_id)])
+
+        cls.refresh(store, Or(Sale.id.is_in(modified_sales),
+                              Sale.id.is_in(modified_items)))
+        store.execute(_SALE_SUMMARY_UPDATE_REFRESH_SQL, (until, ))
+
+    @classmethod
+    def rebuild(cls, store):
+        """Recalculate the whole summary
+
+        :param store: a store
+        """
+        store.execute(_SALE_SUMMARY_LAST_REFRESH_SQL)
+        until = store.execute(_SALE_SUMMARY_OLDEST_TRANSACTION_SQL).get_one()[0]
+        # Make the refreshes of any day wait for the rebuild
+        store.execute("LOCK TABLE sale_summary IN EXCLUSIVE MODE")
+        store.execute(Delete(table=cls))
+        cls._insert(store)
+        store.execute(_SALE_SUMMARY_UPDATE_REFRESH_SQL, (until, ))
+
+    #
+    #  Private
+    #
+
+    @classmethod
+    def _insert(cls, store, query=None):
+        columns = collections.OrderedDict([
+            (cls.date, Date(Sale.confirm_date)),
+            (cls.branch_id, Sale.branch_id),
+            (cls.salesperson_id, Sale.salesperson_id),
+            (cls.sellable_id, SaleItem.sellable_id),
+            (cls.quantity, Sum(SaleItem.quantity)),
+            (cls.total_sold, Sum(Round(SaleItem.price * SaleItem.quantity,
+                                       DECIMAL_PRECISION))),
+            (cls.total_cost, Sum(Round(SaleItem.quantity * SaleItem.average_cost,
+                                       DECIMAL_PRECISION))),
+        ])
+        values = list(columns.values())
+
+        queries = [Sale.status.is_in(cls.statuses),
+                   Ne(Sale.confirm_date, None)]
+        if query is not None:
+            queries.append(query)
+
+        select = Select(values, where=And(*queries), group_by=values[:4],
+                        tables=[SaleItem, Join(Sale, Sale.id == SaleItem.sale_id)])
+        store.execute(Insert(columns, table=cls, values=select))
+
+
 #
 # Views
 #
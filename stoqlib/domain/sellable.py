@@ -40,7 +40,8 @@ from decimal import Decimal
 
 from kiwi.currency import currency
 from stoqdrivers.enum import TaxType, UnitType
-from storm.expr import And, Or, In, Eq
+from storm.expr import And, Or, In, Eq, LeftJoin, SQL
+from storm.info import ClassAlias
 from storm.references import Reference, ReferenceSet
 from zope.interface import implementer
 
@@ -52,6 +53,7 @@ from stoqlib.domain.events import (CategoryCreateEvent, CategoryEditEvent,
                                    SellableCheckTaxesEvent)
 from stoqlib.domain.interfaces import IDescribable
 from stoqlib.domain.image import Image
+from stoqlib.domain.overrides import SellableBranchOverride
 from stoqlib.exceptions import SellableError, TaxError
 from stoqlib.lib.defaults import quantize
 from stoqlib.lib.dateutils import localnow
@@ -162,6 +164,51 @@ class SellableTaxConstant(Domain):
         return self.description
 
 
+#: The ids of some categories and all of their children, recursively.
+#: The %s must be replaced by one placeholder for each category id
+_CATEGORY_SUBTREE_SQL = """
+    WITH RECURSIVE _category_subtree(id) AS (
+        SELECT id FROM sellable_category WHERE id IN (%s)
+      UNION
+        SELECT sellable_category.id
+          FROM sellable_category
+          JOIN _category_subtree
+            ON sellable_category.category_id = _category_subtree.id
+    )
+    SELECT id FROM _category_subtree
+"""
+
+#: The ids of a category and all of its parents
+_CATEGORY_PARENTS_SQL = """
+    WITH RECURSIVE _category_parents(id, category_id) AS (
+        SELECT id, category_id FROM sellable_category WHERE id = ?
+      UNION
+        SELECT sellable_category.id, sellable_category.category_id
+          FROM sellable_category
+          JOIN _category_parents
+            ON sellable_category.id = _category_parents.category_id
+    )
+    SELECT id FROM _category_parents
+"""
+
+#: The full description of all the categories, built from the base categories
+_CATEGORY_FULL_DESCRIPTION_SQL = """
+    WITH RECURSIVE _category_path(id, full_description) AS (
+        SELECT id, COALESCE(description, '')
+          FROM sellable_category
+         WHERE category_id IS NULL
+      UNION ALL
+        SELECT sellable_category.id,
+               _category_path.full_description || ':' ||
+               COALESCE(sellable_category.description, '')
+          FROM sellable_category
+          JOIN _category_path
+            ON sellable_category.category_id = _category_path.id
+    )
+    SELECT id, full_description FROM _category_path
+"""
+
+
 # pylint: disable=E1101
 @implementer(IDescribable)
 class SellableCategory(Domain):
@@ -218,6 +265,8 @@ class SellableCategory(Domain):
     def full_description(self):
         """The full description of the category, including its parents,
         for instance: u"Clothes:Shoes:Black Shoe 14 SL"
+
+        Use :meth:`.get_full_descriptions` when describing many categories
         """
 
         descriptions = [self.description]
@@ -244,17 +293,36 @@ class SellableCategory(Domain):
                   D   E
 
         In this example, calling this from A will return ``set([B, C, D, E])``
+
+        The whole tree is fetched using a single query.
         """
-        children = set(self.children)
+        query = And(In(SellableCategory.id,
+                       self.get_subtree_query(self.store, [self])),
+                    SellableCategory.id != self.id)
+        return set(self.store.find(SellableCategory, query))
 
-        if not len(children):
-            # Base case for the leafs
-            return set()
+    def get_path(self):
+        """Return this category and all its parents, starting from the
+        base category
 
-        for child in list(children):
-            children |= child.get_children_recursively()
+        In the example of :meth:`.get_children_recursively`, calling this
+        from D will return ``[A, B, D]``. All the categories are fetched
+        using a single query.
 
-        return children
+        :returns: a list of |sellablecategory|
+        """
+        parents = self.store.find(
+            SellableCategory,
+            In(SellableCategory.id, SQL(_CATEGORY_PARENTS_SQL, (self.id, ))))
+        parents = dict((c.id, c) for c in parents)
+
+        path = []
+        category = self
+        while category is not None and category not in path:
+            path.append(category)
+            category = parents.get(category.category_id)
+        path.reverse()
+        return path
 
     def get_commission(self):
         """Returns the commission for this category.
@@ -301,6 +369,44 @@ class SellableCategory(Domain):
     # Classmethods
     #
 
+    @classmethod
+    def get_subtree_query(cls, store, categories):
+        """Get a query with the ids of some categories and of all of their
+        children, recursively
+
+        This is useful to filter objects by a category tree, e.g.::
+
+          query = In(Sellable.category_id,
+                     SellableCategory.get_subtree_query(store, [category]))
+
+        :param store: a store
+        :param categories: a list of |sellablecategory|
+        :returns: a query to be used as the values of an ``In`` expression
+        """
+        ids = [c.id for c in categories]
+        if not ids:
+            # An empty IN () is not valid, but this will not match anything
+            ids = [None]
+        placeholders = ', '.join('?' * len(ids))
+        return SQL(_CATEGORY_SUBTREE_SQL % (placeholders, ), tuple(ids))
+
+    @classmethod
+    def get_full_descriptions(cls, store, categories=None):
+        """Get the :obj:`.full_description` of many categories at once
+
+        All the descriptions are built by the database using a single query,
+        instead of walking the parents of each category.
+
+        :param store: a store
+        :param categories: a list of |sellablecategory| or ``None`` to
+            get the description of all the categories
+        :returns: a dict mapping the category id to its full description
+        """
+        descriptions = dict(store.execute(_CATEGORY_FULL_DESCRIPTION_SQL))
+        if categories is None:
+            return descriptions
+        return dict((c.id, descriptions.get(c.id)) for c in categories)
+
     @classmethod
     def get_base_categories(cls, store):
         """Returns all available base categories
@@ -577,9 +683,12 @@ class Sellable(Domain):
         if self.is_on_sale():
             return self.on_sale_price
         else:
-            category = sysparam.get_object(self.store, 'DEFAULT_TABLE_PRICE')
-            if category:
-                info = self.get_category_price_info(category)
+            # Use the id directly to avoid building the category just to
+            # find its price
+            category_id = sysparam.get_object_id('DEFAULT_TABLE_PRICE')
+            if category_id:
+                info = self.store.find(ClientCategoryPrice, sellable=self,
+                                       category_id=category_id).one()
                 if info:
                     return info.price
             return self.base_price
@@ -928,6 +1037,90 @@ class Sellable(Domain):
 
         self.store.remove(self)
 
+    @classmethod
+    def get_prices(cls, store, sellables, category=None, branch=None):
+        """Get the prices of many sellables at once
+
+        This resolves the same price :attr:`.price` would (or
+        :meth:`.get_price_for_category` when *category* is given) for
+        each one of the sellables, considering the on sale price, the
+        ``DEFAULT_TABLE_PRICE`` parameter and the |clientcategory|
+        prices, but using a single query for all of them.
+
+        :param store: a store
+        :param sellables: a sequence of |sellables| or their ids
+        :param category: if not ``None``, the |clientcategory| whose
+          prices should take precedence over the other ones
+        :param branch: if not ``None``, the |branch| whose
+          :class:`stoqlib.domain.overrides.SellableBranchOverride` should
+          be used instead of the sellable values
+        :returns: a dict mapping the sellable ids to their prices
+        """
+        ids = [getattr(sellable, 'id', sellable) for sellable in sellables]
+        if not ids:
+            return {}
+
+        columns = [cls.id, cls.base_price, cls.on_sale_price,
+                   cls.on_sale_start_date, cls.on_sale_end_date]
+        tables = [cls]
+        price_categories = [sysparam.get_object_id('DEFAULT_TABLE_PRICE'),
+                            category and category.id]
+        for i, category_id in enumerate(price_categories):
+            if not category_id:
+                continue
+            CategoryPrice = ClassAlias(ClientCategoryPrice,
+                                       'client_category_price_%d' % i)
+            columns.append(CategoryPrice.price)
+            tables.append(LeftJoin(
+                CategoryPrice,
+                And(CategoryPrice.sellable_id == cls.id,
+                    CategoryPrice.category_id == category_id)))
+
+        if branch is not None:
+            columns.extend([SellableBranchOverride.base_price,
+                            SellableBranchOverride.on_sale_price,
+                            SellableBranchOverride.on_sale_start_date,
+                            SellableBranchOverride.on_sale_end_date])
+            tables.append(LeftJoin(
+                SellableBranchOverride,
+                And(SellableBranchOverride.sellable_id == cls.id,
+                    SellableBranchOverride.branch_id == branch.id)))
+
+        now = localnow()
+        prices = {}
+        results = store.using(*tables).find(tuple(columns), In(cls.id, ids))
+        for row in results:
+            row = list(row)
+            sellable_id = row.pop(0)
+            base_price, on_sale_price, start_date, end_date = row[:4]
+            if branch is not None:
+                overrides = row[-4:]
+                row = row[:-4]
+                base_price, on_sale_price, start_date, end_date = [
+                    value if override is None else override for value, override
+                    in zip([base_price, on_sale_price, start_date, end_date],
+                           overrides)]
+
+            default_price = category_price = None
+            category_prices = row[4:]
+            if price_categories[0]:
+                default_price = category_prices.pop(0)
+            if price_categories[1]:
+                category_price = category_prices.pop(0)
+
+            if category_price is not None:
+                price = category_price
+            elif on_sale_price and is_date_in_interval(now, start_date,
+                                                       end_date):
+                price = on_sale_price
+            elif default_price is not None:
+                price = default_price
+            else:
+                price = base_price
+            prices[sellable_id] = currency(price)
+
+        return prices
+
     @classmethod
     def get_available_sellables_query(cls, store):
         """Get the sellables that are available and can be sold.
@@ -1012,6 +1205,17 @@ class Sellable(Domain):
                                                   consigned)
         return store.find(cls, query)
 
+    @classmethod
+    def get_by_category_tree_query(cls, store, categories):
+        """Returns a query to find the sellables in some categories or in
+        any of their children, recursively
+
+        :param store: a store
+        :param categories: a list of SellableCategory instances
+        """
+        return In(Sellable.category_id,
+                  SellableCategory.get_subtree_query(store, categories))
+
     @classmethod
     def get_unblocked_by_categories_query(cls, store, categories,
                                           include_uncategorized=True):
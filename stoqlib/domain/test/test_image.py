@@ -24,9 +24,21 @@
 
 __tests__ = 'stoqlib/domain/image.py'
 
+import hashlib
+import io
+
+import mock
+from PIL import Image as PILImage
+
 from stoqlib.domain.image import Image
 from stoqlib.domain.test.domaintest import DomainTest
 from stoqlib.domain.events import (ImageCreateEvent, ImageEditEvent)
+from stoqlib.lib.imageutils import get_image_thumbnail
+
+
+class _DictCache(dict):
+    def put(self, data):
+        self[hashlib.md5(data).hexdigest()] = data
 
 
 class TestImage(DomainTest):
@@ -40,6 +52,66 @@ class TestImage(DomainTest):
         # the second argument is the string 'teste' with base64 encoding
         self.assertEqual(image.get_base64_encoded(), 'dGVzdGU=')
 
+    def test_get_main_image_id(self):
+        sellable = self.create_sellable()
+        self.assertIsNone(Image.get_main_image_id(self.store, sellable))
+
+        image = self.create_image()
+        image.sellable = sellable
+        self.assertIsNone(Image.get_main_image_id(self.store, sellable))
+        image.is_main = True
+        self.assertEqual(Image.get_main_image_id(self.store, sellable),
+                         image.id)
+
+    def test_get_image_data(self):
+        image = self.create_image()
+        image.image = b'image'
+        image.thumbnail = b'thumbnail'
+        self.assertEqual(Image.get_image_data(self.store, image.id), b'image')
+
+    def test_get_thumbnails(self):
+        image1 = self.create_image()
+        image1.image = b'image1'
+        image1.thumbnail = b'thumbnail1'
+        image2 = self.create_image()
+        image2.image = b'image2'
+        self.assertEqual(Image.get_thumbnails(self.store, []), {})
+        self.assertEqual(
+            Image.get_thumbnails(self.store, [image1.id, image2.id]),
+            {image1.id: b'thumbnail1', image2.id: None})
+
+        cache = _DictCache()
+        self.assertEqual(
+            Image.get_thumbnails(self.store, [image1.id, image2.id],
+                                 cache=cache),
+            {image1.id: b'thumbnail1', image2.id: None})
+        self.assertEqual(list(cache.values()), [b'thumbnail1'])
+
+        # The thumbnail data should come from the cache now
+        digest = hashlib.md5(b'thumbnail1').hexdigest()
+        cache[digest] = b'cached'
+        self.assertEqual(
+            Image.get_thumbnails(self.store, [image1.id], cache=cache),
+            {image1.id: b'cached'})
+
+    def test_get_image_thumbnail(self):
+        self.assertIsNone(get_image_thumbnail(
+            self.store, u'00000000-0000-0000-0000-000000000000'))
+
+        # An image without a thumbnail, not committed yet
+        image = self.create_image()
+        with io.BytesIO() as f:
+            PILImage.new('RGB', (400, 400)).save(f, 'png')
+            image.image = f.getvalue()
+
+        cache = _DictCache()
+        with mock.patch('stoqlib.lib.imageutils.get_thumbnail_cache',
+                        return_value=cache):
+            thumbnail = get_image_thumbnail(self.store, image.id)
+        self.assertIsNotNone(thumbnail)
+        self.assertEqual(image.thumbnail, thumbnail)
+        self.assertEqual(list(cache.values()), [thumbnail])
+
     def test_get_description(self):
         image = self.create_image()
         image.description = u'Test test'
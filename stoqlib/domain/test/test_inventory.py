@@ -31,6 +31,7 @@ from stoqlib.domain.inventory import (Inventory, InventoryView,
 from stoqlib.domain.product import StockTransactionHistory
 from stoqlib.domain.sellable import Sellable
 from stoqlib.domain.test.domaintest import DomainTest
+from stoqlib.exceptions import StockError
 
 __tests__ = 'stoqlib/domain/inventory.py'
 
@@ -242,6 +243,53 @@ class TestInventory(DomainTest):
         inventory.cancel()
         self.assertRaises(AssertionError, inventory.close)
 
+    def test_adjust_items(self):
+        inventory = self.create_inventory()
+        increased = self.create_inventory_item(inventory, 5)
+        increased.counted_quantity = 8
+        decreased = self.create_inventory_item(inventory, 5)
+        decreased.counted_quantity = 2
+        unchanged = self.create_inventory_item(inventory, 5)
+        unchanged.counted_quantity = 5
+        not_counted = self.create_inventory_item(inventory, 5)
+
+        inventory.adjust_items(invoice_number=13, reason=u'Test')
+        branch = inventory.branch
+        for item, adjusted, stock in [(increased, True, 8),
+                                      (decreased, True, 2),
+                                      (unchanged, False, 5),
+                                      (not_counted, False, 5)]:
+            self.assertEqual(item.is_adjusted, adjusted)
+            storable = item.product.storable
+            self.assertEqual(storable.get_balance_for_branch(branch), stock)
+
+        self.assertEqual(increased.actual_quantity, 8)
+        self.assertEqual(increased.reason, u'Test')
+        self.assertEqual(not_counted.actual_quantity, None)
+
+        transactions = self.store.find(
+            StockTransactionHistory,
+            type=StockTransactionHistory.TYPE_INVENTORY_ADJUST)
+        self.assertEqual(set((t.object_id, t.quantity) for t in transactions),
+                         set([(increased.id, 3), (decreased.id, -3)]))
+
+        entries = self.store.find(FiscalBookEntry,
+                                  entry_type=FiscalBookEntry.TYPE_INVENTORY,
+                                  branch=branch)
+        self.assertEqual(entries.count(), 2)
+        self.assertEqual(set(e.invoice_number for e in entries), set([13]))
+
+    def test_adjust_items_without_stock(self):
+        inventory = self.create_inventory()
+        item = self.create_inventory_item(inventory, 5)
+        item.counted_quantity = 2
+        storable = item.product.storable
+        storable.decrease_stock(4, inventory.branch,
+                                StockTransactionHistory.TYPE_INITIAL, None)
+
+        with self.assertRaises(StockError):
+            inventory.adjust_items(invoice_number=13, reason=u'Test')
+
     def test_all_items_counted(self):
         inventory = self.create_inventory()
         item1 = self.create_inventory_item(inventory)
@@ -25,7 +25,7 @@ import decimal
 
 from kiwi.currency import currency
 
-from stoqlib.exceptions import DatabaseInconsistency
+from stoqlib.exceptions import DatabaseInconsistency, StockError
 from stoqlib.database.runtime import get_current_branch
 from stoqlib.domain.loan import Loan, LoanItem, _
 from stoqlib.domain.product import StockTransactionHistory
@@ -131,6 +131,50 @@ class TestLoan(DomainTest):
 
         self.assertEqual(compare, expected)
 
+    def test_sync_stock_many_items(self):
+        loan = self.create_loan()
+        items = [self.create_loan_item(loan=loan, quantity=i + 1)
+                 for i in range(5)]
+
+        loan.sync_stock()
+        for i, item in enumerate(items):
+            self.assertEqual(
+                item.storable.get_balance_for_branch(loan.branch), 9 - i)
+            self.assertEqual(
+                self.store.find(StockTransactionHistory,
+                                type=StockTransactionHistory.TYPE_LOANED,
+                                object_id=item.id).count(), 1)
+
+        # Syncing again should not change anything
+        loan.sync_stock()
+        self.assertEqual(
+            items[0].storable.get_balance_for_branch(loan.branch), 9)
+
+        for item in items:
+            item.return_quantity = item.quantity
+        loan.close()
+        self.assertEqual(loan.status, Loan.STATUS_CLOSED)
+        for item in items:
+            self.assertEqual(
+                item.storable.get_balance_for_branch(loan.branch), 10)
+            self.assertEqual(
+                self.store.find(StockTransactionHistory,
+                                type=StockTransactionHistory.TYPE_RETURNED_LOAN,
+                                object_id=item.id).count(), 1)
+
+    def test_sync_stock_without_stock(self):
+        loan = self.create_loan()
+        item1 = self.create_loan_item(loan=loan, quantity=5)
+        item2 = self.create_loan_item(loan=loan, quantity=11)
+
+        with self.assertRaises(StockError):
+            loan.sync_stock()
+
+        # Nothing should have been decreased
+        for item in [item1, item2]:
+            self.assertEqual(
+                item.storable.get_balance_for_branch(loan.branch), 10)
+
     def test_can_close(self):
         loan_item = self.create_loan_item()
         loan = loan_item.loan
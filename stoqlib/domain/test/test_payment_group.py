@@ -30,6 +30,7 @@ from kiwi.python import Settable
 from stoqlib.database.runtime import get_current_branch
 from stoqlib.domain.commission import CommissionSource, Commission
 from stoqlib.domain.events import PaymentGroupGetOrderEvent
+from stoqlib.domain.payment.group import PaymentGroup
 from stoqlib.domain.payment.method import PaymentMethod
 from stoqlib.domain.payment.payment import Payment
 from stoqlib.domain.sale import Sale
@@ -311,6 +312,56 @@ class TestPaymentGroup(DomainTest):
         method.create_payment(Payment.TYPE_IN, group, purchase.branch, Decimal(50))
         self.assertEqual(group.get_total_value(), Decimal(250))
 
+    def test_get_totals_for_groups(self):
+        method = PaymentMethod.get_by_name(self.store, u'check')
+        sale = self.create_sale()
+        purchase = self.create_purchase_order()
+        lonely_group = self.create_payment_group()
+
+        p = method.create_payment(Payment.TYPE_IN, sale.group, sale.branch,
+                                  Decimal(100))
+        p.set_pending()
+        p.pay()
+        pending = method.create_payment(Payment.TYPE_IN, sale.group,
+                                        sale.branch, Decimal(200))
+        pending.set_pending()
+        pending.discount = 10
+        method.create_payment(Payment.TYPE_OUT, sale.group, sale.branch,
+                              Decimal(50))
+        p = method.create_payment(Payment.TYPE_OUT, purchase.group,
+                                  purchase.branch, Decimal(80))
+        p.set_pending()
+        p.cancel()
+        method.create_payment(Payment.TYPE_IN, purchase.group,
+                              purchase.branch, Decimal(30))
+
+        groups = [sale.group, purchase.group, lonely_group]
+        totals = PaymentGroup.get_totals_for_groups(self.store, groups)
+        self.assertEqual(totals[sale.group.id],
+                         (100, 250, 200, 300, 10, 0, 0))
+        self.assertEqual(totals[purchase.group.id],
+                         (0, -30, 0, 0, 0, 0, 0))
+        self.assertEqual(totals[lonely_group.id], (0, 0, 0, 0, 0, 0, 0))
+
+        # The totals are cached until something changes
+        with self.count_tracer() as tracer:
+            # count_tracer invalidates the store, so the objects
+            # need to be loaded again before counting
+            group = sale.group
+            for g in groups:
+                g.id
+            count = tracer.count
+
+            self.assertEqual(group.get_total_paid(), 100)
+            self.assertEqual(group.get_total_to_pay(), 200)
+            self.assertEqual(
+                PaymentGroup.get_totals_for_groups(self.store, groups), totals)
+        self.assertEqual(tracer.count, count)
+
+        pending.cancel()
+        self.assertEqual(sale.group.get_total_to_pay(), 0)
+        self.assertEqual(sale.group.get_total_value(), 50)
+
     def test_get_total_to_pay(self):
         method = PaymentMethod.get_by_name(self.store, u'check')
 
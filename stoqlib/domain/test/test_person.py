@@ -36,7 +36,8 @@ from storm.tracer import BaseStatementTracer, install_tracer, remove_tracer_type
 
 from stoqlib.database.expr import Age, Case, Date, DateTrunc, Interval
 from stoqlib.domain.event import Event
-from stoqlib.domain.person import (Calls, ContactInfo, ClientView, EmployeeView,
+from stoqlib.domain.person import (Calls, ContactInfo, ClientView,
+                                   ClientBalanceView, EmployeeView,
                                    SupplierView, TransporterView, BranchView,
                                    UserView, CreditCheckHistoryView, CallsView,
                                    ClientSalaryHistoryView, PersonAddressView,
@@ -713,6 +714,64 @@ class TestClient(_PersonFacetTest, DomainTest):
         self.assertTrue(client.can_purchase(method, currency('200')))
         self.assertRaises(SellError, client.can_purchase, method, currency('1001'))
 
+    def _create_client_payment(self, client, payment_type, method_name,
+                               value, pay=True):
+        method = PaymentMethod.get_by_name(self.store, method_name)
+        payment = self.create_payment(payment_type, value=value, method=method)
+        payment.group.payer = client.person
+        payment.set_pending()
+        if pay:
+            payment.pay()
+        return payment
+
+    def test_get_credit_account_balances(self):
+        client = self.create_client()
+        other_client = self.create_client()
+        self._create_client_payment(client, Payment.TYPE_OUT, u'credit', 100)
+        self._create_client_payment(client, Payment.TYPE_IN, u'credit', 30)
+        self._create_client_payment(other_client, Payment.TYPE_OUT, u'credit',
+                                    50)
+        # Only paid payments are considered
+        self._create_client_payment(other_client, Payment.TYPE_IN, u'credit',
+                                    10, pay=False)
+        without_credit = self.create_client()
+
+        self.assertEqual(Client.get_credit_account_balances(self.store, []),
+                         {})
+        balances = Client.get_credit_account_balances(
+            self.store, [client, other_client, without_credit])
+        self.assertEqual(balances, {client.id: 70,
+                                    other_client.id: 50,
+                                    without_credit.id: 0})
+        self.assertEqual(client.credit_account_balance, 70)
+
+        view = self.store.find(ClientBalanceView, id=client.id).one()
+        self.assertEqual(view.credit_account_balance, 70)
+
+    def test_get_remaining_store_credits(self):
+        client = self.create_client()
+        client.credit_limit = 1000
+        other_client = self.create_client()
+        other_client.credit_limit = 100
+        self._create_client_payment(client, Payment.TYPE_IN, u'store_credit',
+                                    200, pay=False)
+        payment = self._create_client_payment(
+            client, Payment.TYPE_IN, u'store_credit', 300, pay=False)
+        payment.status = Payment.STATUS_CONFIRMED
+        # Paid payments don't count anymore
+        self._create_client_payment(other_client, Payment.TYPE_IN,
+                                    u'store_credit', 50)
+
+        credits = Client.get_remaining_store_credits(
+            self.store, [client, other_client])
+        self.assertEqual(credits, {client.id: 500, other_client.id: 100})
+        self.assertEqual(client.remaining_store_credit, 500)
+
+        view = self.store.find(ClientBalanceView, id=client.id).one()
+        self.assertEqual(view.remaining_store_credit, 500)
+        view = self.store.find(ClientBalanceView, id=other_client.id).one()
+        self.assertEqual(view.remaining_store_credit, 100)
+
     def test_update_credit_limit(self):
         client = self.create_client()
         client.salary = 100
@@ -1697,3 +1756,53 @@ class TestPersonMerging(DomainTest):
 
         products = set(i.product for i in infos)
         self.assertEqual(products, set([product1, product2]))
+
+    def test_merge_many(self):
+        client = self.create_client()
+        client.person.individual.cpf = u''
+        others = [self.create_client() for i in range(3)]
+        others[0].person.individual.cpf = u'123.456.789-09'
+        sales = [self.create_sale(client=other) for other in others]
+        self.store.flush()
+
+        # Each referencing column is updated only once for all the clients
+        tracer = StoqlibUpdateTracer([])
+        install_tracer(tracer)
+        try:
+            client.person.merge_with([other.person for other in others])
+        finally:
+            remove_tracer_type(StoqlibUpdateTracer)
+        sale_updates = [statement for statement, params in tracer.statements
+                        if statement.startswith('UPDATE sale SET client_id')]
+        self.assertEqual(len(sale_updates), 1)
+        self.assertTrue(re.match(
+            'UPDATE sale SET client_id=%s WHERE sale.client_id IN \(%s, %s, %s\)',
+            sale_updates[0]))
+
+        self.store.invalidate()
+        for sale in sales:
+            self.assertEqual(sale.client, client)
+        for other in others:
+            self.assertEqual(other.person.merged_with_id, client.person.id)
+        self.assertEqual(client.person.individual.cpf, u'123.456.789-09')
+        self.assertEqual(others[0].person.individual.cpf, u'')
+
+    def test_merge_many_supplier_product_info(self):
+        sup1 = self.create_supplier()
+        sup2 = self.create_supplier()
+        sup3 = self.create_supplier()
+
+        product1 = self.create_product()
+        product2 = self.create_product()
+
+        # Both suppliers 2 and 3 supply product 2
+        self.create_product_supplier_info(supplier=sup1, product=product1)
+        self.create_product_supplier_info(supplier=sup2, product=product2)
+        self.create_product_supplier_info(supplier=sup3, product=product2)
+
+        sup1.merge_with([sup2, sup3])
+
+        infos = list(self.store.find(ProductSupplierInfo, supplier=sup1))
+        products = set(i.product for i in infos)
+        self.assertEqual(products, set([product1, product2]))
+        self.assertEqual(len(infos), 2)
@@ -28,6 +28,7 @@ from storm.exceptions import NotOneError
 
 from stoqlib.exceptions import StockError
 from stoqlib.database.runtime import get_current_branch, new_store
+from stoqlib.database.testsuite import StoqlibTestsuiteTracer
 from stoqlib.domain.events import (ProductCreateEvent, ProductEditEvent,
                                    ProductRemoveEvent)
 from stoqlib.domain.payment.method import PaymentMethod
@@ -270,6 +271,51 @@ class TestProduct(DomainTest):
         self.assertEqual(component.is_composed_by(component3), False)
         self.assertEqual(component2.is_composed_by(component3), False)
 
+    def test_get_components_tree(self):
+        component = self.create_product()
+        component2 = self.create_product()
+        component3 = self.create_product()
+        pc1 = ProductComponent(product=self.product, component=component,
+                               store=self.store)
+        pc2 = ProductComponent(product=component, component=component2,
+                               store=self.store)
+        pc3 = ProductComponent(product=self.product, component=component3,
+                               store=self.store)
+        # component2 is used twice in the tree
+        pc4 = ProductComponent(product=component3, component=component2,
+                               store=self.store)
+
+        tree = Product.get_components_tree(self.store, [self.product])
+        self.assertEqual(set(tree), set([self.product.id, component.id,
+                                         component2.id, component3.id]))
+        self.assertEqual(set(tree[self.product.id]), set([pc1, pc3]))
+        self.assertEqual(tree[component.id], [pc2])
+        self.assertEqual(tree[component2.id], [])
+        self.assertEqual(tree[component3.id], [pc4])
+
+        # The query flushed the pending objects, so the results should
+        # be cached under the count after it
+        cache = self.store.get_transaction_cache(u'product_components_tree')
+        self.assertEqual(cache[self.product.id][0],
+                         self.store.get_pending_count())
+
+        # The results are memoized while nothing changes
+        tracer = StoqlibTestsuiteTracer()
+        tracer.install()
+        try:
+            self.assertEqual(
+                Product.get_components_tree(self.store, [component3]),
+                {component3.id: [pc4], component2.id: []})
+            self.assertTrue(self.product.is_composed_by(component2))
+            self.assertEqual(tracer.count, 0)
+        finally:
+            tracer.remove()
+
+        ProductComponent(product=component2, component=self.product,
+                         store=self.store)
+        with self.assertRaises(ValueError):
+            Product.get_components_tree(self.store, [component])
+
     def test_suppliers(self):
         product = self.create_product()
         supplier = self.create_supplier()
@@ -579,6 +625,18 @@ class TestProduct(DomainTest):
         pc.quantity = 2
         self.assertEqual(product.get_max_lead_time(1, branch), 12)
 
+        # A composed component adds its own production time
+        component3 = self.create_product(with_supplier=False)
+        component3.is_composed = True
+        component3.production_time = 3
+        Storable(product=component3, store=self.store)
+        ProductComponent(product=component3, component=component1, quantity=2,
+                         store=self.store)
+        ProductComponent(product=product, component=component3, quantity=1,
+                         store=self.store)
+        self.assertEqual(component3.get_max_lead_time(1, branch), 10)
+        self.assertEqual(product.get_max_lead_time(1, branch), 15)
+
     def test_get_main_supplier_name(self):
         self.assertEqual(self.product.get_main_supplier_name(), None)
 
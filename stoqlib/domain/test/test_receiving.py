@@ -33,7 +33,8 @@ from stoqlib.domain.test.domaintest import DomainTest
 from stoqlib.database.runtime import get_current_branch
 from stoqlib.domain.payment.method import PaymentMethod
 from stoqlib.domain.payment.payment import Payment
-from stoqlib.domain.product import ProductStockItem, Storable
+from stoqlib.domain.product import (ProductHistory, ProductStockItem,
+                                    StockTransactionHistory, Storable)
 from stoqlib.domain.purchase import PurchaseOrder
 from stoqlib.domain.receiving import ReceivingOrder, ReceivingInvoice
 from stoqlib.lib.dateutils import localdate
@@ -94,6 +95,48 @@ class TestReceivingOrder(DomainTest):
         self.assertEqual(order.receiving_invoice.invoice_total, order.total)
         self.assertEqual(stock_item.quantity, 16)
 
+    def test_confirm_many_items(self):
+        order = self.create_receiving_order()
+        items = [self.create_receiving_order_item(order, quantity=i + 1)
+                 for i in range(3)]
+        # Receiving only part of the purchased quantity
+        items[0].purchase_item.quantity = 5
+        purchase = order.purchase_orders.find()[0]
+        purchase.status = purchase.ORDER_PENDING
+        purchase.confirm()
+
+        order.confirm()
+        for item in items:
+            self.assertEqual(item.purchase_item.quantity_received,
+                             item.quantity)
+            storable = item.sellable.product_storable
+            self.assertEqual(storable.get_balance_for_branch(order.branch),
+                             item.quantity)
+            transaction = self.store.find(StockTransactionHistory,
+                                          object_id=item.id).one()
+            self.assertEqual(transaction.type,
+                             StockTransactionHistory.TYPE_RECEIVED_PURCHASE)
+            self.assertEqual(transaction.unit_cost, item.cost)
+            history = self.store.find(ProductHistory,
+                                      sellable=item.sellable).one()
+            self.assertEqual(history.quantity_received, item.quantity)
+        self.assertFalse(purchase.can_close())
+
+    def test_confirm_exceeding_quantity(self):
+        order = self.create_receiving_order()
+        item = self.create_receiving_order_item(order, quantity=4)
+        # The purchase item is being received twice
+        self.create_receiving_order_item(order, sellable=item.sellable,
+                                         purchase_item=item.purchase_item,
+                                         quantity=1)
+        purchase = order.purchase_orders.find()[0]
+        purchase.status = purchase.ORDER_PENDING
+        purchase.confirm()
+
+        with self.assertRaises(ValueError):
+            order.confirm()
+        self.assertEqual(item.purchase_item.quantity_received, 0)
+
     def test_order_receive_sell(self):
         product = self.create_product()
         storable = Storable(product=product, store=self.store)
@@ -47,7 +47,8 @@ from stoqlib.domain.sale import (Sale, SalePaymentMethodView,
                                  ReturnedSaleView, Delivery,
                                  ReturnedSaleItemsView, SaleItem,
                                  SaleView, SalesPersonSalesView,
-                                 ClientsWithSaleView, SaleToken)
+                                 ClientsWithSaleView, SaleToken,
+                                 SaleSummary)
 from stoqlib.domain.sellable import Sellable
 from stoqlib.domain.till import TillEntry
 from stoqlib.domain.test.domaintest import DomainTest
@@ -1413,6 +1414,48 @@ class TestSale(DomainTest):
         self.assertEqual(commissions.count(), 1)
         self.assertEqual(commissions[0].value, Decimal('56.00'))
 
+    def test_create_commissions(self):
+        base_category = self.create_sellable_category()
+        CommissionSource(category=base_category,
+                         direct_value=10,
+                         installments_value=5,
+                         store=self.store)
+        category = self.create_sellable_category(parent=base_category)
+
+        sale = self.create_sale()
+        sellable = self.add_product(sale, price=200)
+        sellable.category = category
+        # This one doesn't have a commission source
+        self.add_product(sale, price=100)
+        sale.order()
+        self.add_payments(sale, method_type=u'bill', installments=2)
+
+        commissions = sale.create_commissions()
+        self.assertEqual(len(commissions), 2)
+        for commission in commissions:
+            self.assertEqual(commission.commission_type,
+                             Commission.INSTALLMENTS)
+            self.assertEqual(commission.value, Decimal('5.00'))
+        # The payments already have commissions
+        self.assertEqual(sale.create_commissions(), [])
+
+        sale2 = self.create_sale()
+        sellable = self.add_product(sale2, price=100)
+        sellable.category = category
+        # The sellable source has precedence over the category one
+        CommissionSource(sellable=sellable,
+                         direct_value=12,
+                         installments_value=5,
+                         store=self.store)
+        sale2.order()
+        self.add_payments(sale2)
+
+        commissions = Commission.create_for_sales(self.store, [sale, sale2])
+        self.assertEqual(len(commissions), 1)
+        self.assertEqual(commissions[0].sale, sale2)
+        self.assertEqual(commissions[0].commission_type, Commission.DIRECT)
+        self.assertEqual(commissions[0].value, Decimal('12.00'))
+
     def test_commission_amount_when_sale_returns_completly(self):
         if True:
             raise SkipTest(u"See stoqlib.domain.returned_sale.ReturnedSale.return_ "
@@ -2707,6 +2750,80 @@ class TestDelivery(DomainTest):
                          delivery)
 
 
+class TestSaleSummary(DomainTest):
+
+    def _create_sale(self, quantity=1):
+        sale = self.create_sale(branch=get_current_branch(self.store))
+        sellable = self.add_product(sale, price=10, quantity=quantity)
+        sale.order()
+        self.add_payments(sale)
+        sale.confirm()
+        return sale, sellable
+
+    def test_confirm(self):
+        sale, sellable = self._create_sale(quantity=2)
+        summary = self.store.find(SaleSummary, sellable=sellable).one()
+        self.assertEqual(summary.date.date(), sale.confirm_date.date())
+        self.assertEqual(summary.branch, sale.branch)
+        self.assertEqual(summary.salesperson, sale.salesperson)
+        self.assertEqual(summary.quantity, 2)
+        self.assertEqual(summary.total_sold, 20)
+
+        # Another sale of the same sellable on the same day is aggregated
+        sale = self.create_sale(branch=sale.branch)
+        sale.salesperson = summary.salesperson
+        sale.add_sellable(sellable, quantity=3, price=10)
+        sale.order()
+        self.add_payments(sale)
+        sale.confirm()
+        summary = self.store.find(SaleSummary, sellable=sellable).one()
+        self.assertEqual(summary.quantity, 5)
+        self.assertEqual(summary.total_sold, 50)
+
+    def test_return(self):
+        sale, sellable = self._create_sale()
+        self.assertEqual(
+            self.store.find(SaleSummary, sellable=sellable).count(), 1)
+
+        returned_sale = sale.create_sale_return_adapter()
+        returned_sale.return_()
+        self.assertEqual(sale.status, Sale.STATUS_RETURNED)
+        self.assertTrue(
+            self.store.find(SaleSummary, sellable=sellable).is_empty())
+
+    def test_refresh_modified(self):
+        sale, sellable = self._create_sale()
+        # Changing the items doesn't go through the sale status
+        item = sale.get_items().one()
+        item.quantity = 4
+        summary = self.store.find(SaleSummary, sellable=sellable).one()
+        self.assertEqual(summary.quantity, 1)
+
+        SaleSummary.refresh_modified(self.store)
+        summary = self.store.find(SaleSummary, sellable=sellable).one()
+        self.assertEqual(summary.quantity, 4)
+        self.assertEqual(summary.total_sold, 40)
+
+        # The next refresh starts from the oldest transaction running, so
+        # the ones committing after this refresh are not missed
+        self.assertTrue(self.store.execute(
+            "SELECT refresh_time <= CAST(TRANSACTION_TIMESTAMP() AS timestamp) "
+            "FROM sale_summary_refresh").get_one()[0])
+        item.quantity = 5
+        SaleSummary.refresh_modified(self.store)
+        summary = self.store.find(SaleSummary, sellable=sellable).one()
+        self.assertEqual(summary.quantity, 5)
+
+    def test_rebuild(self):
+        sale, sellable = self._create_sale()
+        sale.confirm_date = localdatetime(2012, 1, 1)
+
+        SaleSummary.rebuild(self.store)
+        summary = self.store.find(SaleSummary, sellable=sellable).one()
+        self.assertEqual(summary.date, localdatetime(2012, 1, 1))
+        self.assertEqual(summary.quantity, 1)
+
+
 class TestSalePaymentMethodView(DomainTest):
 
     def test_with_one_payment_method_sales(self):
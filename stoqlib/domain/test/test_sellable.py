@@ -32,6 +32,7 @@ from stoqdrivers.enum import TaxType
 from stoqlib.exceptions import SellableError, TaxError
 from stoqlib.database.runtime import get_current_branch
 from stoqlib.domain.image import Image
+from stoqlib.domain.overrides import SellableBranchOverride
 from stoqlib.domain.product import Storable, StockTransactionHistory
 from stoqlib.domain.sale import Sale
 from stoqlib.domain.sellable import (Sellable,
@@ -145,6 +146,36 @@ class TestSellableCategory(DomainTest):
         self.assertEqual(category.get_children_recursively(), set())
         self.assertEqual(base_category.get_children_recursively(), set([category]))
 
+        sub_category1 = self._create_category(u"29'", parent=category)
+        sub_category2 = self._create_category(u"32'", parent=category)
+        other = self._create_category(u"LED Monitor", parent=base_category)
+        self.assertEqual(category.get_children_recursively(),
+                         set([sub_category1, sub_category2]))
+        self.assertEqual(base_category.get_children_recursively(),
+                         set([category, sub_category1, sub_category2, other]))
+
+    def test_get_path(self):
+        category = self._create_category(u'LCD', parent=self._base_category)
+        sub_category = self._create_category(u"29'", category)
+
+        self.assertEqual(self._base_category.get_path(), [self._base_category])
+        self.assertEqual(sub_category.get_path(),
+                         [self._base_category, category, sub_category])
+
+    def test_get_full_descriptions(self):
+        category = self._create_category(u'LCD', parent=self._base_category)
+        sub_category = self._create_category(u"29'", category)
+
+        descriptions = SellableCategory.get_full_descriptions(
+            self.store, [self._base_category, sub_category])
+        self.assertEqual(descriptions, {
+            self._base_category.id: u'Monitor',
+            sub_category.id: u"Monitor:LCD:29'"})
+
+        descriptions = SellableCategory.get_full_descriptions(self.store)
+        for c in self.store.find(SellableCategory):
+            self.assertEqual(descriptions[c.id], c.full_description)
+
     def test_on_create(self):
         category = self._create_category(u'cat')
         with mock.patch('stoqlib.domain.sellable.CategoryCreateEvent') as f:
@@ -451,6 +482,31 @@ class TestSellable(DomainTest):
                                                      storable=storable)
         self.assertTrue(sellable in list(available))
 
+    def test_get_by_category_tree_query(self):
+        base_category = SellableCategory(store=self.store, description=u'c1')
+        category = SellableCategory(store=self.store, description=u'c2',
+                                    category=base_category)
+        other_category = SellableCategory(store=self.store, description=u'c3')
+        s1 = self.create_sellable()
+        s1.category = base_category
+        s2 = self.create_sellable()
+        s2.category = category
+        s3 = self.create_sellable()
+        s3.category = other_category
+
+        query = Sellable.get_by_category_tree_query(self.store,
+                                                    [base_category])
+        self.assertEqual(set(self.store.find(Sellable, query)),
+                         set([s1, s2]))
+
+        query = Sellable.get_by_category_tree_query(self.store,
+                                                    [category, other_category])
+        self.assertEqual(set(self.store.find(Sellable, query)),
+                         set([s2, s3]))
+
+        query = Sellable.get_by_category_tree_query(self.store, [])
+        self.assertTrue(self.store.find(Sellable, query).is_empty())
+
     def test_get_unblocked_by_category_query(self):
         s1 = self.create_sellable()
         s2 = self.create_sellable()
@@ -817,6 +873,46 @@ class TestSellable(DomainTest):
             # sellable has a special price for that category
             self.assertEqual(sellable.price, 155)
 
+    def test_get_prices(self):
+        sellable = self.create_sellable(price=100)
+        on_sale = self.create_sellable(price=100)
+        on_sale.on_sale_price = 80
+        on_sale.on_sale_start_date = localdate(2001, 1, 1)
+        category = self.create_client_category(u'Cat 1')
+        other_category = self.create_client_category(u'Cat 2')
+        ClientCategoryPrice(sellable=sellable, category=category, price=155,
+                            store=self.store)
+        ClientCategoryPrice(sellable=on_sale, category=other_category,
+                            price=120, store=self.store)
+
+        self.assertEqual(Sellable.get_prices(self.store, []), {})
+        sellables = [sellable, on_sale]
+        with self.count_tracer() as tracer:
+            prices = Sellable.get_prices(self.store, sellables)
+        self.assertEqual(tracer.count, 1)
+        self.assertEqual(prices, {sellable.id: 100, on_sale.id: 80})
+        for s in sellables:
+            self.assertEqual(prices[s.id], s.price)
+
+        prices = Sellable.get_prices(self.store, sellables,
+                                     category=other_category)
+        self.assertEqual(prices, {sellable.id: 100, on_sale.id: 120})
+        for s in sellables:
+            self.assertEqual(prices[s.id],
+                             s.get_price_for_category(other_category))
+
+        with self.sysparam(DEFAULT_TABLE_PRICE=category):
+            prices = Sellable.get_prices(self.store, [s.id for s in sellables])
+            self.assertEqual(prices, {sellable.id: 155, on_sale.id: 80})
+            for s in sellables:
+                self.assertEqual(prices[s.id], s.price)
+
+        branch = get_current_branch(self.store)
+        SellableBranchOverride(store=self.store, sellable=sellable,
+                               branch=branch, base_price=90)
+        prices = Sellable.get_prices(self.store, sellables, branch=branch)
+        self.assertEqual(prices, {sellable.id: 90, on_sale.id: 80})
+
     def test_remove_category_price(self):
         category_price = self.create_client_category_price()
 
@@ -24,9 +24,11 @@
 
 from kiwi.currency import currency
 
-from stoqlib.domain.product import Product, ProductHistory
+from stoqlib.domain.product import (Product, ProductHistory,
+                                    StockTransactionHistory)
 from stoqlib.domain.test.domaintest import DomainTest
-from stoqlib.domain.transfer import TransferOrderItem
+from stoqlib.domain.transfer import TransferOrderItem, TransferOrder
+from stoqlib.exceptions import StockError
 
 __tests__ = 'stoqlib/domain/transfer.py'
 
@@ -133,6 +135,49 @@ class TestTransferOrder(DomainTest):
         self.assertFalse(history is None)
         self.assertEqual(history.quantity_transfered, qty)
 
+    def test_send_many_items(self):
+        order = self.create_transfer_order()
+        items = [self.create_transfer_order_item(order, quantity=3)
+                 for i in range(3)]
+        no_stock = self.create_product()
+        no_stock.manage_stock = False
+        order.add_sellable(no_stock.sellable, None, quantity=4)
+
+        order.send()
+        self.assertEqual(order.status, TransferOrder.STATUS_SENT)
+        for item in items:
+            storable = item.sellable.product_storable
+            self.assertEqual(
+                storable.get_balance_for_branch(order.source_branch), 0)
+            transaction = self.store.find(StockTransactionHistory,
+                                          object_id=item.id).one()
+            self.assertEqual(transaction.type,
+                             StockTransactionHistory.TYPE_TRANSFER_TO)
+            self.assertEqual(transaction.quantity, -3)
+            self.assertEqual(transaction.unit_cost, 50)
+            history = self.store.find(ProductHistory,
+                                      sellable=item.sellable).one()
+            self.assertEqual(history.quantity_transfered, 3)
+
+        # The product without stock management has only its history
+        self.assertEqual(
+            self.store.find(ProductHistory,
+                            sellable=no_stock.sellable).one().quantity_transfered,
+            4)
+
+    def test_send_without_stock(self):
+        order = self.create_transfer_order()
+        item = self.create_transfer_order_item(order, quantity=2)
+        # The storable has only 2 in stock, but 4 are being sent
+        order.add_sellable(item.sellable, None, quantity=2)
+
+        with self.assertRaises(StockError):
+            order.send()
+        self.assertEqual(order.status, TransferOrder.STATUS_PENDING)
+        storable = item.sellable.product_storable
+        self.assertEqual(
+            storable.get_balance_for_branch(order.source_branch), 2)
+
     def test_receive(self):
         sent_qty = 2
         order = self.create_transfer_order()
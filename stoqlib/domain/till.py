@@ -386,7 +386,9 @@ class Till(IdentifiableDomain):
         # payment was not with card
         day_history[(money_method, None, None)] = 0
 
-        for entry in self.get_entries():
+        entries = self.get_entries().prefetch('payment.method',
+                                              'payment.card_data.provider')
+        for entry in entries:
             provider = card_type = None
             payment = entry.payment
             method = payment.method if payment else money_method
@@ -29,7 +29,8 @@ import collections
 from decimal import Decimal
 
 from kiwi.currency import currency
-from storm.expr import Join, LeftJoin, Sum, Cast, Coalesce, And, Or
+from storm.expr import (Join, LeftJoin, Sum, Cast, Coalesce, And, Or, Eq,
+                        Insert, Max, Select)
 from storm.info import ClassAlias
 from storm.references import Reference
 from zope.interface import implementer
@@ -43,12 +44,14 @@ from stoqlib.database.viewable import Viewable
 from stoqlib.domain.base import Domain, IdentifiableDomain
 from stoqlib.domain.events import StockOperationConfirmedEvent
 from stoqlib.domain.fiscal import Invoice
-from stoqlib.domain.product import ProductHistory, StockTransactionHistory
+from stoqlib.domain.product import (Product, ProductHistory, ProductStockItem,
+                                    StockTransactionHistory, Storable)
 from stoqlib.domain.person import Person, Branch, Company
 from stoqlib.domain.interfaces import IContainer, IInvoice, IInvoiceItem
 from stoqlib.domain.sellable import Sellable
 from stoqlib.domain.product import StorableBatch
 from stoqlib.domain.taxes import check_tax_info_presence
+from stoqlib.exceptions import StockError
 from stoqlib.lib.dateutils import localnow
 from stoqlib.lib.parameters import sysparam
 from stoqlib.lib.translation import stoqlib_gettext
@@ -286,6 +289,15 @@ class TransferOrder(IdentifiableDomain):
         kwargs['invoice'] = Invoice(store=store, invoice_type=Invoice.TYPE_OUT)
         super(TransferOrder, self).__init__(store=store, **kwargs)
 
+    def _get_storable_items_query(self):
+        # The items of this transfer which have their stock managed
+        tables = [TransferOrderItem,
+                  Join(Product, Product.id == TransferOrderItem.sellable_id),
+                  Join(Storable, Storable.id == Product.id)]
+        query = And(TransferOrderItem.transfer_order_id == self.id,
+                    Eq(Product.manage_stock, True))
+        return tables, query
+
     #
     # IContainer implementation
     #
@@ -390,11 +402,60 @@ class TransferOrder(IdentifiableDomain):
 
     def send(self):
         """Sends a transfer order to the destination branch.
+
+        The stock of all the items is decreased at once, without calling
+        :meth:`TransferOrderItem.send` for each one of them.
+
+        :raises: :exc:`stoqlib.exceptions.StockError` if there is not
+            enough stock in the source branch to send any of the items
         """
         assert self.can_send()
-
-        for item in self.get_items():
-            item.send()
+        store = self.store
+
+        tables, query = self._get_storable_items_query()
+        tables = tables + [
+            LeftJoin(ProductStockItem,
+                     And(ProductStockItem.storable_id == Storable.id,
+                         ProductStockItem.branch_id == self.source_branch_id,
+                         Or(ProductStockItem.batch_id == TransferOrderItem.batch_id,
+                            And(Eq(ProductStockItem.batch_id, None),
+                                Eq(TransferOrderItem.batch_id, None)))))]
+
+        # The same storable/batch may be in more than one item, so the
+        # quantities need to be summed before comparing with the stock
+        missing = store.using(*tables).find(
+            TransferOrderItem.sellable_id, query)
+        missing = missing.group_by(TransferOrderItem.sellable_id,
+                                   TransferOrderItem.batch_id)
+        missing = missing.having(Sum(TransferOrderItem.quantity) >
+                                 Coalesce(Max(ProductStockItem.quantity), 0))
+        if not missing.is_empty():
+            raise StockError(
+                _('Quantity to decrease is greater than the available stock.'))
+
+        StockTransactionHistory.create_from_query(
+            store, StockTransactionHistory.TYPE_TRANSFER_TO,
+            tables=tables, where=query,
+            storable_id=Storable.id,
+            branch_id=Cast(self.source_branch_id, 'uuid'),
+            batch_id=TransferOrderItem.batch_id,
+            quantity=-TransferOrderItem.quantity,
+            # Just like decrease_stock, use the current stock cost
+            unit_cost=ProductStockItem.stock_cost,
+            object_id=TransferOrderItem.id)
+
+        history_columns = collections.OrderedDict([
+            (ProductHistory.branch_id, Cast(self.source_branch_id, 'uuid')),
+            (ProductHistory.sellable_id, TransferOrderItem.sellable_id),
+            (ProductHistory.quantity_transfered, TransferOrderItem.quantity),
+        ])
+        if self.receival_date is not None:
+            history_columns[ProductHistory.received_date] = self.receival_date
+        store.execute(Insert(
+            history_columns, table=ProductHistory,
+            values=Select(list(history_columns.values()),
+                          where=TransferOrderItem.transfer_order_id == self.id,
+                          tables=[TransferOrderItem])))
 
         # Save the operation nature and branch in Invoice table.
         self.invoice.operation_nature = self.operation_nature
@@ -406,22 +467,46 @@ class TransferOrder(IdentifiableDomain):
 
     def receive(self, responsible, receival_date=None):
         """Confirms the receiving of the transfer order.
+
+        The stock of all the items is increased at once, without calling
+        :meth:`TransferOrderItem.receive` for each one of them.
         """
         assert self.can_receive()
 
-        for item in self.get_items():
-            item.receive()
+        tables, query = self._get_storable_items_query()
+        StockTransactionHistory.create_from_query(
+            self.store, StockTransactionHistory.TYPE_TRANSFER_FROM,
+            tables=tables, where=query,
+            storable_id=Storable.id,
+            branch_id=Cast(self.destination_branch_id, 'uuid'),
+            batch_id=TransferOrderItem.batch_id,
+            quantity=TransferOrderItem.quantity,
+            unit_cost=TransferOrderItem.stock_cost,
+            object_id=TransferOrderItem.id)
 
         self.receival_date = receival_date or localnow()
         self.destination_responsible = responsible
         self.status = self.STATUS_RECEIVED
 
     def cancel(self, responsible, cancel_reason, cancel_date=None):
-        """Cancel a transfer order"""
+        """Cancel a transfer order
+
+        The stock of all the items is returned to the source branch at
+        once, without calling :meth:`TransferOrderItem.cancel` for each
+        one of them.
+        """
         assert self.can_cancel()
 
-        for item in self.get_items():
-            item.cancel()
+        tables, query = self._get_storable_items_query()
+        StockTransactionHistory.create_from_query(
+            self.store, StockTransactionHistory.TYPE_CANCELLED_TRANSFER,
+            tables=tables, where=query,
+            storable_id=Storable.id,
+            branch_id=Cast(self.source_branch_id, 'uuid'),
+            batch_id=TransferOrderItem.batch_id,
+            quantity=TransferOrderItem.quantity,
+            unit_cost=TransferOrderItem.stock_cost,
+            object_id=TransferOrderItem.id)
 
         self.cancel_date = cancel_date or localnow()
         self.cancel_responsible_id = responsible.id
@@ -54,7 +54,7 @@ from stoqlib.domain.purchase import (Quotation, QuoteGroup, PurchaseOrder,
                                      PurchaseItem)
 from stoqlib.domain.receiving import (ReceivingOrderItem, ReceivingOrder,
                                       PurchaseReceivingMap, ReceivingInvoice)
-from stoqlib.domain.sale import SaleItem, Sale, Delivery
+from stoqlib.domain.sale import SaleItem, Sale, SaleSummary, Delivery
 from stoqlib.domain.returnedsale import ReturnedSale, ReturnedSaleItem
 from stoqlib.domain.sellable import (Sellable, SellableUnit,
                                      SellableCategory,
@@ -637,6 +637,9 @@ class QuotationView(Viewable):
 class SoldItemView(Viewable):
     """Stores information about all sale items, including the average cost
     of the sold items.
+
+    The values are read from the :class:`stoqlib.domain.sale.SaleSummary`,
+    so it can be filtered by its date and branch.
     """
 
     sellable = Sellable
@@ -650,22 +653,18 @@ class SoldItemView(Viewable):
     product_id = Product.id
 
     # Aggregate
-    quantity = Sum(SaleItem.quantity)
-    total_sold = Sum(Round(SaleItem.price * SaleItem.quantity, DECIMAL_PRECISION))
-    total_cost = Sum(Round(SaleItem.quantity * SaleItem.average_cost, DECIMAL_PRECISION))
+    quantity = Sum(SaleSummary.quantity)
+    total_sold = Sum(SaleSummary.total_sold)
+    total_cost = Sum(SaleSummary.total_cost)
 
     tables = [
-        Sellable,
+        SaleSummary,
+        Join(Sellable, Sellable.id == SaleSummary.sellable_id),
         LeftJoin(Product, Product.id == Sellable.id),
-        LeftJoin(SaleItem, Sellable.id == SaleItem.sellable_id),
-        LeftJoin(Sale, SaleItem.sale_id == Sale.id),
         LeftJoin(SellableCategory, Sellable.category_id == SellableCategory.id),
     ]
 
-    clause = Or(Sale.status == Sale.STATUS_CONFIRMED,
-                Sale.status == Sale.STATUS_RENEGOTIATED)
-
-    group_by = [id, product_id, code, description, category, Sale.status]
+    group_by = [id, product_id, code, description, category]
 
     @property
     def average_cost(self):
@@ -747,11 +746,11 @@ class SoldItemsByBranchView(SoldItemView):
     branch_name = Coalesce(NullIf(Company.fancy_name, u''), Person.name)
 
     # Aggregates
-    total = Sum(Round(SaleItem.quantity * SaleItem.price, DECIMAL_PRECISION))
+    total = Sum(SaleSummary.total_sold)
 
     tables = SoldItemView.tables[:]
     tables.extend([
-        LeftJoin(Branch, Branch.id == Sale.branch_id),
+        LeftJoin(Branch, Branch.id == SaleSummary.branch_id),
         LeftJoin(Person, Branch.person_id == Person.id),
         LeftJoin(Company, Company.person_id == Person.id),
     ])
@@ -36,6 +36,10 @@ for the update and set some parameters depending on those rules. For instance:
     - Set to (if not unique)
   Category (Reference)
     - Set to    [   |v]
+
+When possible (i.e. the field and the operation can be expressed in SQL),
+applying an operation will update all the results of the current search with
+a single UPDATE statement, instead of changing them one by one.
 """
 
 import logging
@@ -52,16 +56,21 @@ from kiwi.datatypes import converter
 from kiwi.ui.objectlist import Column
 from kiwi.ui.widgets.combo import ProxyComboBox
 from kiwi.ui.widgets.entry import ProxyEntry, ProxyDateEntry
+from storm.expr import And, Eq, Func, Ne, Or
+from storm.expr import Column as StormColumn
 
 from stoqlib.gui.dialogs.progressdialog import ProgressDialog
 from stoqlib.gui.search.searchcolumns import SearchColumn
 from stoqlib.gui.search.searchdialog import SearchDialog
-from stoqlib.lib.message import marker, warning, yesno
+from stoqlib.lib.message import info, marker, warning, yesno
 from stoqlib.lib.translation import stoqlib_gettext
 
 _ = stoqlib_gettext
 log = logging.getLogger(__name__)
 
+# How many objects will be saved before flushing the store
+_FLUSH_BATCH_SIZE = 500
+
 
 #
 #   Operations
@@ -137,6 +146,18 @@ class Operation(Gtk.HBox):
         """
         raise NotImplementedError()
 
+    def get_update_expression(self, spec):
+        """Returns the new value for the field as a storm expression
+
+        This is used to update all the items at once. Subclasses that can
+        express their operation in SQL should override this.
+
+        :param spec: the search spec of the mass editor
+        :returns: the expression, or ``ValueUnset`` if the operation
+            cannot be done in SQL
+        """
+        return ValueUnset
+
     def apply_operation(self, item):
         value = self.get_new_value(item)
         # If the value is not valid, do not update the object
@@ -158,6 +179,16 @@ class MultiplyOperation(Operation):
         self.add_label(self.middle_label)
         self.entry = self.add_entry(Decimal)
 
+    def _get_other_column(self, spec):
+        # The other column must be on the same table, so it can be used in
+        # the UPDATE statement
+        column = self._field.get_update_column(spec)
+        other_column = self.combo.get_selected().get_value_column(spec)
+        if (column is None or other_column is None or
+                column.table is not other_column.table):
+            return None
+        return other_column
+
     def get_new_value(self, item):
         multiplier = self.entry.validate()
         if multiplier is ValueUnset:
@@ -166,6 +197,13 @@ class MultiplyOperation(Operation):
         old_value = other_field.get_value(item)
         return old_value * multiplier
 
+    def get_update_expression(self, spec):
+        multiplier = self.entry.validate()
+        other_column = self._get_other_column(spec)
+        if multiplier is ValueUnset or other_column is None:
+            return ValueUnset
+        return other_column * multiplier
+
 
 class AddOperation(MultiplyOperation):
     """An operation that adds a field with a value"""
@@ -181,6 +219,13 @@ class AddOperation(MultiplyOperation):
         old_value = other_field.get_value(item)
         return old_value + value
 
+    def get_update_expression(self, spec):
+        value = self.entry.validate()
+        other_column = self._get_other_column(spec)
+        if value is ValueUnset or other_column is None:
+            return ValueUnset
+        return other_column + value
+
 
 class DivideOperation(MultiplyOperation):
     """An operation that divides a field by a value"""
@@ -196,6 +241,13 @@ class DivideOperation(MultiplyOperation):
         old_value = other_field.get_value(item)
         return old_value / divider
 
+    def get_update_expression(self, spec):
+        divider = self.entry.validate()
+        other_column = self._get_other_column(spec)
+        if divider is ValueUnset or not divider or other_column is None:
+            return ValueUnset
+        return other_column / divider
+
 
 class SetValueOperation(Operation):
     """An operation that sets a field to a specifc value.
@@ -214,6 +266,12 @@ class SetValueOperation(Operation):
             return ValueUnset
         return value
 
+    def get_update_expression(self, spec):
+        value = self.entry.validate()
+        if value is None:
+            return ValueUnset
+        return value
+
 
 class ReplaceOperation(Operation):
     """An operation that replaces a string by another one"""
@@ -228,6 +286,13 @@ class ReplaceOperation(Operation):
         old_value = self._field.get_value(item)
         return old_value.replace(self.one_entry.read(), self.other_entry.read())
 
+    def get_update_expression(self, spec):
+        column = self._field.get_update_column(spec)
+        if column is None:
+            return ValueUnset
+        return Func('replace', column, self.one_entry.read(),
+                    self.other_entry.read())
+
 
 class SetObjectValueOperation(Operation):
     """An operation that sets a field to a specifc value.
@@ -314,6 +379,9 @@ class Editor(Gtk.HBox):
     def apply_operation(self, item):
         return self._oper.apply_operation(item)
 
+    def get_update_expression(self, spec):
+        return self._oper.get_update_expression(spec)
+
 
 class DecimalEditor(Editor):
     operations = [
@@ -375,6 +443,34 @@ class Field(object):
     def save_value(self, item):  # pragma nocover
         raise NotImplementedError()
 
+    def get_value_column(self, spec):
+        """Get the database column that holds this field's value
+
+        :returns: the column or ``None`` if the value doesn't come
+            directly from a column
+        """
+        return None
+
+    def get_update_column(self, spec):
+        """Get the database column that this field updates
+
+        :returns: the column or ``None`` if this field cannot be
+            updated with an UPDATE statement
+        """
+        return None
+
+    def get_set_expressions(self, column, value):
+        """Get the expressions used to update the field in the database
+
+        Subclasses can override this to update other columns that depend
+        on this field's value.
+
+        :param column: the column returned by :meth:`.get_update_column`
+        :param value: the new value for the column, as a storm expression
+        :returns: a list of expressions to be passed to ``ResultSet.set``
+        """
+        return [column == value]
+
     def get_column(self, spec):
         return Column('id', title=self.label, data_type=self.data_type,
                       format_func=self.format_func, format_func_data=self,
@@ -406,7 +502,8 @@ class Field(object):
 class AccessorField(Field):
 
     def __init__(self, label, obj_name, attribute, data_type, unique=False,
-                 validator=None, visible=True, read_only=False, format_func=None):
+                 validator=None, visible=True, read_only=False, format_func=None,
+                 set_based=False):
         """A field that updates a value of another object
 
         :param obj_name: the name of the object that will be updated, or None if
@@ -422,6 +519,11 @@ class AccessorField(Field):
         :param read_only: If this field should be used only for informational purposes
           and filtering
         :param format_func: A function that will be called to format the data.
+        :param set_based: If the field can be updated for all the results
+          with a single UPDATE statement. Only set this if changing the
+          attribute doesn't have side effects on the object. Note that in
+          this case the validator will also be called with a storm
+          expression and should return a condition for it
         """
         super(AccessorField, self).__init__(data_type, validator=validator,
                                             unique=unique, visible=visible,
@@ -429,6 +531,7 @@ class AccessorField(Field):
         self.label = label
         self.obj_name = obj_name
         self.attribute = attribute
+        self.set_based = set_based
 
     def _get_obj(self, item):
         if self.obj_name:
@@ -454,6 +557,18 @@ class AccessorField(Field):
         if dest_obj:
             setattr(dest_obj, self.attribute, value)
 
+    def get_value_column(self, spec):
+        table = getattr(spec, self.obj_name) if self.obj_name else spec
+        column = getattr(table, self.attribute, None)
+        if not isinstance(column, StormColumn):
+            return None
+        return column
+
+    def get_update_column(self, spec):
+        if not self.set_based:
+            return None
+        return self.get_value_column(spec)
+
     def get_column(self, spec):
         # SearchColumn expects str instead of unicode and objects are rendered
         # as strings
@@ -512,11 +627,24 @@ class MassEditorWidget(Gtk.HBox):
         object: ObjectEditor,
     }
 
-    def __init__(self, store, fields, results):
+    savepoint = 'before_mass_editor_update'
+
+    def __init__(self, store, fields, results, search=None, search_spec=None):
+        """
+        :param store: a store
+        :param fields: the fields that can be edited
+        :param results: the results list
+        :param search: the search slave. Used to update all of its results at
+          once when the field and the operation allows it
+        :param search_spec: the search spec of the search
+        """
         self._store = store
         self._editor = None
         self._fields = fields
         self._results = results
+        self._search = search
+        self._search_spec = search_spec
+        self._updated_count = 0
         super(MassEditorWidget, self).__init__(spacing=6)
         self._setup_widgets()
 
@@ -550,6 +678,8 @@ class MassEditorWidget(Gtk.HBox):
         self.apply_button = Gtk.Button(stock=Gtk.STOCK_APPLY)
         self.apply_button.connect('clicked', self._on_apply_button__clicked)
         self.pack_start(self.apply_button, False, False, 0)
+        self.updated_label = Gtk.Label()
+        self.pack_start(self.updated_label, False, False, 0)
 
         for field in self._fields:
             # Don't let the user edit unique fields for now
@@ -559,12 +689,59 @@ class MassEditorWidget(Gtk.HBox):
         self.field_combo.select_item_by_position(0)
 
     def _apply(self):
+        if self._apply_set_based():
+            return
+
         marker('Updating values')
         for i in self._results:
             self._editor.apply_operation(i)
             self._results.refresh(i)
         marker('Done updating values')
 
+    def _apply_set_based(self):
+        field = self.field_combo.get_selected()
+        # Fields edited one by one need to be saved that way, and we need the
+        # query of the current search to do the update on the database.
+        results = self._search and self._search.get_last_results()
+        if field.new_values or not hasattr(results, 'get_select_expr'):
+            return False
+
+        column = field.get_update_column(self._search_spec)
+        if column is None:
+            return False
+        value = self._editor.get_update_expression(self._search_spec)
+        if value is ValueUnset:
+            return False
+
+        table = column.table
+        query = And(table.id.is_in(results.get_select_expr(table.id)),
+                    Ne(value, None),
+                    Or(Eq(column, None), Ne(column, value)))
+        if callable(field.validator):
+            query = And(query, field.validator(value))
+
+        count = self._store.find(table, query).count()
+        if count == 0:
+            info(_('No items will be updated'))
+            return True
+        if not yesno(_('This will update {} items. Are you sure?').format(count),
+                     Gtk.ResponseType.NO, _('Apply changes'), _('Don\'t apply')):
+            return True
+
+        marker('Updating values')
+        if not self._updated_count:
+            # Make it possible to discard the changes if the dialog is
+            # cancelled, like it happens with the ones done one by one
+            self._store.savepoint(self.savepoint)
+        self._store.find(table, query).set(
+            *field.get_set_expressions(column, value))
+        self._updated_count += count
+        self.updated_label.set_text(
+            _('{} items updated').format(self._updated_count))
+        self._search.refresh()
+        marker('Done updating values')
+        return True
+
     #
     # Public API
     #
@@ -576,6 +753,17 @@ class MassEditorWidget(Gtk.HBox):
             objs.update(field.new_values.keys())
         return objs
 
+    def get_updated_count(self):
+        """Returns how many rows were already updated on the database"""
+        return self._updated_count
+
+    def discard_updates(self):
+        """Discard the updates already done on the database"""
+        if not self._updated_count:
+            return
+        self._store.rollback(name=self.savepoint, close=False)
+        self._updated_count = 0
+
     #
     # BaseEditorSlave
     #
@@ -590,8 +778,10 @@ class MassEditorWidget(Gtk.HBox):
                 field.save_value(obj)
                 yield i, total
             # Flush soon, so that any errors triggered by database constraints
-            # pop up.
-            self._store.flush()
+            # pop up, but not for every object to avoid too many round-trips.
+            if (i + 1) % _FLUSH_BATCH_SIZE == 0:
+                self._store.flush()
+        self._store.flush()
 
         marker('Done saving data')
 
@@ -616,7 +806,9 @@ class MassEditorSearch(SearchDialog):
         SearchDialog.__init__(self, store, hide_footer=False)
         self.set_ok_label(_('Save'))
         self.ok_button.set_sensitive(True)
-        self.mass_editor = MassEditorWidget(store, self._fields, self.results)
+        self.mass_editor = MassEditorWidget(store, self._fields, self.results,
+                                            search=self.search,
+                                            search_spec=self.search_spec)
         self.search.vbox.pack_start(self.mass_editor, False, False, 0)
         self.search.vbox.reorder_child(self.mass_editor, 1)
         self.mass_editor.show_all()
@@ -665,7 +857,8 @@ class MassEditorSearch(SearchDialog):
     def confirm(self, retval=None):
         total_products = len(self.mass_editor.get_changed_objects())
         if total_products == 0:
-            self.retval = False
+            # The updates applied to all the results were already confirmed
+            self.retval = bool(self.mass_editor.get_updated_count())
             self.close()
             return
 
@@ -703,6 +896,11 @@ class MassEditorSearch(SearchDialog):
         self.retval = True
         self.close()
 
+    def close(self, *args):
+        if not self.retval:
+            self.mass_editor.discard_updates()
+        super(MassEditorSearch, self).close(*args)
+
     #
     #   Callbacks
     #
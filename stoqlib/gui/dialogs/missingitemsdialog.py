@@ -29,6 +29,7 @@ from kiwi.ui.objectlist import Column
 
 from stoqlib.api import api
 from stoqlib.database.runtime import get_current_branch
+from stoqlib.domain.product import Product
 from stoqlib.domain.production import ProductionMaterial, ProductionOrder
 from stoqlib.domain.sale import Sale, SaleItem
 from stoqlib.gui.base.dialogs import run_dialog
@@ -88,10 +89,13 @@ class MissingItemsDialog(SimpleListDialog):
                                      description=desc,
                                      store=store)
 
+        products = [store.fetch(item.storable.product) for item in self.missing]
+        # Fetch the components of all the products at once
+        tree = Product.get_components_tree(store, products)
+
         materials = {}
-        for item in self.missing:
-            product = store.fetch(item.storable.product)
-            components = list(product.get_components())
+        for item, product in zip(self.missing, products):
+            components = tree[product.id]
             if not components:
                 continue
             qty = item.ordered - item.stock
@@ -23,6 +23,8 @@
 ##
 """Payment Flow History Report Dialog"""
 
+import datetime
+
 from storm.expr import And, Eq, Or
 
 from stoqlib.database.expr import Date
@@ -35,72 +37,77 @@ from stoqlib.reporting.payment import PaymentFlowHistoryReport
 _ = stoqlib_gettext
 
 # A few comments for the payment_flow_query:
-# - The first table in the FROM clause is the list of all possible dates
-# (due_date and paid_date) in the results. This is done so that the subsequent
-# subselect can be joined properly
-# - In that same subselect, we use IS NOT NULL to avoid an empty row for
-# payments that were not received yet.
-# - We filter out statuses (0, 5) to not include PREVIEW and CANCELED payments
-# - payment_type = 1 are OUT_PAYMENTS  and 0 are IN_PAYMENTS
-
+# - The payments are filtered by due_date and paid_date ranges (instead of
+# DATE(due_date) and DATE(paid_date)) so that only the requested interval is
+# read, using the indexes on those columns
+# - payment_dates has one row for each due date and one for each paid date
+# in the interval. We use IS NOT NULL to avoid an empty row for payments
+# that were not received yet. All statuses are included there so that
+# the dates are the same as before, even if all its payments were cancelled
+# - We filter out statuses (preview, cancelled) from the values and counts
+# - payment_type 'out' are OUT_PAYMENTS and 'in' are IN_PAYMENTS
+# - opening_balance is the real balance until the start of the interval and
+# the balances of each day are calculated from it by a window function
+# - The parameters are start, end + 1 day, start, end + 1 day and start
 
 payment_flow_query = """
-SELECT all_payment_dates.date,
-       COALESCE(payments_to_pay.count, 0) as to_pay_payments,
-       COALESCE(payments_to_pay.to_pay, 0) as to_pay,
-       COALESCE(payments_paid.count, 0) as paid_payments,
-       COALESCE(payments_paid.paid, 0) as paid,
-       COALESCE(payments_to_receive.count, 0) as to_receive_payments,
-       COALESCE(payments_to_receive.to_receive, 0) as to_receive,
-       COALESCE(payments_received.count, 0) as received_payments,
-       COALESCE(payments_received.received, 0) as received
-
-FROM (SELECT date(due_date) as date FROM payment
-      UNION SELECT date(paid_date) as date FROM payment WHERE
-      paid_date IS NOT NULL) as all_payment_dates
-
--- To pay (out payments)
-LEFT JOIN (SELECT DATE(due_date) as date, count(1) as count, sum(value) as to_pay
-           FROM payment WHERE payment_type = 'out' AND status not in ('preview', 'cancelled')
-           GROUP BY DATE(due_date))
-     AS payments_to_pay ON (all_payment_dates.date = payments_to_pay.date)
-
--- Paid (out payments)
-LEFT JOIN (SELECT DATE(paid_date) as date, count(1) as count, sum(value) as paid
-           FROM payment WHERE payment_type = 'out'
-           AND payment.status not in ('preview', 'cancelled')
-           GROUP BY DATE(paid_date))
-     AS payments_paid ON (all_payment_dates.date = payments_paid.date)
-
--- To receive (in payments)
-LEFT JOIN (SELECT DATE(due_date) as date, count(1) as count, sum(value) as to_receive
-           FROM payment WHERE payment_type = 'in'
-           AND payment.status not in ('preview', 'cancelled')
-           GROUP BY DATE(due_date))
-     AS payments_to_receive ON (all_payment_dates.date = payments_to_receive.date)
-
--- Received (in payments)
-LEFT JOIN (SELECT DATE(paid_date) as date, count(1) as count, sum(value) as received
-           FROM payment WHERE payment_type = 'in'
-           AND payment.status not in ('preview', 'cancelled')
-           GROUP BY DATE(paid_date))
-     AS payments_received ON (all_payment_dates.date = payments_received.date)
-ORDER BY all_payment_dates.date;
+WITH payment_dates AS (
+    SELECT DATE(due_date) AS date, 'due' AS kind, payment_type, value,
+           status NOT IN ('preview', 'cancelled') AS is_valid
+      FROM payment
+     WHERE due_date >= ? AND due_date < ?
+  UNION ALL
+    SELECT DATE(paid_date) AS date, 'paid' AS kind, payment_type, value,
+           status NOT IN ('preview', 'cancelled') AS is_valid
+      FROM payment
+     WHERE paid_date >= ? AND paid_date < ?
+), payment_days AS (
+    SELECT date,
+           COUNT(CASE WHEN is_valid AND kind = 'due' AND payment_type = 'out'
+                      THEN 1 END) AS to_pay_payments,
+           COALESCE(SUM(CASE WHEN is_valid AND kind = 'due' AND payment_type = 'out'
+                             THEN value END), 0) AS to_pay,
+           COUNT(CASE WHEN is_valid AND kind = 'paid' AND payment_type = 'out'
+                      THEN 1 END) AS paid_payments,
+           COALESCE(SUM(CASE WHEN is_valid AND kind = 'paid' AND payment_type = 'out'
+                             THEN value END), 0) AS paid,
+           COUNT(CASE WHEN is_valid AND kind = 'due' AND payment_type = 'in'
+                      THEN 1 END) AS to_receive_payments,
+           COALESCE(SUM(CASE WHEN is_valid AND kind = 'due' AND payment_type = 'in'
+                             THEN value END), 0) AS to_receive,
+           COUNT(CASE WHEN is_valid AND kind = 'paid' AND payment_type = 'in'
+                      THEN 1 END) AS received_payments,
+           COALESCE(SUM(CASE WHEN is_valid AND kind = 'paid' AND payment_type = 'in'
+                             THEN value END), 0) AS received
+      FROM payment_dates
+     GROUP BY date
+), opening_balance AS (
+    SELECT COALESCE(SUM(CASE WHEN payment_type = 'in' THEN value
+                             ELSE -value END), 0) AS balance
+      FROM payment
+     WHERE paid_date < ? AND status NOT IN ('preview', 'cancelled')
+)
+SELECT date, to_pay_payments, to_pay, paid_payments, paid,
+       to_receive_payments, to_receive, received_payments, received,
+       opening_balance.balance + COALESCE(SUM(received - paid) OVER (
+           ORDER BY date ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING),
+           0) AS previous_balance
+  FROM payment_days, opening_balance
+ ORDER BY date;
 """
 
 
 class PaymentFlowDay(object):
 
-    def __init__(self, store, row, previous_day=None):
+    def __init__(self, store, row):
         """Payment Flow History for a given date
 
-        :param row: A list of values from the payment_flow_query above
-        :param previous_day: The `previous_day <PaymentFlowDay>`. This is used
-          to calculate the expected and real balances for each day (based on the
-          previous dates).
+        :param row: A list of values from the payment_flow_query above. The
+          last one is the real balance of the previous dates, used to
+          calculate the expected and real balances for this day.
         """
         (date, to_pay_count, to_pay, paid_count, paid, to_receive_count,
-         to_receive, received_count, received) = row
+         to_receive, received_count, received, previous_balance) = row
 
         self.history_date = date
         # values
@@ -114,10 +121,7 @@ class PaymentFlowDay(object):
         self.paid_payments = paid_count
         self.received_payments = received_count
 
-        if previous_day:
-            self.previous_balance = previous_day.balance_real
-        else:
-            self.previous_balance = 0
+        self.previous_balance = previous_balance
 
         # Today's balance is the previous day balance, plus the payments we
         # received, minus what we paid. expected if for the payments we should
@@ -154,24 +158,14 @@ class PaymentFlowDay(object):
         """Get the payment flow history for a given date interval
 
         This will return a list of PaymentFlowDay, one for each date that has
-        payments registered and are in the interval specified.
+        payments registered and are in the interval specified. Only the
+        payments of that interval are read, the balance before it is
+        calculated by the database.
         """
-        history = []
-        previous_entry = None
-
-        for row in store.execute(payment_flow_query).get_all():
-            entry = cls(store, row, previous_entry)
-            if entry.history_date > end:
-                break
-
-            # We only store entries for dates higher than the user requested, but
-            # we still need to create the entries from the beginning, so we
-            # have the real balances
-            if entry.history_date >= start:
-                history.append(entry)
-            previous_entry = entry
-
-        return history
+        next_day = end + datetime.timedelta(days=1)
+        params = (start, next_day, start, next_day, start)
+        return [cls(store, row)
+                for row in store.execute(payment_flow_query, params)]
 
 
 class PaymentFlowHistoryDialog(DateRangeDialog):
@@ -26,16 +26,13 @@
 
 Duplicate detection is currenctly really simple and works like this:
 
-1) All data is fetched from the database.
-2) We iter through each item, reducing it to a key, that will be used to detect
-the duplicates
-2.1) The key will be calculated using the persons name, phone and/or address
+1) Each person is reduced to a key by the database, that will be used to
+detect the duplicates
+1.1) The key will be calculated using the persons name, phone and/or address
 street (configurable)
-2.2) We insert the key in a dictionary, where the value is a list of objects
-that match the same key
-
-After this, all items in the dictionary that have more than one person are
-considered duplicate by the given criteria
+2) The persons are grouped by that key, and only the groups that have more
+than one person are fetched. Those are considered duplicate by the given
+criteria
 
 Room for improvement:
     - Add some way the user can choose which register will be kept
@@ -47,10 +44,15 @@ Room for improvement:
       knows there is someone duplicate)
 """
 
+import re
+
 from gi.repository import Gtk
 from kiwi.ui.objectlist import Column
+from storm.expr import And, Cast, Count, Like
 
 from stoqlib.api import api
+from stoqlib.database.expr import (ArrayAgg, Case, CharLength, Concat,
+                                   RegexpReplace, Right, SplitPart, Trim)
 from stoqlib.domain.person import PersonAddressView
 from stoqlib.gui.base.dialogs import run_dialog
 from stoqlib.gui.dialogs.progressdialog import ProgressDialog
@@ -108,43 +110,47 @@ class _MethodModel(object):
         self.same_street = True
         self._street_prefixes = api.get_l10n_field('common_street_prefixes')
 
-    def _get_street_name(self, person):
-        street = person.clean_street.strip()
-        for prefix in self._street_prefixes:
-            if street.startswith(prefix):
-                street = street[len(prefix):]
-                break
-        return street.strip()
-
-    def _get_name(self, person):
+    def _get_street_name(self):
+        street = Trim(u'BOTH', u' ', PersonAddressView.clean_street)
+        if self._street_prefixes:
+            prefixes = u'|'.join(re.escape(prefix)
+                                 for prefix in self._street_prefixes)
+            street = Trim(u'BOTH', u' ',
+                          RegexpReplace(street, u'^(%s)' % prefixes, u''))
+        return street
+
+    def _get_name(self):
+        name = PersonAddressView.clean_name
         if self.method == self.SAME_NAME:
-            return person.clean_name
+            return name
         elif self.method == self.FIRST_NAME:
-            first_name = person.clean_name.split(' ')[0]
-            return first_name
+            return SplitPart(name, u' ', 1)
         elif self.method == self.FIRST_LAST_NAME:
-            parts = person.clean_name.split(' ')
-            if len(parts) == 1:
-                return parts[0]
-            else:
-                return parts[0] + parts[-1]
-
-    def get_key(self, person):
-        key = [self._get_name(person)]
+            return Case(Like(name, u'% %'),
+                        Concat(SplitPart(name, u' ', 1),
+                               RegexpReplace(name, u'^.* ', u'')),
+                        name)
+
+    def get_key(self):
+        """Get the key used to detect the duplicates
+
+        :returns: a tuple with the list of columns that make the key and the
+          query that excludes the persons that don't have a valid key
+        """
+        columns = [self._get_name()]
+        queries = []
         if self.same_phone:
-            phone_number = str(person.phone_number)[-8:]
-            if not phone_number or len(phone_number) < 6:
-                return None
-            key.append(phone_number)
+            phone_number = PersonAddressView.phone_number
+            columns.append(Right(phone_number, 8))
+            queries.append(CharLength(phone_number) >= 6)
 
         if self.same_street:
-            street = self._get_street_name(person)
+            street = self._get_street_name()
+            columns.append(street)
             # We cant trust when the street name is to short
-            if len(street) <= 3:
-                return None
-            key.append(street)
+            queries.append(CharLength(street) > 3)
 
-        return tuple(key)
+        return columns, And(PersonAddressView.clause, *queries)
 
 
 class NameColumn(Column):
@@ -221,12 +227,8 @@ class PersonMergeDialog(BaseEditor):
         self._create_progress(_('Merging duplicate'))
 
         first = store.fetch(to_merge[0].person.person)
-        rest = to_merge[1:]
-        total = len(rest)
-        for i, other in enumerate(rest):
-            first.merge_with(store.fetch(other.person.person),
-                             copy_empty_values=True)
-            self._update_progress(i, total)
+        rest = [store.fetch(other.person.person) for other in to_merge[1:]]
+        first.merge_with(rest, copy_empty_values=True)
 
         self._close_progress()
 
@@ -251,38 +253,27 @@ class PersonMergeDialog(BaseEditor):
 
     def _search_duplicates(self):
         self._create_progress(_('Searching duplicates'))
-        data = self.store.find(PersonAddressView).order_by(PersonAddressView.name)
-        total = data.count()
         self.dup_tree.clear()
-        dups_total = 0
-
-        # A dictionaty mapping a reduced version of the person to a list of
-        # persons that match this reduced version.
-        person_dict = {}
-
-        # A cache of duplicate registers already found.
-        dups = []
-
-        for i, person in enumerate(data):
-            key = self.model.get_key(person)
-            if not key:
-                continue
 
-            entry = person_dict.setdefault(key, [])
-            if len(entry) == 1:
-                # The entry already has one person in it. So we can consider
-                # this a duplicate.
-                dups.append(entry)
-            entry.append(person)
+        # Only the groups of persons that have the same key are fetched
+        columns, query = self.model.get_key()
+        groups = self.store.using(*PersonAddressView.tables).find(
+            ArrayAgg(Cast(PersonAddressView.id, 'text')), query)
+        groups = list(groups.group_by(*columns).having(Count() > 1))
+        self._update_progress(0, 2)
 
-            if len(entry) >= 2:
-                dups_total += 1
+        ids = set(person_id for group in groups for person_id in group)
+        persons = dict((person.id, person) for person in self.store.find(
+            PersonAddressView, PersonAddressView.id.is_in(ids)))
+        self._update_progress(1, 2)
 
-            if i % 100 == 0:
-                self._update_progress(i, total)
+        dups = [sorted((persons[person_id] for person_id in group),
+                       key=lambda p: p.name)
+                for group in groups]
+        dups.sort(key=lambda d: d[0].name)
 
         self.message.set_text(_('Found %s persons in a total of %s duplicate registers')
-                              % (len(dups), dups_total + len(dups)))
+                              % (len(dups), len(ids)))
         self._close_progress()
         self._build_duplicate_tree(dups)
 
@@ -43,6 +43,7 @@ from stoqlib.gui.dialogs.masseditordialog import (Field, MassEditorSearch,
                                                   AccessorField, ReferenceField)
 from stoqlib.lib.translation import stoqlib_gettext
 from stoqlib.lib.message import info
+from stoqlib.lib.dateutils import localnow
 from stoqlib.lib.formatters import get_formatted_percentage
 from stoqlib.domain.service import Service
 from stoqlib.domain.product import Product, Storable, ProductManufacturer
@@ -125,6 +126,13 @@ class CategoryPriceField(Field):
             info.price = value
 
 
+class BasePriceField(AccessorField):
+    def get_set_expressions(self, column, value):
+        # Sellable.on_object_changed does this when setting the price
+        # on the object itself
+        return [column == value, Sellable.price_last_updated == localnow()]
+
+
 class SellableView(Viewable):
     sellable = Sellable
     product = Product
@@ -166,7 +174,8 @@ class SellableMassEditorDialog(MassEditorSearch):
             AccessorField(_('Barcode'), 'sellable', 'barcode', str, unique=True),
             ReferenceField(_('Category'), 'sellable', 'category',
                            SellableCategory, 'description'),
-            AccessorField(_('Description'), 'sellable', 'description', str),
+            AccessorField(_('Description'), 'sellable', 'description', str,
+                          set_based=True),
             ReferenceField(_('Unit'), 'sellable', 'unit',
                            SellableUnit, 'description', visible=False),
             ReferenceField(_('C.F.O.P.'), 'sellable', 'default_sale_cfop',
@@ -178,14 +187,14 @@ class SellableMassEditorDialog(MassEditorSearch):
                           format_func=get_formatted_percentage),
             AccessorField(_('Cost'), 'sellable', 'cost', currency,
                           validator=validate_price),
-            AccessorField(_('Default Price'), 'sellable', 'base_price', currency,
-                          validator=validate_price),
+            BasePriceField(_('Default Price'), 'sellable', 'base_price', currency,
+                           validator=validate_price, set_based=True),
             AccessorField(_('On Sale Price'), 'sellable', 'on_sale_price', currency,
-                          validator=validate_price),
+                          validator=validate_price, set_based=True),
             AccessorField(_('On Sale Start Date'), 'sellable', 'on_sale_start_date',
-                          datetime.date),
+                          datetime.date, set_based=True),
             AccessorField(_('On Sale End Date'), 'sellable', 'on_sale_end_date',
-                          datetime.date),
+                          datetime.date, set_based=True),
 
             # Cost and price update time
             AccessorField(_('Need Price Update'), None, 'need_price_update',
@@ -196,25 +205,35 @@ class SellableMassEditorDialog(MassEditorSearch):
                           datetime.date, read_only=True, visible=False),
 
             # Product Fields
-            AccessorField(_('NCM'), 'product', 'ncm', str, visible=False),
-            AccessorField(_('Location'), 'product', 'location', str, visible=False),
-            AccessorField(_('Brand'), 'product', 'brand', str, visible=False),
-            AccessorField(_('Family'), 'product', 'family', str, visible=False),
-            AccessorField(_('Model'), 'product', 'model', str, visible=False),
-            AccessorField(_('Width'), 'product', 'width', decimal.Decimal, visible=False),
-            AccessorField(_('Height'), 'product', 'height', decimal.Decimal, visible=False),
-            AccessorField(_('Depth'), 'product', 'depth', decimal.Decimal, visible=False),
-            AccessorField(_('Weight'), 'product', 'weight', decimal.Decimal, visible=False),
+            AccessorField(_('NCM'), 'product', 'ncm', str, visible=False,
+                          set_based=True),
+            AccessorField(_('Location'), 'product', 'location', str, visible=False,
+                          set_based=True),
+            AccessorField(_('Brand'), 'product', 'brand', str, visible=False,
+                          set_based=True),
+            AccessorField(_('Family'), 'product', 'family', str, visible=False,
+                          set_based=True),
+            AccessorField(_('Model'), 'product', 'model', str, visible=False,
+                          set_based=True),
+            AccessorField(_('Width'), 'product', 'width', decimal.Decimal, visible=False,
+                          set_based=True),
+            AccessorField(_('Height'), 'product', 'height', decimal.Decimal, visible=False,
+                          set_based=True),
+            AccessorField(_('Depth'), 'product', 'depth', decimal.Decimal, visible=False,
+                          set_based=True),
+            AccessorField(_('Weight'), 'product', 'weight', decimal.Decimal, visible=False,
+                          set_based=True),
 
             ReferenceField(_('Manufacturer'), 'product', 'manufacturer',
                            ProductManufacturer, 'name', visible=False),
 
             # Service Fields
             AccessorField(_('Service List Item Code'), 'service', 'service_list_item_code',
-                          str, visible=False),
+                          str, visible=False, set_based=True),
             AccessorField(_('City Taxation Code'), 'service', 'city_taxation_code',
-                          str, visible=False),
-            AccessorField(_('ISS Aliquot'), 'service', 'p_iss', decimal.Decimal, visible=False),
+                          str, visible=False, set_based=True),
+            AccessorField(_('ISS Aliquot'), 'service', 'p_iss', decimal.Decimal,
+                          visible=False, set_based=True),
         ]
 
         category_fields = []
@@ -28,7 +28,7 @@ from kiwi.datatypes import converter
 
 from stoqlib.domain.image import Image
 from stoqlib.gui.base.dialogs import RunnableView
-from stoqlib.lib.imageutils import get_pixbuf, get_thumbnail
+from stoqlib.lib.imageutils import get_pixbuf, get_image_thumbnail
 from stoqlib.lib.translation import stoqlib_gettext as _
 
 _pixbuf_converter = converter.get_converter(GdkPixbuf.Pixbuf)
@@ -61,23 +61,21 @@ class SellableImageViewer(GladeDelegate, RunnableView):
 
     def set_sellable(self, sellable):
         self.sellable = sellable
-        if not self.sellable or not self.sellable.image:
+        # Only fetch the image data that is going to be displayed
+        image_id = sellable and Image.get_main_image_id(sellable.store,
+                                                        sellable)
+        if not image_id:
             self.image.set_from_stock(Gtk.STOCK_MISSING_IMAGE,
                                       Gtk.IconSize.DIALOG)
             return
 
         if self._use_thumbnail:
             size = (Image.THUMBNAIL_SIZE_WIDTH, Image.THUMBNAIL_SIZE_HEIGHT)
-
-            if not sellable.image.thumbnail:
-                # If image came without a thumbnail, generate one for it
-                # This should happen only once for each image
-                sellable.image.thumbnail = get_thumbnail(
-                    sellable.image.image, size)
-
-            pixbuf = get_pixbuf(sellable.image.thumbnail, size)
+            thumbnail = get_image_thumbnail(sellable.store, image_id)
+            pixbuf = get_pixbuf(thumbnail, size)
         else:
-            pixbuf = _pixbuf_converter.from_string(sellable.image.image)
+            image_data = Image.get_image_data(sellable.store, image_id)
+            pixbuf = _pixbuf_converter.from_string(image_data)
             iw, ih = pixbuf.get_width(), pixbuf.get_height()
             image_aspect = float(iw) / ih
 
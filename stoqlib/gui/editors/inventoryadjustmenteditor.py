@@ -171,13 +171,9 @@ class InventoryAdjustmentEditor(BaseEditor):
         self._run_adjustment_dialog(selected)
 
     def on_adjust_all_button__clicked(self, button):
-        for item in self.inventory_items:
-            if item.is_adjusted:
-                continue
-            item.actual_quantity = item.counted_quantity
-            item.reason = _(u'Automatic adjustment')
-            item.adjust(self.model.invoice_number)
-            self.inventory_items.update(item)
+        self.model.adjust_items(self.model.invoice_number,
+                                reason=_(u'Automatic adjustment'))
+        self.inventory_items.refresh()
 
     def on_inventory_items__row_activated(self, objectlist, item):
         if not self.adjust_button.get_sensitive():
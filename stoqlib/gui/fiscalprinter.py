@@ -382,6 +382,12 @@ class FiscalCoupon(GObject.GObject):
     gsignal('customer-identified', retval=bool)
     gsignal('add-item', object, retval=int)
     gsignal('remove-item', object)
+    #: emitted to wait for the items still being sent to the fiscal printer.
+    #: The return value should be the number of items rejected meanwhile
+    gsignal('flush', retval=int)
+    #: emitted when the fiscal printer could not print an item that was
+    #: already added to the coupon
+    gsignal('item-rejected', object)
     gsignal('add-payments', object)
     gsignal('totalize', object)
     gsignal('close', object, retval=int)
@@ -440,11 +446,37 @@ class FiscalCoupon(GObject.GObject):
     def get_items(self):
         return list(self._item_ids.keys())
 
+    def reject_item(self, sale_item, item_id):
+        """Rejects an item previously added to the coupon
+
+        The fiscal printer may acknowledge an item only after
+        :meth:`.add_item` returned. This should be called when it fails to
+        print the item, so it can be removed from the sale.
+
+        :param sale_item: the sale item
+        :param item_id: the id returned by :meth:`.add_item` for it
+        """
+        log.info("sale item %r was rejected by the coupon" % (sale_item, ))
+        ids = self._item_ids.get(sale_item, [])
+        if item_id in ids:
+            ids.remove(item_id)
+        if not ids:
+            self._item_ids.pop(sale_item, None)
+        self.emit('item-rejected', sale_item)
+
+    def flush(self):
+        """Waits until all the items were sent to the fiscal printer
+
+        :returns: the number of items that were rejected meanwhile. They
+          were already removed from the coupon.
+        """
+        return self.emit('flush')
+
     def remove_item(self, sale_item):
         if sale_item.price < 0:
             return
 
-        for item_id in self._item_ids.pop(sale_item):
+        for item_id in self._item_ids.pop(sale_item, []):
             log.info("removing sale item %r from coupon" % (sale_item, ))
             try:
                 self.emit('remove-item', item_id)
@@ -512,6 +544,12 @@ class FiscalCoupon(GObject.GObject):
             will be used to rollback to if the sale was not confirmed.
         :param subtotal: the total value of all the items in the sale
         """
+        # Some items may still be on their way to the fiscal printer. If it
+        # rejected any of them, the sale doesn't match the coupon anymore
+        if self.flush():
+            store.rollback(name=savepoint, close=False)
+            return False
+
         # Actually, we are confirming the sale here, so the sale
         # confirmation process will be available to others applications
         # like Till and not only to the POS.
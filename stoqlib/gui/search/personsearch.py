@@ -34,7 +34,7 @@ from storm.expr import Eq
 from stoqlib.api import api
 from stoqlib.domain.person import (EmployeeRole,
                                    Branch, BranchView,
-                                   Client, ClientView,
+                                   Client, ClientBalanceView,
                                    Employee, EmployeeView,
                                    TransporterView,
                                    SupplierView, UserView, ClientsWithCreditView)
@@ -165,11 +165,14 @@ class SupplierSearch(BasePersonSearch):
 class ClientSearch(BasePersonSearch):
     title = _('Client Search')
     editor_class = ClientEditor
-    search_spec = ClientView
+    search_spec = ClientBalanceView
     search_label = _('matching:')
-    text_field_columns = [ClientView.name, ClientView.cpf, ClientView.rg_number,
-                          ClientView.phone_number, ClientView.mobile_number,
-                          ClientView.fancy_name, ClientView.email]
+    text_field_columns = [ClientBalanceView.name, ClientBalanceView.cpf,
+                          ClientBalanceView.rg_number,
+                          ClientBalanceView.phone_number,
+                          ClientBalanceView.mobile_number,
+                          ClientBalanceView.fancy_name,
+                          ClientBalanceView.email]
 
     def __init__(self, store, birth_date=None, **kwargs):
         self._birth_date = birth_date
@@ -223,7 +226,11 @@ class ClientSearch(BasePersonSearch):
                 SearchColumn('fancy_name', _('Fancy Name'), data_type=str,
                              width=150, visible=False),
                 SearchColumn('email', _('Email'), data_type=str,
-                             width=150, visible=False)]
+                             width=150, visible=False),
+                SearchColumn('credit_account_balance', _('Credit Balance'),
+                             data_type=currency, width=120, visible=False),
+                SearchColumn('remaining_store_credit', _('Store Credit'),
+                             data_type=currency, width=120, visible=False)]
 
     def get_editor_model(self, client_view):
         return client_view.client
@@ -35,7 +35,7 @@ from stoqlib.api import api
 from stoqlib.domain.person import Branch
 from stoqlib.domain.product import (Product, ProductHistory,
                                     ProductStockItem)
-from stoqlib.domain.sale import Sale
+from stoqlib.domain.sale import SaleSummary
 from stoqlib.domain.sellable import SellableCategory, Sellable
 from stoqlib.domain.views import (ProductQuantityView,
                                   ProductFullStockItemView, SoldItemView,
@@ -187,7 +187,7 @@ class ProductSearch(SellableSearch):
         self._print_slave.print_price_button.set_sensitive(False)
 
     def on_print_price_button_clicked(self, button):
-        print_report(ProductPriceReport, list(self.results),
+        print_report(ProductPriceReport, self.get_report_data(),
                      filters=self.search.get_search_filters(),
                      branch_name=self.branch_filter.combo.get_selected_label())
     #
@@ -361,7 +361,7 @@ class ProductsSoldSearch(ProductSearch):
     has_print_price_button = False
     advanced_search = False
     text_field_columns = [SoldItemView.description]
-    branch_filter_column = Sale.branch_id
+    branch_filter_column = SaleSummary.branch_id
 
     def __init__(self, store, hide_footer=True, hide_toolbar=True):
         ProductSearch.__init__(self, store, hide_footer=hide_footer,
@@ -411,7 +411,7 @@ class ProductsSoldSearch(ProductSearch):
     def create_filters(self):
         self.date_filter = DateSearchFilter(_('Date:'))
         self.date_filter.select(Today)
-        self.add_filter(self.date_filter, columns=[Sale.confirm_date])
+        self.add_filter(self.date_filter, columns=[SaleSummary.date])
 
     def get_columns(self):
         return [Column('code', title=_('Code'), data_type=str,
@@ -31,11 +31,14 @@ from decimal import Decimal
 from gi.repository import Gtk, Pango
 from kiwi.currency import currency
 from kiwi.ui.objectlist import Column
-from storm.expr import Count, And
+from storm.expr import Count, And, Join
 
 from stoqlib.api import api
+from stoqlib.database.expr import Date
 from stoqlib.enums import SearchFilterPosition
 from stoqlib.domain.sale import (Sale,
+                                 SaleItem,
+                                 SaleSummary,
                                  SaleView,
                                  SalePaymentMethodView,
                                  SoldItemsByClient,
@@ -206,7 +209,7 @@ class SoldItemsByBranchSearch(SearchDialog):
     size = (800, 450)
     unlimited_results = True
     text_field_columns = [SoldItemsByBranchView.description]
-    branch_filter_column = Sale.branch_id
+    branch_filter_column = SaleSummary.branch_id
 
     def setup_widgets(self):
         self.add_csv_button(_('Sales'), _('sales'))
@@ -242,8 +245,18 @@ class SoldItemsByBranchSearch(SearchDialog):
             total_quantity += obj.quantity
             total += obj.total
 
+        # The summary doesn't know which sales were summarized, so join
+        # it back with the sales of its days to count them
         queries, having = self.search.parse_states()
-        sale_results = self.store.using(*self.search_spec.tables)
+        tables = self.search_spec.tables[:]
+        tables.extend([
+            Join(SaleItem, SaleItem.sellable_id == SaleSummary.sellable_id),
+            Join(Sale, And(Sale.id == SaleItem.sale_id,
+                           Sale.branch_id == SaleSummary.branch_id,
+                           Date(Sale.confirm_date) == Date(SaleSummary.date),
+                           Sale.status.is_in(SaleSummary.statuses))),
+        ])
+        sale_results = self.store.using(*tables)
         sale_results = sale_results.find(Count(Sale.id, distinct=True))
         if queries:
             sale_results = sale_results.find(And(*queries))
@@ -262,7 +275,7 @@ class SoldItemsByBranchSearch(SearchDialog):
 
     def create_filters(self):
         date_filter = DateSearchFilter(_('Date:'))
-        self.search.add_filter(date_filter, columns=[Sale.confirm_date])
+        self.search.add_filter(date_filter, columns=[SaleSummary.date])
         self.date_filter = date_filter
 
     def get_columns(self):
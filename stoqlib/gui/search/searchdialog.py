@@ -28,8 +28,11 @@ from gi.repository import Gtk
 from kiwi.environ import environ
 from kiwi.ui.delegates import GladeSlaveDelegate
 from kiwi.utils import gsignal
+from storm.exceptions import FeatureError
+from storm.expr import Desc, Expr
 
 from stoqlib.database.queryexecuter import DateQueryState, DateIntervalQueryState
+from stoqlib.database.runtime import StoqlibResultSet
 from stoqlib.domain.person import Individual
 from stoqlib.enums import SearchFilterPosition
 from stoqlib.gui.base.dialogs import BasicDialog
@@ -268,6 +271,29 @@ class SearchDialog(BasicDialog):
         if self.unlimited_results:
             self.search.get_query_executer().set_limit(-1)
 
+    def _get_results_order(self):
+        # The order of the results as an expression for the query, or None
+        # if they are not sorted by a column of the query
+        sort_column_id, sort_order = self.results.get_model().get_sort_column_id()
+        columns = self.results.get_columns()
+        if sort_column_id is None or not 0 <= sort_column_id < len(columns):
+            return None
+
+        column = columns[sort_column_id]
+        # The database can't sort the way a custom sort function does
+        if column.sort_func is not None:
+            return None
+        attribute = getattr(column, 'search_attribute', None) or column.attribute
+        if isinstance(attribute, str):
+            search_spec = self.search.get_query_executer().search_spec
+            attribute = getattr(search_spec, attribute, None)
+        if not isinstance(attribute, Expr):
+            return None
+
+        if sort_order == Gtk.SortType.DESCENDING:
+            return Desc(attribute)
+        return attribute
+
     #
     # Public API
     #
@@ -333,8 +359,43 @@ class SearchDialog(BasicDialog):
         # FIXME: This should chain up so the "cancel" signal gets emitted
         self.close()
 
+    def get_report_data(self):
+        """Get the data that should be printed by a report
+
+        When possible, this is the query of the last search ordered by the
+        column the results are sorted by, so the report can fetch the rows
+        in chunks and only the columns that it needs. Otherwise, this is
+        a list of the objects loaded in the results.
+
+        :returns: a result set or a list
+        """
+        states = self.search.get_last_states()
+        order_by = self._get_results_order()
+        executer = self.search.get_query_executer()
+        limit = executer.get_limit()
+        # When the results were limited, the query would return rows
+        # that are not on the list
+        if (states is None or order_by is None or
+                (limit > 0 and len(self.results) >= limit)):
+            return list(self.results)
+
+        results = self.search.get_last_results()
+        if isinstance(results, StoqlibResultSet):
+            try:
+                return results.copy().order_by(order_by)
+            except FeatureError:
+                # The last results were sliced by the limit
+                pass
+
+        # The last results may be limited or cached, and those can't
+        # be ordered, so search again without the limit
+        results = executer.search(states, limit=-1)
+        if not isinstance(results, StoqlibResultSet):
+            return list(self.results)
+        return results.order_by(order_by)
+
     def print_report(self):
-        print_report(self.report_class, self.results, list(self.results),
+        print_report(self.report_class, self.results, self.get_report_data(),
                      filters=self.search.get_search_filters())
 
     # FIXME: This should be on BasePersonSearch
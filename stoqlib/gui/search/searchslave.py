@@ -38,7 +38,8 @@ from stoqlib.api import api
 from stoqlib.database.queryexecuter import (NumberQueryState, StringQueryState,
                                             DateQueryState, DateIntervalQueryState,
                                             NumberIntervalQueryState, BoolQueryState,
-                                            QueryExecuter, MultiQueryState)
+                                            QueryExecuter, MultiQueryState,
+                                            SearchResultCache)
 from stoqlib.enums import SearchFilterPosition
 from stoqlib.gui.interfaces import ISearchResultView
 from stoqlib.gui.search.searchcolumns import SearchColumn
@@ -107,8 +108,10 @@ class SearchSlave(SlaveDelegate):
         self._auto_search = True
         self._lazy_search = False
         self._last_results = None
+        self._last_states = None
         self._model = None
         self._query_executer = None
+        self._result_cache = None
         self._restore_name = restore_name
         self._search_filters = []
         self._selected_item = None
@@ -345,6 +348,8 @@ class SearchSlave(SlaveDelegate):
                 executer.set_limit(sysparam.get_int('MAX_SEARCH_RESULTS'))
             if self._search_spec is not None:
                 executer.set_search_spec(self._search_spec)
+            if self._result_cache is not None:
+                executer.enable_result_cache(self._result_cache)
             self._query_executer = executer
         return self._query_executer
 
@@ -518,6 +523,23 @@ class SearchSlave(SlaveDelegate):
             self.result_view.enable_lazy_search()
         self._lazy_search = True
 
+    def enable_result_cache(self, cache=None):
+        """Cache the results of the searches
+
+        Refreshing the search will not query the database again
+        unless the tables used by the search changed or the results expired.
+        See :class:`stoqlib.database.queryexecuter.SearchResultCache`
+
+        The cache is only applied to limited searches, so this does nothing
+        when :meth:`.enable_lazy_search` is used.
+
+        :param cache: the cache to use or ``None`` to create a new one
+        """
+        self._result_cache = cache or SearchResultCache()
+        # The executer is created lazily, after the lazy search is enabled
+        if self._query_executer is not None:
+            self._query_executer.enable_result_cache(self._result_cache)
+
     def set_auto_search(self, auto_search):
         """
         Enables/Disables auto search which means that the search result box
@@ -577,6 +599,13 @@ class SearchSlave(SlaveDelegate):
     def get_last_results(self):
         return self._last_results
 
+    def get_last_states(self):
+        """Get the states of the filters used by the last search
+
+        :returns: a list of states or ``None`` if no search was done yet
+        """
+        return self._last_states
+
     def set_result_view(self, result_view_class, refresh=False):
         """
         Creates a new result view and attaches it to this search container.
@@ -26,6 +26,7 @@ import datetime
 from decimal import Decimal
 import mock
 from gi.repository import Gtk, Pango
+from kiwi import ValueUnset
 
 from stoqlib.domain.sellable import Sellable, SellableCategory, SellableUnit
 from stoqlib.gui.dialogs.masseditordialog import (MultiplyOperation,
@@ -170,6 +171,32 @@ class TestOperations(GUITest):
         operation.apply_operation(sellable)
         self.assertEqual(field.get_new_value(sellable), u'XXX bar XXX Foo')
 
+    def test_get_update_expression(self):
+        price_field = AccessorField('Test', None, 'base_price', Decimal,
+                                    set_based=True)
+        cost_field = AccessorField('Test', None, 'cost', Decimal)
+        operation = MultiplyOperation(self.store, price_field, [cost_field])
+        operation.combo.select(cost_field)
+        operation.entry.set_text('3')
+        expr = operation.get_update_expression(Sellable)
+        self.assertEqual(expr.exprs, (Sellable.cost, Decimal(3)))
+
+        # The field itself is not set based
+        operation.set_field(cost_field)
+        self.assertIs(operation.get_update_expression(Sellable), ValueUnset)
+
+        operation = SetValueOperation(self.store, price_field, [])
+        operation.entry.set_text('4')
+        self.assertEqual(operation.get_update_expression(Sellable), 4)
+        operation.entry.set_text('foo')
+        self.assertIs(operation.get_update_expression(Sellable), ValueUnset)
+
+        # Dates can't be set in SQL yet
+        field = AccessorField('Test', None, 'on_sale_start_date',
+                              datetime.date, set_based=True)
+        operation = SetDateValueOperation(self.store, field, [])
+        self.assertIs(operation.get_update_expression(Sellable), ValueUnset)
+
 
 class TestEditors(GUITest):
 
@@ -346,6 +373,44 @@ class TestMassEditor(GUITest):
         self.assertEqual(args[0],
                          'There was an error saving one of the values')
 
+    @mock.patch('stoqlib.gui.dialogs.masseditordialog.yesno')
+    def test_apply_set_based(self, yesno):
+        yesno.return_value = True
+        sellable = self.create_sellable(price=10)
+        sellable.cost = 5
+        other_sellable = self.create_sellable(price=10)
+        other_sellable.cost = 5
+
+        price_field = AccessorField('Test', None, 'base_price', Decimal,
+                                    set_based=True)
+        cost_field = AccessorField('Test', None, 'cost', Decimal)
+        search = self._create_search(
+            [price_field, cost_field],
+            self.store.find(Sellable, id=sellable.id))
+        search.search.refresh()
+
+        mass_editor = search.mass_editor
+        mass_editor.field_combo.select(price_field)
+        mass_editor._editor.operations_combo.select(MultiplyOperation)
+        operation = mass_editor._editor._oper
+        operation.combo.select(cost_field)
+        operation.entry.set_text('3')
+        self.click(mass_editor.apply_button)
+
+        yesno.assert_called_once_with(
+            'This will update 1 items. Are you sure?', Gtk.ResponseType.NO,
+            'Apply changes', "Don't apply")
+        # Nothing was changed one by one
+        self.assertEqual(mass_editor.get_changed_objects(), set())
+        self.assertEqual(mass_editor.get_updated_count(), 1)
+        self.assertEqual(sellable.base_price, 15)
+        self.assertEqual(other_sellable.base_price, 10)
+
+        # Cancelling the dialog should discard the changes
+        search.cancel()
+        self.assertEqual(mass_editor.get_updated_count(), 0)
+        self.assertEqual(sellable.base_price, 10)
+
     @mock.patch('stoqlib.gui.dialogs.masseditordialog.yesno')
     @mock.patch('stoqlib.gui.dialogs.masseditordialog.warning')
     def test_confirm_not_changed(self, warning, yesno):
@@ -22,8 +22,12 @@
 ## Author(s): Stoq Team <stoq-devel@async.com.br>
 ##
 
+import datetime
+
 import mock
-from stoqlib.gui.dialogs.paymentflowhistorydialog import PaymentFlowHistoryDialog
+from stoqlib.domain.payment.payment import Payment
+from stoqlib.gui.dialogs.paymentflowhistorydialog import (PaymentFlowDay,
+                                                          PaymentFlowHistoryDialog)
 from stoqlib.gui.test.uitestutils import GUITest
 
 
@@ -54,3 +58,38 @@ class TestPaymentFlowHistoryDialog(GUITest):
         divergent_payments = results[0].get_divergent_payments()
         self.assertEqual(divergent_payments.count(), 1)
         self.assertEqual(divergent_payments[0], payment)
+
+    def test_get_flow_history(self):
+        date = datetime.date(1990, 1, 1)
+        received = self.create_payment(payment_type=Payment.TYPE_IN,
+                                       date=date, value=100)
+        received.set_pending()
+        received.pay(date + datetime.timedelta(days=1), paid_value=100)
+        paid = self.create_payment(date=date + datetime.timedelta(days=2),
+                                   value=30)
+        paid.set_pending()
+        paid.pay(date + datetime.timedelta(days=3), paid_value=30)
+        self.create_payment(date=date + datetime.timedelta(days=4), value=5)
+
+        history = PaymentFlowDay.get_flow_history(
+            self.store, date, date + datetime.timedelta(days=4))
+        self.assertEqual(
+            [(day.history_date, day.previous_balance, day.balance_expected,
+              day.balance_real) for day in history],
+            [(date, 0, 100, 0),
+             (date + datetime.timedelta(days=1), 0, 0, 100),
+             (date + datetime.timedelta(days=2), 100, 70, 100),
+             (date + datetime.timedelta(days=3), 100, 100, 70),
+             # The payment not confirmed yet is not in the balances
+             (date + datetime.timedelta(days=4), 70, 70, 70)])
+
+        # Only the last days are calculated, starting from the balance of
+        # the previous ones
+        history = PaymentFlowDay.get_flow_history(
+            self.store, date + datetime.timedelta(days=3),
+            date + datetime.timedelta(days=3))
+        self.assertEqual(len(history), 1)
+        self.assertEqual(history[0].previous_balance, 100)
+        self.assertEqual(history[0].paid, 30)
+        self.assertEqual(history[0].paid_payments, 1)
+        self.assertEqual(history[0].balance_real, 70)
@@ -120,9 +120,11 @@ class TestPaymentSearch(GUITest):
 
         self.assertSensitive(search._details_slave, ['print_button'])
         self.click(search._details_slave.print_button)
+        args, kwargs = print_report.call_args
         print_report.assert_called_once_with(CardPaymentReport, search.results,
-                                             list(search.results),
+                                             mock.ANY,
                                              filters=search.search.get_search_filters())
+        self.assertReportData(args[2], search.results)
 
     def test_format_card_type(self):
         search = CardPaymentSearch(self.store)
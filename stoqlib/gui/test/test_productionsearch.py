@@ -130,8 +130,9 @@ class TestProductionItemsSearch(GUITest):
         self.click(search._details_slave.print_button)
         args, kwargs = print_report.call_args
         print_report.assert_called_once_with(
-            ProductionItemReport, search.results, list(search.results),
+            ProductionItemReport, search.results, mock.ANY,
             filters=search.search.get_search_filters())
+        self.assertReportData(args[2], search.results)
 
 
 class TestProductionHistorySearch(GUITest):
@@ -206,7 +207,9 @@ class TestProductionHistorySearch(GUITest):
         self.assertSensitive(details_slave, ['print_button'])
 
         self.click(details_slave.print_button)
+        args, kwargs = print_report.call_args
         print_report.assert_called_once_with(ProductionItemReport,
                                              search.results,
-                                             list(search.results),
+                                             mock.ANY,
                                              filters=search.search.get_search_filters())
+        self.assertReportData(args[2], search.results)
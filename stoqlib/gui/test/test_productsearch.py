@@ -25,14 +25,17 @@
 import datetime
 import mock
 
+from gi.repository import Gtk
+
 from stoqlib.api import api
-from stoqlib.database.runtime import get_current_branch, get_current_user
+from stoqlib.database.runtime import (get_current_branch, get_current_user,
+                                     StoqlibResultSet)
 from stoqlib.domain.person import Branch
 from stoqlib.domain.product import (ProductHistory, Storable, Product,
                                     ProductStockItem, ProductSupplierInfo,
                                     StockTransactionHistory)
 from stoqlib.domain.purchase import PurchaseOrder
-from stoqlib.domain.sale import SaleItem
+from stoqlib.domain.sale import SaleItem, SaleSummary
 from stoqlib.domain.sellable import Sellable
 from stoqlib.gui.search.productsearch import (ProductSearch,
                                               ProductSearchQuantity,
@@ -117,8 +120,9 @@ class TestProductSearch(GUITest):
         self.click(search._details_slave.print_button)
         args, kwargs = print_report.call_args
         print_report.assert_called_once_with(
-            ProductReport, search.results, list(search.results),
+            ProductReport, search.results, mock.ANY,
             filters=search.search.get_search_filters())
+        self.assertReportData(args[2], search.results)
 
     @mock.patch('stoqlib.gui.search.productsearch.print_report')
     def test_print_price_button(self, print_report):
@@ -129,9 +133,10 @@ class TestProductSearch(GUITest):
         self.click(search._print_slave.print_price_button)
         args, kwargs = print_report.call_args
         print_report.assert_called_once_with(
-            ProductPriceReport, list(search.results),
+            ProductPriceReport, mock.ANY,
             filters=search.search.get_search_filters(),
             branch_name=search.branch_filter.combo.get_selected_label())
+        self.assertReportData(args[1], search.results)
 
     def test_search(self):
         self.clean_domain([StockTransactionHistory, ProductSupplierInfo,
@@ -267,8 +272,9 @@ class TestProductSearchQuantity(GUITest):
         self.click(search._details_slave.print_button)
         args, kwargs = print_report.call_args
         print_report.assert_called_once_with(
-            ProductQuantityReport, search.results, list(search.results),
+            ProductQuantityReport, search.results, mock.ANY,
             filters=search.search.get_search_filters())
+        self.assertReportData(args[2], search.results)
 
 
 class TestProductsSoldSearch(GUITest):
@@ -279,7 +285,7 @@ class TestProductsSoldSearch(GUITest):
         return search
 
     def _create_domain(self):
-        self.clean_domain([SaleItem])
+        self.clean_domain([SaleItem, SaleSummary])
 
         branch = get_current_branch(self.store)
         self.today = localtoday()
@@ -347,8 +353,9 @@ class TestProductsSoldSearch(GUITest):
         args, kwargs = print_report.call_args
         print_report.assert_called_once_with(ProductsSoldReport,
                                              search.results,
-                                             list(search.results),
+                                             mock.ANY,
                                              filters=search.search.get_search_filters())
+        self.assertReportData(args[2], search.results)
 
 
 class TestProductStockSearch(GUITest):
@@ -426,8 +433,39 @@ class TestProductStockSearch(GUITest):
         args, kwargs = print_report.call_args
         print_report.assert_called_once_with(ProductStockReport,
                                              search.results,
-                                             list(search.results),
+                                             mock.ANY,
                                              filters=search.search.get_search_filters())
+        self.assertReportData(args[2], search.results)
+
+    @mock.patch('stoqlib.gui.search.searchdialog.print_report')
+    def test_print_button_sorted(self, print_report):
+        self._create_domain()
+        search = self._show_search()
+        search.branch_filter.set_state(None)
+        search.search.refresh()
+
+        columns = search.results.get_columns()
+        description = [c.attribute for c in columns].index('description')
+        search.results.get_model().set_sort_column_id(
+            description, Gtk.SortType.DESCENDING)
+
+        self.click(search._details_slave.print_button)
+        args, kwargs = print_report.call_args
+        data = args[2]
+        # The report should receive the query ordered like the results
+        self.assertIsInstance(data, StoqlibResultSet)
+        self.assertEqual([obj.description for obj in data],
+                         [obj.description for obj in search.results])
+        self.assertEqual([obj.description for obj in data],
+                         [u'Luvas', u'Botas'])
+
+        report = ProductStockReport('report.pdf', search.results, data)
+        with mock.patch.object(StoqlibResultSet, 'fetch_chunks',
+                               autospec=True,
+                               side_effect=StoqlibResultSet.fetch_chunks) as fetch_chunks:
+            rows = list(report.get_data())
+        fetch_chunks.assert_called_once_with(data, columns=mock.ANY)
+        self.assertEqual(len(rows), 2)
 
 
 class TestProductBrandSearch(GUITest):
@@ -483,8 +521,9 @@ class TestProductBrandSearch(GUITest):
         args, kwargs = print_report.call_args
         print_report.assert_called_once_with(ProductBrandReport,
                                              search.results,
-                                             list(search.results),
+                                             mock.ANY,
                                              filters=search.search.get_search_filters())
+        self.assertReportData(args[2], search.results)
 
 
 class TestProductClosedStockSearch(GUITest):
@@ -542,5 +581,6 @@ class TestProductClosedStockSearch(GUITest):
         args, kwargs = print_report.call_args
         print_report.assert_called_once_with(
             ProductClosedStockReport,
-            search.results, list(search.results),
+            search.results, mock.ANY,
             filters=search.search.get_search_filters())
+        self.assertReportData(args[2], search.results)
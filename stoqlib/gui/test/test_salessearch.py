@@ -28,7 +28,7 @@ from stoqlib.api import api
 from stoqlib.domain.commission import Commission
 from stoqlib.domain.payment.payment import Payment
 from stoqlib.domain.person import Branch
-from stoqlib.domain.sale import Sale, SaleItem, SaleView
+from stoqlib.domain.sale import Sale, SaleItem, SaleSummary, SaleView
 from stoqlib.database.runtime import get_current_branch
 from stoqlib.gui.dialogs.saledetails import SaleDetailsDialog
 from stoqlib.gui.search.searchfilters import DateSearchFilter
@@ -91,6 +91,10 @@ class TestSoldItemsByBranchSearch(GUITest):
         sale.open_date = localdate(2012, 2, 2).date()
         sale.confirm_date = localdate(2012, 2, 2).date()
 
+        # The sales were summarized when confirmed, before changing
+        # their dates and without the ones removed above
+        SaleSummary.rebuild(self.store)
+
     def _show_search(self):
         search = SoldItemsByBranchSearch(self.store)
         search.search.refresh()
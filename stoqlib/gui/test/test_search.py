@@ -33,6 +33,7 @@ from dateutil.relativedelta import SU, MO, SA, relativedelta as delta
 
 from stoqlib.api import api
 from stoqlib.domain.product import Product
+from stoqlib.domain.sellable import Sellable
 from stoqlib.domain.test.domaintest import DomainTest
 from stoqlib.gui.editors.producteditor import ProductEditor
 from stoqlib.gui.events import SearchDialogSetupSearchEvent
@@ -40,6 +41,7 @@ from stoqlib.gui.search.productsearch import ProductSearch
 from stoqlib.gui.search.searchextension import SearchExtension
 from stoqlib.gui.search.searchcolumns import SearchColumn, QuantityColumn
 from stoqlib.gui.search.searchdialog import SearchDialog
+from stoqlib.gui.search.searchslave import SearchSlave
 from stoqlib.gui.search.searchfilters import (StringSearchFilter, DateSearchFilter,
                                               ComboSearchFilter, NumberSearchFilter)
 from stoqlib.gui.search.searchoptions import (ThisWeek, LastWeek, NextWeek, ThisMonth,
@@ -254,6 +256,28 @@ class TestQuantityColumn(GUITest):
         self.assertEqual(column._format_func(obj, True), u"\u221E")
 
 
+class TestSearchSlave(GUITest):
+    def test_enable_result_cache(self):
+        columns = [SearchColumn('description', data_type=str)]
+        search = SearchSlave(columns, store=self.store,
+                             search_spec=Sellable)
+        search.enable_result_cache()
+        search.enable_lazy_search()
+
+        # Lazy searches are not limited, and thus are never cached
+        executer = search.get_query_executer()
+        self.assertIsNotNone(executer.get_result_cache())
+        self.assertEqual(executer.get_limit(), -1)
+
+        search = SearchSlave(columns, store=self.store,
+                             search_spec=Sellable)
+        search.enable_result_cache()
+        executer = search.get_query_executer()
+        self.assertIsNotNone(executer.get_result_cache())
+        self.assertEqual(executer.get_limit(),
+                         api.sysparam.get_int('MAX_SEARCH_RESULTS'))
+
+
 class TestSearchGeneric(DomainTest):
     """Generic tests for searches"""
 
@@ -71,9 +71,11 @@ class TestStockDecreaseSearch(GUITest):
         search.search.refresh()
         self.assertSensitive(search._details_slave, ['print_button'])
         self.click(search._details_slave.print_button)
+        args, kwargs = print_report.call_args
         print_report.assert_called_once_with(StockDecreaseReport, search.results,
-                                             list(search.results),
+                                             mock.ANY,
                                              filters=search.search.get_search_filters())
+        self.assertReportData(args[2], search.results)
 
         search.search.refresh()
         self.assertNotSensitive(search._details_slave, ['details_button'])
@@ -157,9 +157,11 @@ class TestTransferOrderSearch(GUITest):
 
         self.assertSensitive(search._details_slave, ['print_button'])
         self.click(search._details_slave.print_button)
+        args, kwargs = print_report.call_args
         print_report.assert_called_once_with(TransferOrderReport, search.results,
-                                             list(search.results),
+                                             mock.ANY,
                                              filters=search.search.get_search_filters())
+        self.assertReportData(args[2], search.results)
 
         run_dialog.reset_mock()
         self.assertSensitive(search._details_slave, ['details_button'])
@@ -226,6 +228,8 @@ class TestTransferItemSearch(GUITest):
                                            search.results[0].transfer_order)
         # Testing clicking on print button
         self.click(search._details_slave.print_button)
+        args, kwargs = print_report.call_args
         print_report.assert_called_once_with(TransferItemReport, search.results,
-                                             list(search.results),
+                                             mock.ANY,
                                              filters=search.search.get_search_filters())
+        self.assertReportData(args[2], search.results)
@@ -648,6 +648,15 @@ class GUITest(DomainTest):
                 self.fail("%s.%s should not be visible" % (
                     dialog.__class__.__name__, attr))
 
+    def assertReportData(self, data, results):
+        """Check that the data given to a report has the same rows as results
+
+        The data may be a new query for the results, so the rows are compared
+        by their ids and not by identity.
+        """
+        self.assertEqual(sorted(str(item.id) for item in data),
+                         sorted(str(item.id) for item in results))
+
     def check_widget(self, widget, ui_test_name, models=None, ignores=None):
         models = models or []
         ignores = ignores or []
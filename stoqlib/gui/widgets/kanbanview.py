@@ -33,6 +33,10 @@ from kiwi.python import Settable
 from kiwi.utils import gsignal
 from kiwi.ui.objectlist import Column, ObjectList
 
+from stoqlib.lib.translation import stoqlib_gettext
+
+_ = stoqlib_gettext
+
 
 class KanbanObjectListColumn(Column):
     def create_renderer(self, model):
@@ -99,15 +103,39 @@ class KanbanViewColumn(object):
         self.value = value
         self.view = None
         self.object_list = None
+        self.more_button = None
 
     def clear(self):
         """Clear this view, eg remove all the items"""
         self.object_list.clear()
+        self.set_has_more(False)
 
     def append_item(self, item):
         """Append an item to the view"""
         self.object_list.append(item)
 
+    def insert_item(self, index, item):
+        """Insert an item in the given position of the view"""
+        self.object_list.insert(index, item)
+
+    def remove_item(self, item):
+        """Remove an item from the view"""
+        self.object_list.remove(item)
+
+    def get_items(self):
+        """Get the items of the view, in the order they are displayed"""
+        return list(self.object_list)
+
+    def set_has_more(self, has_more):
+        """Show a button to load more items in the view
+
+        When the button is clicked, the ::load-more signal will be emitted
+        by the :class:`KanbanView` with this column as the argument.
+
+        :param has_more: if there are items that were not loaded yet
+        """
+        self.more_button.set_visible(has_more)
+
 
 class KanbanView(Gtk.Frame):
     """
@@ -127,6 +155,7 @@ class KanbanView(Gtk.Frame):
     gsignal('item-popup-menu', object, object, object)
     gsignal('selection-changed', object)
     gsignal('activate-link', object)
+    gsignal('load-more', object)
 
     def __init__(self):
         super(KanbanView, self).__init__()
@@ -156,6 +185,14 @@ class KanbanView(Gtk.Frame):
         for column in self._columns.values():
             column.clear()
 
+    def get_columns(self):
+        """
+        Get all the columns of the view
+
+        :returns: a list of columns
+        """
+        return list(self._columns.values())
+
     def get_column_by_title(self, column_title):
         """
         Get a column given a title
@@ -171,14 +208,23 @@ class KanbanView(Gtk.Frame):
         :param KanbanViewColumn column: column to add
         """
         object_list = self._create_list(column.title)
-        self.hbox.pack_start(object_list, True, True, 0)
+        more_button = Gtk.Button(label=_(u"Show more"))
+        more_button.set_relief(Gtk.ReliefStyle.NONE)
+        more_button.connect('clicked', self._on_more_button__clicked, column)
+
+        vbox = Gtk.VBox()
+        vbox.pack_start(object_list, True, True, 0)
+        vbox.pack_start(more_button, False, False, 0)
+        self.hbox.pack_start(vbox, True, True, 0)
         object_list.show()
+        vbox.show()
 
         self._columns[column.title] = column
         self._treeviews[column.title] = object_list.get_treeview()
 
         column.view = self
         column.object_list = object_list
+        column.more_button = more_button
 
     def enable_editing(self):
         """
@@ -349,6 +395,9 @@ class KanbanView(Gtk.Frame):
         self.emit('activate-link', uri)
         return True
 
+    def _on_more_button__clicked(self, button, column):
+        self.emit('load-more', column)
+
     def _on_row_activated(self, olist, item):
         self.emit('item-activated', item)
 
@@ -481,8 +481,8 @@ class NewLoanWizard(BaseWizard):
             # message and the dialog is kept open so the user can fix whatever is wrong.
             return
 
+        # This will also decrease the stock of the loaned items
         self.model.confirm()
-        self.model.sync_stock()
         self.retval = self.model
         self.close()
         NewLoanWizardFinishEvent.emit(self.model)
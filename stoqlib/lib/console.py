@@ -28,6 +28,7 @@ import datetime
 import os
 
 from stoqlib.api import api
+from stoqlib.database.debug import enable_query_profiler, get_query_profiler
 from stoqlib.database.tables import get_table_types
 from stoqlib.lib.environment import configure_locale
 
@@ -53,6 +54,9 @@ class Console(object):
         self.ns['store'] = self.store
         self.ns['sysparam'] = api.sysparam
         self.ns['api'] = api
+        # e.g. enable_query_profiler().dump('/tmp/profile.json')
+        self.ns['enable_query_profiler'] = enable_query_profiler
+        self.ns['get_query_profiler'] = get_query_profiler
 
         if not bare:
             self.ns['branch'] = api.get_current_branch(self.store)
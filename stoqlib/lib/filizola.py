@@ -46,7 +46,9 @@ def generate_filizola_file(store):
     content = []
     content.append(diversos)
 
-    for sellable in store.find(Sellable):
+    sellables = list(store.find(Sellable))
+    prices = Sellable.get_prices(store, sellables)
+    for sellable in sellables:
         try:
             # We can only send sellables whose code can be converted to integer
             code = int(sellable.code)
@@ -62,7 +64,7 @@ def generate_filizola_file(store):
             code,
             unit,
             str(strip_accents(sellable.description))[:22],
-            int(sellable.price * 100),
+            int(prices[sellable.id] * 100),
             0,
             '',
             0,
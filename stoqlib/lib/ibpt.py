@@ -160,8 +160,13 @@ class IBPTGenerator(object):
         return total_item * state_tax
 
     def get_ibpt_message(self):
+        items = list(self.items)
+        if items:
+            items[0].store.prefetch(items, 'sellable.product._icms_template',
+                                    'sellable.service')
+
         federal_tax = state_tax = 0
-        for item in self.items:
+        for item in items:
             tax_values = self._load_tax_values(item)
             federal_tax += self._calculate_federal_tax(item, tax_values)
             state_tax += self._calculate_state_tax(item, tax_values)
@@ -28,17 +28,90 @@ Some of those functions were borrowed from datagrid_gtk3:
 https://github.com/nowsecure/datagrid-gtk3/blob/master/datagrid_gtk3/utils/imageutils.py
 """
 
+import hashlib
 import io
+import os
 
 from gi.repository import GdkPixbuf
 from PIL import Image, ImageFilter
 
+from stoqlib.database.runtime import get_default_store, new_store
+from stoqlib.lib.osutils import get_application_dir
+
 _image_border_size = 6
 _image_shadow_size = 6
 _image_shadow_offset = 2
 # Generating a drop shadow is an expensive operation. Keep a cache
 # of already generated drop shadows so they can be reutilized
 _drop_shadows_cache = {}
+_thumbnail_cache = None
+
+
+class ThumbnailCache(object):
+    """A station local cache of thumbnails, addressed by their content
+
+    Each thumbnail is stored in a file named after the md5 digest of its
+    data, so a changed image will never hit a stale entry and there's no
+    need to invalidate anything.
+
+    :param path: the directory where the thumbnails will be stored.
+        Defaults to a directory inside the application dir
+    """
+
+    def __init__(self, path=None):
+        if path is None:
+            path = os.path.join(get_application_dir(), 'thumbnails')
+        self.path = path
+
+    def _get_filename(self, digest):
+        return os.path.join(self.path, digest[:2], digest + '.png')
+
+    #
+    #  Public API
+    #
+
+    def get(self, digest):
+        """Get a thumbnail from the cache
+
+        :param digest: the md5 hex digest of the thumbnail
+        :returns: the thumbnail data or ``None`` if it is not cached
+        """
+        try:
+            with open(self._get_filename(digest), 'rb') as f:
+                return f.read()
+        except (IOError, OSError):
+            return None
+
+    def put(self, data):
+        """Add a thumbnail to the cache
+
+        :param data: the thumbnail data
+        :returns: the md5 hex digest of the thumbnail
+        """
+        digest = hashlib.md5(data).hexdigest()
+        filename = self._get_filename(digest)
+        if os.path.exists(filename):
+            return digest
+
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        # Write to a temporary file first so a concurrent reader never
+        # sees a partial thumbnail
+        tmp_filename = '%s.%d.tmp' % (filename, os.getpid())
+        with open(tmp_filename, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_filename, filename)
+        return digest
+
+
+def get_thumbnail_cache():
+    """Get the thumbnail cache for this station
+
+    :returns: a :class:`ThumbnailCache`
+    """
+    global _thumbnail_cache
+    if _thumbnail_cache is None:
+        _thumbnail_cache = ThumbnailCache()
+    return _thumbnail_cache
 
 
 def image2pixbuf(image):
@@ -159,6 +232,45 @@ def get_thumbnail(image_bytes, size):
             return new_f.getvalue()
 
 
+def get_image_thumbnail(store, image_id):
+    """Get the thumbnail of an image using the thumbnail cache
+
+    Only the thumbnail is transfered from the database, and only if it
+    is not already on this station's :class:`ThumbnailCache`.
+
+    :param store: the store where the image is. A thumbnail generated for
+      it will be saved when *store* is committed, except for the default
+      store, which is read-only
+    :param image_id: the id of the :class:`stoqlib.domain.image.Image`
+    :returns: the thumbnail data or ``None`` if the image doesn't exist
+    """
+    from stoqlib.domain.image import Image
+    cache = get_thumbnail_cache()
+    thumbnail = Image.get_thumbnails(store, [image_id], cache=cache).get(
+        image_id)
+    if thumbnail is not None:
+        return thumbnail
+
+    # Some older images don't have a thumbnail. Generate it and store it
+    # on the database, so this happens only once for each image
+    data = Image.get_image_data(store, image_id)
+    if data is None:
+        return None
+
+    size = (Image.THUMBNAIL_SIZE_WIDTH, Image.THUMBNAIL_SIZE_HEIGHT)
+    thumbnail = get_thumbnail(data, size)
+    if store is get_default_store():
+        # The default store only sees committed images, so they are
+        # available on a new store too
+        with new_store() as image_store:
+            image_store.get(Image, image_id).thumbnail = thumbnail
+    else:
+        # The image may not be committed yet
+        store.get(Image, image_id).thumbnail = thumbnail
+    cache.put(thumbnail)
+    return thumbnail
+
+
 def get_pixbuf(image_bytes, draw_border=True, fill_image=None):
     """Render image into a pixbuf doing the necessary transformations.
 
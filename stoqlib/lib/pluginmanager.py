@@ -22,15 +22,14 @@
 ## Author(s): Stoq Team <stoq-devel@async.com.br>
 ##
 
-import atexit
 import glob
 import hashlib
 import io
+import json
 import logging
 import os
-import shutil
 import sys
-import tempfile
+import time
 from zipfile import ZipFile, BadZipfile, is_zipfile
 
 from kiwi.desktopparser import DesktopParser
@@ -43,12 +42,16 @@ from stoqlib.domain.plugin import InstalledPlugin, PluginEgg
 from stoqlib.lib.interfaces import IPlugin, IPluginManager
 from stoqlib.lib.kiwilibrary import library
 from stoqlib.lib.message import error
-from stoqlib.lib.osutils import get_system_locale
+from stoqlib.lib.osutils import get_application_dir, get_system_locale
 from stoqlib.lib.settings import get_settings
 from stoqlib.lib.translation import stoqlib_gettext as _
 
 log = logging.getLogger(__name__)
 
+#: Eggs on the cache not used by any execution of stoq for this many
+#: seconds are removed
+_EGGS_CACHE_MAX_AGE = 30 * 24 * 60 * 60
+
 
 class PluginError(Exception):
     pass
@@ -89,11 +92,7 @@ class PluginDescription(object):
         else:
             self.replaces = []
 
-        settings = get_settings()
-        lang = settings.get('user-locale', None)
-        if not lang:
-            lang = get_system_locale()
-
+        lang = get_plugin_locale()
         self.long_name = config.get_locale('Plugin', 'Name', lang)
         self.description = config.get_locale('Plugin', 'Description', lang)
 
@@ -101,6 +100,98 @@ class PluginDescription(object):
     def dirname(self):
         return os.path.dirname(self.filename)
 
+    @classmethod
+    def from_dict(cls, data):
+        """Create a description from the data returned by :meth:`.to_dict`
+
+        This is way faster than parsing the plugin file again.
+        """
+        desc = cls.__new__(cls)
+        desc.__dict__.update(data)
+        return desc
+
+    def to_dict(self):
+        """Get the parsed information of this description
+
+        :returns: a dict that can be serialized as json
+        """
+        return dict(self.__dict__)
+
+
+def get_plugin_locale():
+    """Get the locale used to translate the plugin descriptions"""
+    settings = get_settings()
+    lang = settings.get('user-locale', None)
+    if not lang:
+        lang = get_system_locale()
+    return lang
+
+
+class _PluginDescriptionIndex(object):
+    """An index of the plugin descriptions stored in the application dir
+
+    Parsing the descriptions means opening every plugin file and
+    every egg found on the plugin paths on each startup. The index stores
+    what was parsed, so that only new or modified files need to be read
+    again.
+    """
+
+    def __init__(self, filename):
+        self._filename = filename
+        self._dirty = False
+        self._used = set()
+        self._entries = {}
+        try:
+            with open(filename) as f:
+                self._entries = json.load(f)
+        except (IOError, ValueError):
+            pass
+
+    def get_description(self, filename, is_egg=False, versioned=False):
+        """Get the description of the plugin file
+
+        :param filename: the plugin file or egg
+        :param is_egg: if the file is an egg
+        :param versioned: if the name of the file changes when its content
+            does, like the eggs on the cache. Their modification time is
+            not checked, since it is used to know when they were last used
+        :returns: a :class:`PluginDescription`
+        """
+        self._used.add(filename)
+        st = os.stat(filename)
+        key = [st.st_size, get_plugin_locale()]
+        if not versioned:
+            key.insert(0, st.st_mtime)
+        entry = self._entries.get(filename)
+        if entry is not None and entry['key'] == key:
+            return PluginDescription.from_dict(entry['description'])
+
+        desc = PluginDescription(filename, is_egg)
+        self._entries[filename] = dict(key=key, description=desc.to_dict())
+        self._dirty = True
+        return desc
+
+    def save(self):
+        """Write the index to disk, if something changed"""
+        # Forget about the files that don't exist anymore, like the old
+        # versions of the eggs removed from the cache
+        for filename in list(self._entries):
+            if filename not in self._used and not os.path.exists(filename):
+                del self._entries[filename]
+                self._dirty = True
+
+        if not self._dirty:
+            return
+
+        tmp = self._filename + '.%d' % (os.getpid(), )
+        try:
+            with open(tmp, 'w') as f:
+                json.dump(self._entries, f)
+            os.replace(tmp, self._filename)
+        except (IOError, OSError) as e:
+            log.warning("Could not save the plugin index: %s", e)
+        self._dirty = False
+
 
 @implementer(IPluginManager)
 class PluginManager(object):
@@ -113,6 +204,7 @@ class PluginManager(object):
 
     def __init__(self):
         self._eggs_cache = None
+        self._egg_files = []
         self._reload()
 
     def get_installed_plugins_names(self, store=None):
@@ -161,22 +253,52 @@ class PluginManager(object):
         self._read_plugin_descriptions()
 
     def _create_eggs_cache(self):
-        self._eggs_cache = tempfile.mkdtemp(prefix='stoq', suffix='eggs')
-        log.info("Eggs cache created in %s", self._eggs_cache)
+        # The cache is kept between executions, so that we only need to
+        # transfer the eggs that changed since the last time
+        self._eggs_cache = os.path.join(get_application_dir(), 'eggs')
+        if not os.path.exists(self._eggs_cache):
+            os.makedirs(self._eggs_cache)
+        log.info("Eggs cache in %s", self._eggs_cache)
 
         # Now extract all eggs from the database and put it where stoq know
         # how to load them
+        self._egg_files = []
         default_store = get_default_store()
-        for plugin_egg in default_store.find(PluginEgg):
-            plugin_name = plugin_egg.plugin_name
-            log.info("Creating egg cache for plugin %r" % (plugin_name, ))
-
-            egg_filename = '{}.egg'.format(plugin_name)
-            with open(os.path.join(self._eggs_cache, egg_filename), 'wb') as f:
-                f.write(plugin_egg.egg_content)
+        eggs = default_store.find(PluginEgg).values(PluginEgg.id,
+                                                    PluginEgg.plugin_name,
+                                                    PluginEgg.egg_md5sum)
+        for egg_id, plugin_name, md5sum in list(eggs):
+            content = None
+            if not md5sum:
+                content = default_store.get(PluginEgg, egg_id).egg_content
+                md5sum = hashlib.md5(content).hexdigest()
+
+            # Each version of the egg has its own file name, since other
+            # instances of stoq may have the old one imported right now
+            egg_filename = os.path.join(
+                self._eggs_cache, '{}-{}.egg'.format(plugin_name, md5sum))
+            self._egg_files.append(egg_filename)
+            if os.path.exists(egg_filename):
+                # Mark it as used, so it is not removed below
+                os.utime(egg_filename)
+                continue
 
-        atexit.register(
-            lambda: shutil.rmtree(self._eggs_cache, ignore_errors=True))
+            log.info("Creating egg cache for plugin %r" % (plugin_name, ))
+            if content is None:
+                content = default_store.get(PluginEgg, egg_id).egg_content
+            tmp = egg_filename + '.%d' % (os.getpid(), )
+            with open(tmp, 'wb') as f:
+                f.write(content)
+            # Another instance may be creating the same egg right now
+            os.replace(tmp, egg_filename)
+
+        # Remove the old versions of the eggs and the eggs of plugins that
+        # are not on the database anymore, once nothing used them for a while
+        expired = time.time() - _EGGS_CACHE_MAX_AGE
+        for filename in glob.iglob(os.path.join(self._eggs_cache, '*.egg')):
+            if (filename not in self._egg_files and
+                    os.path.getmtime(filename) < expired):
+                os.unlink(filename)
 
     def _get_external_plugins_paths(self):
         # This is the dir containing stoq/kiwi/stoqdrivers/etc
@@ -190,25 +312,35 @@ class PluginManager(object):
             yield os.path.dirname(os.path.dirname(filename))
 
     def _read_plugin_descriptions(self):
+        index = _PluginDescriptionIndex(
+            os.path.join(get_application_dir(), 'plugins-index.json'))
+
         # Development plugins on the same checkout
-        paths = [os.path.join(library.get_root(), 'plugins')]
+        self._read_plugin_path(index, os.path.join(library.get_root(), 'plugins'))
 
         # Plugins from PluginEgg
-        paths.append(self._eggs_cache)
+        for filename in self._egg_files:
+            self._register_plugin_description(index, filename, is_egg=True,
+                                              versioned=True)
 
+        paths = []
         if library.get_resource_exists('stoq', 'plugins'):
             paths.append(library.get_resource_filename('stoq', 'plugins'))
-
         paths.extend(list(self._get_external_plugins_paths()))
-
         for path in paths:
-            for filename in glob.iglob(os.path.join(path, '*', '*.plugin')):
-                self._register_plugin_description(filename)
-            for filename in glob.iglob(os.path.join(path, '*.egg')):
-                self._register_plugin_description(filename, is_egg=True)
+            self._read_plugin_path(index, path)
 
-    def _register_plugin_description(self, filename, is_egg=False):
-        desc = PluginDescription(filename, is_egg)
+        index.save()
+
+    def _read_plugin_path(self, index, path):
+        for filename in glob.iglob(os.path.join(path, '*', '*.plugin')):
+            self._register_plugin_description(index, filename)
+        for filename in glob.iglob(os.path.join(path, '*.egg')):
+            self._register_plugin_description(index, filename, is_egg=True)
+
+    def _register_plugin_description(self, index, filename, is_egg=False,
+                                     versioned=False):
+        desc = index.get_description(filename, is_egg, versioned)
         self._plugin_descriptions[desc.name] = desc
 
     def _import_plugin(self, plugin_desc):
@@ -144,6 +144,8 @@ class StoqlibSintegraGenerator(object):
 
     def _add_registers(self, state):
         receiving_orders = self._date_query(ReceivingOrder, 'receival_date')
+        receiving_orders = receiving_orders.prefetch(
+            'receiving_invoice.supplier.person')
 
         # 1) Add orders (registry 50)
         for receiving_order in receiving_orders:
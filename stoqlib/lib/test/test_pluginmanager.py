@@ -27,7 +27,10 @@
 
 import contextlib
 import io
+import json
 import os
+import shutil
+import tempfile
 import zipfile
 
 import mock
@@ -40,7 +43,8 @@ from stoqlib.domain.test.domaintest import DomainTest
 from stoqlib.lib.interfaces import IPlugin, IPluginManager
 from stoqlib.lib.pluginmanager import (PluginError, register_plugin,
                                        PluginManager, get_plugin_manager,
-                                       PluginDescription)
+                                       PluginDescription,
+                                       _PluginDescriptionIndex)
 
 plugin_desc = """\
 [Plugin]
@@ -102,6 +106,96 @@ class TestPluginDescription(DomainTest):
         self.assertEqual(desc.long_name, 'Test plugin')
 
 
+class TestPluginDescriptionIndex(DomainTest):
+
+    def test_get_description(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            os.mkdir(os.path.join(tmpdir, 'test'))
+            filename = os.path.join(tmpdir, 'test', 'test.plugin')
+            with open(filename, 'w') as f:
+                f.write(plugin_desc)
+            index_filename = os.path.join(tmpdir, 'index.json')
+
+            index = _PluginDescriptionIndex(index_filename)
+            desc = index.get_description(filename)
+            self.assertEqual(desc.name, 'test')
+            index.save()
+            self.assertTrue(os.path.exists(index_filename))
+
+            # The description should be loaded from the index, without
+            # parsing the file again
+            index = _PluginDescriptionIndex(index_filename)
+            with mock.patch.object(PluginDescription, '__init__') as init:
+                desc = index.get_description(filename)
+                self.assertNotCalled(init)
+            self.assertEqual(desc.name, 'test')
+            self.assertEqual(desc.entry, 'testplugin')
+            self.assertEqual(desc.dependencies, ['test1', 'test2', 'test3'])
+            self.assertEqual(desc.replaces, ['test4'])
+            self.assertEqual(desc.long_name, 'Test plugin')
+            self.assertEqual(desc.dirname, os.path.join(tmpdir, 'test'))
+
+            # Modifying the file should parse it again
+            with open(filename, 'w') as f:
+                f.write(plugin_desc.replace('Module=testplugin',
+                                            'Module=otherplugin'))
+            desc = index.get_description(filename)
+            self.assertEqual(desc.entry, 'otherplugin')
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_get_description_versioned(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            os.mkdir(os.path.join(tmpdir, 'test'))
+            filename = os.path.join(tmpdir, 'test', 'test.plugin')
+            with open(filename, 'w') as f:
+                f.write(plugin_desc)
+            index_filename = os.path.join(tmpdir, 'index.json')
+
+            index = _PluginDescriptionIndex(index_filename)
+            index.get_description(filename, versioned=True)
+            index.save()
+
+            # Marking the file as used should not invalidate its entry
+            os.utime(filename, (0, 0))
+            index = _PluginDescriptionIndex(index_filename)
+            with mock.patch.object(PluginDescription, '__init__') as init:
+                desc = index.get_description(filename, versioned=True)
+                self.assertNotCalled(init)
+            self.assertEqual(desc.entry, 'testplugin')
+
+            # And so the index doesn't need to be written again
+            with mock.patch('stoqlib.lib.pluginmanager.json.dump') as dump:
+                index.save()
+                self.assertNotCalled(dump)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_save_removed_files(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            os.mkdir(os.path.join(tmpdir, 'test'))
+            filename = os.path.join(tmpdir, 'test', 'test.plugin')
+            with open(filename, 'w') as f:
+                f.write(plugin_desc)
+            index_filename = os.path.join(tmpdir, 'index.json')
+
+            index = _PluginDescriptionIndex(index_filename)
+            index.get_description(filename)
+            index.save()
+
+            # The entries of files that don't exist anymore are removed
+            os.unlink(filename)
+            index = _PluginDescriptionIndex(index_filename)
+            index.save()
+            with open(index_filename) as f:
+                self.assertEqual(json.load(f), {})
+        finally:
+            shutil.rmtree(tmpdir)
+
+
 class TestPluginManager(DomainTest):
 
     def setUp(self):
@@ -138,38 +232,63 @@ class TestPluginManager(DomainTest):
     #  Tests
     #
 
+    @mock.patch('stoqlib.lib.pluginmanager.get_application_dir')
     @mock.patch('stoqlib.lib.pluginmanager.get_default_store')
-    def test_create_eggs_cache(self, get_default_store):
+    def test_create_eggs_cache(self, get_default_store, get_application_dir):
         original_eggs_cache = self._manager._eggs_cache
+        original_egg_files = self._manager._egg_files
+        tmpdir = tempfile.mkdtemp()
         try:
             get_default_store.return_value = self.store
+            get_application_dir.return_value = tmpdir
 
             PluginEgg(store=self.store, plugin_name=u'foobar',
                       egg_content=b'lorem',
                       egg_md5sum=u'e194544df936c31ebf9b4c2d4a6ef213')
-            PluginEgg(store=self.store, plugin_name=u'foo',
-                      egg_content=b'ipsum',
-                      egg_md5sum=u'2b3bd636ec90eb39c3c171dd831b8c30')
+            foo = PluginEgg(store=self.store, plugin_name=u'foo',
+                            egg_content=b'ipsum',
+                            egg_md5sum=u'2b3bd636ec90eb39c3c171dd831b8c30')
+            # Without a md5sum, it is calculated from the content
             PluginEgg(store=self.store, plugin_name=u'bar',
-                      egg_content=b'lorem ipsum',
-                      egg_md5sum=u'5f084b7281515082703bd903708c977a')
+                      egg_content=b'lorem ipsum')
 
             self._manager._create_eggs_cache()
             plugins_dir = self._manager._eggs_cache
+            self.assertEqual(plugins_dir, os.path.join(tmpdir, 'eggs'))
 
-            with open(os.path.join(plugins_dir, 'foobar.egg')) as f:
-                self.assertEqual(f.read(), 'lorem')
-
-            with open(os.path.join(plugins_dir, 'foo.egg')) as f:
-                self.assertEqual(f.read(), 'ipsum')
+            def read_egg(filename):
+                with open(os.path.join(plugins_dir, filename)) as f:
+                    return f.read()
 
-            with open(os.path.join(plugins_dir, 'bar.egg')) as f:
-                self.assertEqual(f.read(), 'lorem ipsum')
+            self.assertEqual(
+                read_egg('foobar-e194544df936c31ebf9b4c2d4a6ef213.egg'), 'lorem')
+            self.assertEqual(
+                read_egg('foo-2b3bd636ec90eb39c3c171dd831b8c30.egg'), 'ipsum')
+            self.assertEqual(
+                read_egg('bar-80a751fde577028640c419000e33eba6.egg'), 'lorem ipsum')
 
             self.assertEqual(set(self._manager.egg_plugins_names),
                              {'foobar', 'foo', 'bar'})
+
+            # A new version goes to another file. The old one may still be
+            # in use by other instances, so it is kept for a while
+            foo.egg_content = b'dolor'
+            foo.egg_md5sum = u'a98931d104a7fb8f30450547d97e7ca5'
+            old_egg = os.path.join(plugins_dir,
+                                   'foo-2b3bd636ec90eb39c3c171dd831b8c30.egg')
+            self._manager._create_eggs_cache()
+            self.assertEqual(
+                read_egg('foo-a98931d104a7fb8f30450547d97e7ca5.egg'), 'dolor')
+            self.assertTrue(os.path.exists(old_egg))
+            self.assertNotIn(old_egg, self._manager._egg_files)
+
+            os.utime(old_egg, (0, 0))
+            self._manager._create_eggs_cache()
+            self.assertFalse(os.path.exists(old_egg))
         finally:
             self._manager._eggs_cache = original_eggs_cache
+            self._manager._egg_files = original_egg_files
+            shutil.rmtree(tmpdir)
 
     @mock.patch('stoqlib.lib.webservice.WebService.download_plugin')
     @mock.patch('stoqlib.lib.pluginmanager.new_store')
@@ -24,9 +24,14 @@
 ##
 """ Application uptime"""
 
+import contextlib
+import logging
 import time
 
+log = logging.getLogger(__name__)
+
 _start_time = None
+_phases = []
 
 
 def set_initial():
@@ -41,3 +46,35 @@ def get_uptime():
     if not _start_time:
         return 0.0
     return float(time.time() - _start_time)
+
+
+@contextlib.contextmanager
+def measure_phase(name):
+    """Measure how long a phase of the application startup takes
+
+    >>> with measure_phase('connect'):
+    ...     pass
+
+    :param name: the name of the phase
+    """
+    start = time.time()
+    try:
+        yield
+    finally:
+        _phases.append((name, time.time() - start))
+
+
+def get_phases():
+    """Get the phases measured by :func:`measure_phase`
+
+    :returns: a list of (name, seconds) tuples, in the order they finished
+    """
+    return list(_phases)
+
+
+def log_phases():
+    """Log the timing breakdown of the startup phases"""
+    total = sum(seconds for name, seconds in _phases)
+    log.info("Startup took %.3fs (uptime %.3fs)", total, get_uptime())
+    for name, seconds in sorted(_phases, key=lambda p: -p[1]):
+        log.info("  %-30s %.3fs", name, seconds)
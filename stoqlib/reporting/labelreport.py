@@ -29,6 +29,7 @@ import tempfile
 
 from kiwi.python import strip_accents
 from kiwi.accessor import kgetattr
+from storm.properties import PropertyColumn
 
 from stoqlib.domain.sellable import Sellable
 from stoqlib.lib.parameters import sysparam
@@ -37,20 +38,18 @@ from stoqlib.lib.translation import stoqlib_gettext
 
 _ = stoqlib_gettext
 
+#: How many label models are processed and written at once
+_CHUNK_SIZE = 1000
 
-def _parse_row(sellable, columns):
-    data = []
-    for col in columns:
-        value = kgetattr(sellable, col)
-        if value is None:
-            value = ''
-        elif isinstance(value, str):
-            # XXX: glabels is not working with unicode caracters
-            value = strip_accents(value)
 
-        data.append(value)
+def _parse_value(value):
+    if value is None:
+        value = ''
+    elif isinstance(value, str):
+        # XXX: glabels is not working with unicode caracters
+        value = strip_accents(value)
 
-    return data
+    return value
 
 
 class LabelReport(object):
@@ -61,22 +60,89 @@ class LabelReport(object):
         self.models = models
         self.skip = skip
         self.temp = temp
-        self.rows = []
         columns = sysparam.get_string('LABEL_COLUMNS')
-        columns = columns.split(',')
-        for model in models:
-            for i in range(int(model.quantity)):
-                if not isinstance(model, Sellable):
-                    model = model.sellable
-                self.rows.append(_parse_row(model, columns))
-        # assert False
+        self.columns = columns.split(',')
+
+    #
+    #  Private
+    #
+
+    def _get_chunks(self):
+        chunk = []
+        for model in self.models:
+            quantity = int(model.quantity)
+            if not isinstance(model, Sellable):
+                model = model.sellable
+            chunk.append((model, quantity))
+            if len(chunk) >= _CHUNK_SIZE:
+                yield chunk
+                chunk = []
+
+        if chunk:
+            yield chunk
+
+    def _get_chunk_rows(self, sellables):
+        store = self.store or sellables[0].store
+        ids = list(set(sellable.id for sellable in sellables))
+
+        # Sellable columns are fetched by a single query for the whole
+        # chunk. Anything else (e.g. references) is still fetched with
+        # kgetattr, but only once for each sellable
+        projected = [col for col in self.columns
+                     if isinstance(getattr(Sellable, col, None),
+                                   PropertyColumn)]
+        values = {}
+        if projected:
+            result = store.find(
+                tuple([Sellable.id] +
+                      [getattr(Sellable, col) for col in projected]),
+                Sellable.id.is_in(ids))
+            for row in result:
+                values[row[0]] = dict(zip(projected, row[1:]))
+        if 'price' in self.columns:
+            prices = Sellable.get_prices(store, ids)
+            for sellable_id, price in prices.items():
+                values.setdefault(sellable_id, {})['price'] = price
+
+        rows = {}
+        for sellable in sellables:
+            if sellable.id in rows:
+                continue
+            sellable_values = values.get(sellable.id, {})
+            rows[sellable.id] = [
+                _parse_value(sellable_values[col] if col in sellable_values
+                             else kgetattr(sellable, col))
+                for col in self.columns]
+
+        return rows
+
+    #
+    #  Public API
+    #
+
+    def get_rows(self):
+        """Get the rows of the labels to be printed
+
+        The models are processed in chunks. The data of each sellable
+        is fetched and parsed only once and its row is repeated for
+        each label that should be printed for it.
+
+        :returns: an iterator of rows, one for each label
+        """
+        for chunk in self._get_chunks():
+            rows = self._get_chunk_rows([sellable for sellable, q in chunk])
+            for sellable, quantity in chunk:
+                for i in range(quantity):
+                    yield rows[sellable.id]
 
     def save(self):
         temp_csv = tempfile.NamedTemporaryFile(suffix='.csv', delete=False, mode='w')
         writer = csv.writer(temp_csv, delimiter=',',
                             doublequote=True,
                             quoting=csv.QUOTE_ALL)
-        writer.writerows(self.rows)
+        # The rows are written as they are generated, instead of building
+        # all of them in memory before
+        writer.writerows(self.get_rows())
         temp_csv.close()
 
         template_file = sysparam.get_string('LABEL_TEMPLATE_PATH')
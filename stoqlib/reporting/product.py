@@ -77,6 +77,7 @@ class ProductPriceReport(TableReport):
     """
     title = _("Product Listing")
     filter_format_string = _("on branch <u>%s</u>")
+    projected_columns = ['code', 'description', 'price']
 
     def __init__(self, filename, products, *args, **kwargs):
         branch_name = kwargs.pop('branch_name')
@@ -26,8 +26,9 @@ import platform
 from gi.repository import GdkPixbuf
 from kiwi.accessor import kgetattr
 from kiwi.environ import environ
+from kiwi.python import Settable
 
-from stoqlib.database.runtime import get_default_store
+from stoqlib.database.runtime import StoqlibResultSet, get_default_store
 from stoqlib.lib.template import render_template
 from stoqlib.lib.translation import stoqlib_gettext, stoqlib_ngettext
 from stoqlib.lib.formatters import (get_formatted_price, get_formatted_cost,
@@ -120,6 +121,12 @@ class TableReport(HTMLReport):
 
     Subclasses must implement get_columns and get_row, and can optionaly
     implement accumulate, reset and get_summary_row.
+
+    The data can be a list of objects or a query (a result set). In the
+    latter case, the rows will be fetched from the database in chunks
+    while the report is generated, in the order of the query. If :obj:`.projected_columns` is
+    defined, only those columns will be fetched, instead of the whole
+    objects.
     """
 
     #: The title of the report. Will be present in the header.
@@ -140,6 +147,13 @@ class TableReport(HTMLReport):
     #:
     template_filename = "objectlist.html"
 
+    #: The attributes of the rows used by :meth:`.get_row` and
+    #: :meth:`.accumulate`. When the data is a query and all of them are
+    #: columns of it, only those will be fetched from the database and the
+    #: rows will be :class:`kiwi.python.Settable` with them.
+    #: ``None`` means that the whole objects are needed
+    projected_columns = None
+
     def __init__(self, filename, data, title=None, blocked_records=0,
                  status_name=None, filter_strings=None, status=None):
         self.title = title or self.title
@@ -159,7 +173,10 @@ class TableReport(HTMLReport):
         """ This method build the report title based on the arguments sent
         by SearchBar to its class constructor.
         """
-        rows = len(self.data)
+        if isinstance(self.data, StoqlibResultSet):
+            rows = self.data.count()
+        else:
+            rows = len(self.data)
         total_rows = rows + self.blocked_records
         item = stoqlib_ngettext(self.main_object_name[0],
                                 self.main_object_name[1], total_rows)
@@ -178,12 +195,36 @@ class TableReport(HTMLReport):
                 notes.append(filter_string)
         self.notes = notes
 
+    def _iter_data(self):
+        if not isinstance(self.data, StoqlibResultSet):
+            for obj in self.data:
+                yield obj
+            return
+
+        attributes = self.get_projected_columns()
+        columns = attributes and self.data.get_projection(attributes)
+        for chunk in self.data.fetch_chunks(columns=columns):
+            for obj in chunk:
+                if columns:
+                    obj = Settable(**dict(zip(attributes, obj)))
+                yield obj
+
     def get_data(self):
         self.reset()
-        for obj in self.data:
+        for obj in self._iter_data():
             self.accumulate(obj)
             yield self.get_row(obj)
 
+    def get_projected_columns(self):
+        """Get the attributes of the rows that should be fetched
+
+        By default, this returns :obj:`.projected_columns`.
+
+        :returns: a list of attributes or ``None`` if the whole objects
+            are needed
+        """
+        return self.projected_columns
+
     def accumulate(self, row):
         """This method is called once for each row in the report.
 
@@ -234,6 +275,9 @@ class ObjectListReport(TableReport):
     This report will only show the columns that are visible, in the order they
     are visible. It will also show the filters that were enabled when the report
     was generated.
+
+    When the data is a query, only the values of the visible columns (and
+    the ones in :obj:`.summary`) are fetched from the database, if possible.
     """
 
     #: Defines the columns that should have a summary in the last row of the
@@ -268,6 +312,23 @@ class ObjectListReport(TableReport):
 
         return columns
 
+    def get_projected_columns(self):
+        """Get the attributes of the rows that should be fetched
+
+        Those are the attributes of the visible columns and of the
+        :obj:`.summary`, plus any other defined in :obj:`.projected_columns`.
+        """
+        # Those columns need the whole object to be formatted
+        if any(c.format_func_data is not None for c in self._columns):
+            return None
+
+        attributes = []
+        for attr in ([c.attribute for c in self._columns] + self.summary +
+                     (self.projected_columns or [])):
+            if attr not in attributes:
+                attributes.append(attr)
+        return attributes
+
     def get_cell(self, obj, column):
         #XXX Maybe the default value should be ''
         return column.as_string(kgetattr(obj, column.attribute, None), obj)
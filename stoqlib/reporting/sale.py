@@ -106,6 +106,8 @@ class SoldItemsByBranchReport(ObjectListReport):
     """
     title = _("Sold Items by Branch Report")
     summary = ['quantity', 'total']
+    # Used by accumulate to summarize the values by branch
+    projected_columns = ['branch_name']
     template_filename = 'sale/sold_items_by_branch.html'
 
     def reset(self):
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+# vi:si:et:sw=4:sts=4:ts=4
+
+##
+## Copyright (C) 2016 Stoq Tecnologia <http://stoq.link>
+## All rights reserved
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU Lesser General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU Lesser General Public License
+## along with this program; if not, write to the Free Software
+## Foundation, Inc., or visit: http://www.gnu.org/.
+##
+## Author(s): Stoq Team <stoq-devel@async.com.br>
+##
+
+
+from decimal import Decimal
+
+from kiwi.python import Settable
+
+from stoqlib.domain.test.domaintest import DomainTest
+from stoqlib.reporting.labelreport import LabelReport
+
+
+class TestLabelReport(DomainTest):
+    def test_get_rows(self):
+        sellable1 = self.create_sellable(price=10, description=u'Café',
+                                         code=u'1')
+        sellable1.product.brand = u'Brand'
+        sellable2 = self.create_sellable(price=20, description=u'Tea',
+                                         code=u'2')
+        models = [Settable(sellable=sellable1, quantity=Decimal(2)),
+                  Settable(sellable=sellable2, quantity=Decimal(1)),
+                  Settable(sellable=sellable1, quantity=Decimal(1))]
+
+        columns = u'code,description,price,product.brand'
+        with self.sysparam(LABEL_COLUMNS=columns):
+            report = LabelReport(None, models, store=self.store)
+
+        self.assertEqual(list(report.get_rows()), [
+            [u'1', u'Cafe', Decimal(10), u'Brand'],
+            [u'1', u'Cafe', Decimal(10), u'Brand'],
+            [u'2', u'Tea', Decimal(20), u''],
+            [u'1', u'Cafe', Decimal(10), u'Brand']])